@@ -32,30 +32,160 @@ Examples:
   ~$ ./prog_name --minutes 3 --seconds -44 --milliseconds -378 -num 2 -t ass
   # read a srt file from 'file_sub.srt' to 'newfile.srt':
   ~$ ./prog_name -t srt -M -1 -S 4 -i film_sub.srt -o newfile.srt
+  # shift all the srt files in 'season1' writing them in 'fixed':
+  ~$ ./prog_name -t srt -S 2 -D fixed --batch 'season1/*.srt'
+  # the same for all the subtitles in the 'library' tree:
+  ~$ ./prog_name -S 2 -D fixed -R library
+  # the second example, from Python (see transform()):
+  >>> csub.transform(pathlib.Path('film_sub.srt'),
+  ...                pathlib.Path('newfile.srt'), 'srt', shift=-56)
 """.format(VERSION)
 
 #################
 # I M P O R T S #
 #################
 
+import array
 import atexit
-import argparse
+import bisect
 import codecs
+import collections
+import contextlib
+import copy
+from fractions import Fraction
+import functools
+import io
 import itertools
 import math
+import mmap
 import operator
 import os
 import re
-from string import Template
+import struct
 import sys
-import tempfile
+import time
+import unicodedata
 import warnings
+# the modules needed only by the command line, the batch modes,
+# the temp files, the cue index, the library API and the follow mode
+# (argparse, concurrent.futures, ctypes, datetime, glob, hashlib, json,
+# select, signal, socket and tempfile) are imported where used, for a
+# faster startup
+numpy = None # imported by load_numpy(), see --numpy
+_numpy_loaded = False
 
 #############
 # CONSTANTS #
 #############
 
 OPT_RANGE = ':'
+# subtitle type by file extension, for the recursive mode
+EXT_TYPES = {'.srt': 'srt', '.ass': 'ass', '.ssa': 'ssa', '.sub': 'sub'}
+TYPE_ALIASES = {'ssa': 'ass', 'microdvd': 'sub'}
+MANIFEST_NAME = '.csub-manifest'
+# bounds for the subtitle type detection
+SNIFF_LINES = 100
+SNIFF_SIZE = 16384
+SNIFF_ASS = re.compile(r'^\ufeff?\s*(\[Script Info\]|\[V4\+? Styles\]'
+                       r'|\[Events\]|Dialogue:)')
+SNIFF_SRT = re.compile(r'^\s*-?\d+:\d{2}:\d{2},\d{3}\s*-->')
+SNIFF_MICRODVD = re.compile(r'^\ufeff?\{-?\d+\}\{-?\d+\}')
+# layout of the fixed-width time fields for the NumPy backend:
+# SRT time lines ('00:00:00,000 --> 00:00:00,000\n'), ASS start+end
+# times ('0:00:00.000:00:00.00') and srt index numbers
+SRT_DIGIT_COLS = [0, 1, 3, 4, 6, 7, 9, 10, 11,
+                  17, 18, 20, 21, 23, 24, 26, 27, 28]
+SRT_SEP_COLS = [2, 5, 8, 12, 13, 14, 15, 16, 19, 22, 25, 29]
+SRT_SEPS = list(b'::, --> ::,\n')
+SRT_NUMBERS = re.compile(r'-?\d+(\n-?\d+)*')
+ASS_DIGIT_COLS = [0, 2, 3, 5, 6, 8, 9, 10, 12, 13, 15, 16, 18, 19]
+ASS_SEP_COLS = [1, 4, 11, 14]
+ASS_SEPS = list(b'::::')
+# cue parsing (iter_cues), on the raw (undecoded) lines
+CUE_NUMBER = re.compile(rb'\s*(-?\d+)\s*')
+CUE_SRT_TIME = re.compile(rb'\s*(-?\d+):(\d{2}):(\d{2}),(\d{3})\s*-->'
+                          rb'\s*(-?\d+):(\d{2}):(\d{2}),(\d{3})(.*)')
+CUE_ASS_EVENT = re.compile(rb'(Dialogue: *-?\d+),'
+                           rb'(-?\d+):(\d{2}):(\d{2})([:.])(\d{2}),'
+                           rb'(-?\d+):(\d{2}):(\d{2})([:.])(\d{2}),'
+                           rb'((?:[^,]*,){6})(.*)')
+CUE_MICRODVD = re.compile(rb'\{(-?\d+)\}\{(-?\d+)\}(.*)')
+# cue index sidecar (--index): file suffix, header (magic, subtitle
+# type, codec, size and mtime of the file, hash, number of cues), the
+# patterns of the cues in the mapped file (strict, as in safe mode),
+# the ASCII bytes which are spaces once decoded and the copy buffer
+INDEX_SUFFIX = '.csubidx'
+INDEX_MAGIC = b'CSUBIDX2'
+INDEX_HEADER = struct.Struct('<8s4s32sQQ16sQ')
+INDEX_SRT_BLOCK = re.compile(
+    rb'((-?\d+)[ \t\f\v\r]*\n'
+    rb'[ \t\f\v]*(-?\d+):(\d{2}):(\d{2}),(\d{3})[ \t\f\v]*-->'
+    rb'[ \t\f\v]*(-?\d+):(\d{2}):(\d{2}),(\d{3})[^\n]*(?:\n|\Z)'
+    rb'((?:[ \t\f\v\r]*\S[^\n]*(?:\n|\Z))*)[ \t\f\v\r]*(?:\n|\Z))')
+INDEX_ASS_EVENT = re.compile(rb'\nDialogue: \d+,(\d):(\d{2}):(\d{2})[:.](\d{2}),'
+                             rb'(\d):(\d{2}):(\d{2})[:.](\d{2}),')
+INDEX_ASS_LINE = re.compile(rb'\nDialogue:')
+INDEX_MICRODVD = re.compile(rb'(\{(\d+)\}\{(\d+)\}[^\n]*(?:\n|\Z))')
+INDEX_SPACES = (b'\x1c', b'\x1d', b'\x1e', b'\x1f') # ASCII, but str.isspace()
+COPY_BUFSIZE = 1024 * 1024
+# output chunks size (--buffer-size) and lines gathered at once
+OUTPUT_BUFSIZE = 64 * 1024
+OUTPUT_BATCH = 256
+# --follow: first and max interval (secs) between the checks of the
+# input file, doubled while it doesn't change (inotify events, where
+# available, end the wait earlier)
+FOLLOW_POLL = 0.05
+FOLLOW_MAX_POLL = 1.0
+# inotify events watched by FileWatcher: IN_MODIFY, IN_ATTRIB,
+# IN_CLOSE_WRITE, IN_DELETE_SELF and IN_MOVE_SELF
+INOTIFY_MASK = 0x002 | 0x004 | 0x008 | 0x400 | 0x800
+# --sync-to: the framerates (any pair of them is a framerate change
+# tried), the seconds per sample of the speech signals cross-correlated
+# with NumPy or with the (slower) pure Python FFT and the precision of
+# the estimated shift (ms), refined for the framerate changes with
+# the highest correlations
+SYNC_FRAMERATES = ('23.976', '24', '25', '29.97')
+SYNC_STEP = 0.1
+SYNC_STEP_PURE = 0.5
+SYNC_PRECISION = 1
+SYNC_CANDIDATES = 3
+# range keys found scanning the rest of the input (--copy-tail): any
+# line made of a number for srt (a superset of the block numbers),
+# the start time of ass events and the start frame of microdvd lines
+# (starting with the newline before the line, faster to search)
+TAIL_SRT = re.compile(rb'\n[ \t]*([-+]?\d+)[ \t\r]*$', re.M)
+TAIL_ASS = re.compile(rb'\nDialogue:[^,\n]*,[ \t]*(-?\d+):(\d+):(\d+)')
+TAIL_MICRODVD = re.compile(rb'\n\{(-?\d+)\}')
+# zero-padded numbers, to format the time fields (see srt_time)
+DIGITS_2 = tuple('{:02d}'.format(n) for n in range(100))
+DIGITS_3 = tuple('{:03d}'.format(n) for n in range(1000))
+# encoding detection (-e auto): BOMs (longest first), the candidates
+# tried, in order of preference, and the size of the sample used.
+ENCODING_AUTO = 'auto'
+ENCODING_BOMS = ((codecs.BOM_UTF32_LE, 'utf-32'),
+                 (codecs.BOM_UTF32_BE, 'utf-32'),
+                 (codecs.BOM_UTF8, 'utf-8-sig'),
+                 (codecs.BOM_UTF16_LE, 'utf-16'),
+                 (codecs.BOM_UTF16_BE, 'utf-16'))
+ENCODING_CANDIDATES = ('utf-8', 'iso-2022-jp', 'cp932',
+                       'cp1253', 'iso-8859-7', 'iso-8859-15')
+ENCODING_SAMPLE = 65536
+# options not affecting the output of a single file
+FINGERPRINT_EXCLUDE = ('batch', 'buffer_size', 'copy_tail', 'follow', 'info',
+                       'infile', 'is_warn', 'jobs', 'live', 'max_tasks',
+                       'outfile', 'output_dir', 'recursive', 'same_file',
+                       'serve', 'serve_root', 'socket', 'subtitle_type',
+                       'tempdir', 'timeout', 'use_index', 'use_mmap',
+                       'use_numpy')
+# options which can't be given to the library API (see Transformer)
+# and the number of Transformer objects kept by transform()
+TRANSFORM_EXCLUDE = ('batch', 'follow', 'info', 'infile', 'jobs', 'live',
+                     'max_tasks', 'outfile', 'output_dir', 'recursive',
+                     'same_file', 'serve', 'serve_root', 'socket',
+                     'subtitle_type', 'sync_to', 'tempdir', 'timeout')
+TRANSFORM_CACHE = 64
+# the only options of the --serve mode (the others are given by the jobs)
+SERVE_OPTIONS = ('info', 'jobs', 'serve', 'serve_root', 'socket')
 
 #####################
 # F U N C T I O N S #
@@ -89,6 +219,241 @@ def iterdec (multicall=False):
 def get_stretch (s):
     return [(int(x) if x else 0) for x in s.strip().split(':')]
 
+def parse_seconds (value):
+    """
+    Returns the seconds (a Fraction) of *value*, a number or a string
+    of seconds or [[H:]M:]S[.fff] (',' is a decimal separator too).
+    """
+    if not isinstance(value, str):
+        return Fraction(str(value) if isinstance(value, float) else value)
+    value = value.strip().replace(',', '.')
+    seconds = 0
+    for field in value.lstrip('+-').split(':'):
+        seconds = seconds * 60 + Fraction(field)
+    return -seconds if value.startswith('-') else seconds
+
+def get_anchors (values):
+    """
+    Returns the lists of the pairs (original time, target time) and
+    (cue number, target time) of the --anchors *values*, 'ORIG=TARGET'
+    strings or (orig, target) pairs, where ORIG is a cue number if it
+    starts with '#' (times in seconds, see parse_seconds).
+    Raise OptionError if some of them are invalid.
+    """
+    times, cues = [], []
+    for value in values:
+        try:
+            orig, target = (value.split('=') if isinstance(value, str)
+                            else value)
+            target = parse_seconds(target)
+            if isinstance(orig, str) and orig.strip().startswith('#'):
+                cues.append((int(orig.strip()[1:]), target))
+            else:
+                times.append((parse_seconds(orig), target))
+        except (TypeError, ValueError, ZeroDivisionError) as e:
+            raise OptionError('invalid --anchors value: {!r} [{}]'.format(
+                value, e))
+    return times, cues
+
+def seconds_to_units (seconds, per_second):
+    """
+    Returns the integer time units (*per_second* in a second) nearest
+    to *seconds* (a Fraction), rounding half up.
+    """
+    return math.floor(seconds * per_second + Fraction(1, 2))
+
+def merge_intervals (intervals):
+    """
+    Returns the sorted list of the disjoint (start, end) intervals
+    covering the same times of *intervals* (the empty ones dropped).
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+def overlap_function (reference, intervals, ratio=1, np=None):
+    """
+    Returns the function of an offset (secs) giving the total time in
+    common between the *reference* intervals and the *intervals* scaled
+    by *ratio* and then shifted by the offset (both lists as returned
+    by merge_intervals), vectorized if *np* (the numpy module) is given.
+    """
+    if np is not None:
+        starts, ends = np.array(reference).T
+        lengths = ends - starts
+        before = np.concatenate(([0.0], np.cumsum(lengths)))
+        bounds = np.array(intervals) * ratio
+        def covered (times):
+            # reference time before *times*
+            found = np.searchsorted(starts, times, 'right')
+            i = np.maximum(found - 1, 0)
+            return np.where(found > 0, before[i] + np.minimum(
+                times - starts[i], lengths[i]), 0.0)
+        return lambda offset: float((covered(bounds[:, 1] + offset)
+                                     - covered(bounds[:, 0] + offset)).sum())
+    def overlap (offset):
+        total = 0
+        i, n = 0, len(reference)
+        for start, end in intervals:
+            start, end = start * ratio + offset, end * ratio + offset
+            while i < n and reference[i][1] <= start:
+                i += 1
+            j = i
+            while j < n and reference[j][0] < end:
+                total += (min(end, reference[j][1])
+                          - max(start, reference[j][0]))
+                j += 1
+        return total
+    return overlap
+
+def occupancy (intervals, step, size, ratio=1, np=None):
+    """
+    Returns the occupancy signal of the *intervals* (in seconds, scaled
+    by *ratio*): *size* samples, *step* seconds apart, 1 if the sample
+    is in an interval, otherwise 0. A numpy array if *np* (the numpy
+    module) is given, otherwise a list.
+    """
+    scale = ratio / step
+    if np is not None:
+        bounds = np.array(intervals, dtype=float).reshape(-1, 2) * scale
+        bounds = np.clip(np.ceil(bounds - 0.5), 0, size).astype(np.intp)
+        diff = np.zeros(size + 1)
+        np.add.at(diff, bounds[:, 0], 1)
+        np.add.at(diff, bounds[:, 1], -1)
+        return (np.cumsum(diff[:-1]) > 0).astype(float)
+    signal = [0.0] * size
+    for start, end in intervals:
+        first = min(max(math.ceil(start * scale - 0.5), 0), size)
+        last = min(max(math.ceil(end * scale - 0.5), 0), size)
+        signal[first:last] = [1.0] * (last - first)
+    return signal
+
+def fft (values, inverse=False):
+    """
+    Returns the discrete Fourier transform (or the inverse one, not
+    normalized) of the complex *values*, a list whose length is a
+    power of two (iterative radix-2 FFT, used if NumPy is missing).
+    """
+    n = len(values)
+    out = list(values)
+    j = 0
+    for i in range(1, n): # bit-reversal permutation
+        bit = n >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j |= bit
+        if i < j:
+            out[i], out[j] = out[j], out[i]
+    angle = (2 if inverse else -2) * math.pi / n
+    roots = [complex(math.cos(angle * k), math.sin(angle * k))
+             for k in range(n // 2)]
+    size = 2
+    while size <= n:
+        half = size // 2
+        twiddles = roots[::n // size]
+        if half < n // size: # many small blocks: by twiddle factor
+            for k, w in enumerate(twiddles):
+                evens = out[k::size]
+                odds = [x * w for x in out[k + half::size]]
+                out[k::size] = [a + b for a, b in zip(evens, odds)]
+                out[k + half::size] = [a - b for a, b in zip(evens, odds)]
+        else:
+            for start in range(0, n, size):
+                middle, stop = start + half, start + size
+                evens = out[start:middle]
+                odds = [x * w for x, w in zip(out[middle:stop], twiddles)]
+                out[start:middle] = [a + b for a, b in zip(evens, odds)]
+                out[middle:stop] = [a - b for a, b in zip(evens, odds)]
+        size *= 2
+    return out
+
+def correlation_peaks (reference, signals, np=None):
+    """
+    Returns the list of the pairs (lag, value) of the maxima of the
+    cross-correlations of the *reference* signal with each one of the
+    *signals* (see occupancy): moving the signal ahead by lag samples
+    gives value samples in common with the reference, the most.
+    Computed through the FFT, numpy's if *np* is given, else fft().
+    """
+    size = 1 << (len(reference) + max(map(len, signals))).bit_length()
+    peaks = []
+    if np is not None:
+        spectrum = np.fft.rfft(reference, size)
+        for signal in signals:
+            corr = np.fft.irfft(
+                spectrum * np.fft.rfft(signal, size).conj(), size)
+            lag = int(corr.argmax())
+            peaks.append((lag, float(corr[lag])))
+    else:
+        spectrum = fft(reference + [0.0] * (size - len(reference)))
+        # two signals x, y at once, as x + iy: with Z its spectrum,
+        # conj(X) + i*conj(Y) is Z at -k, and both correlations are real
+        for first in range(0, len(signals), 2):
+            pair = signals[first:first + 2]
+            mixed = fft([complex(x, y) for x, y in itertools.zip_longest(
+                *(pair + [[]])[:2], fillvalue=0.0)] + [0j] * (size - max(map(len, pair))))
+            corr = fft([a * mixed[-k] for k, a in enumerate(spectrum)],
+                       inverse=True)
+            for values in ([c.real for c in corr],
+                           [c.imag for c in corr])[:len(pair)]:
+                value = max(values)
+                peaks.append((values.index(value), value / size))
+    return [(lag if lag < len(reference) else lag - size, value)
+            for lag, value in peaks]
+
+def find_sync (reference, intervals, np=None):
+    """
+    Returns the triple (framerate, shift, overlap) syncing the speech
+    *intervals* to the *reference* ones (in seconds, both as returned
+    by merge_intervals): the framerate change, an (old, new) pair of
+    SYNC_FRAMERATES or None, and the shift (seconds, a Fraction,
+    added before changing the framerate, see Subtitle.compile_times)
+    giving the most speech in common, *overlap* (the fraction of the
+    shortest speech, 0..1). The speech signals are cross-correlated
+    (see correlation_peaks) for each framerate change, then the shift
+    of the SYNC_CANDIDATES changes with the highest peaks is refined
+    (up to SYNC_PRECISION ms) on the intervals, keeping the best one.
+    """
+    step = SYNC_STEP if np is not None else SYNC_STEP_PURE
+    candidates = [(None, Fraction(1))] + [
+        ((float(old), float(new)), Fraction(new) / Fraction(old))
+        for old, new in itertools.permutations(SYNC_FRAMERATES, 2)]
+    ref_signal = occupancy(reference, step,
+                           math.ceil(reference[-1][1] / step) + 1, 1, np)
+    signals = [occupancy(intervals, step,
+                         math.ceil(intervals[-1][1] * ratio / step) + 1,
+                         float(ratio), np)
+               for _, ratio in candidates]
+    peaks = correlation_peaks(ref_signal, signals, np)
+    results = []
+    for i in sorted(range(len(candidates)), key=lambda i: -peaks[i][1])[
+            :SYNC_CANDIDATES]:
+        framerate, ratio = candidates[i]
+        # offsets in ms, the nearest ones first on ties
+        offset = spacing = round(step * 1000)
+        offset *= peaks[i][0]
+        overlap = overlap_function(reference, intervals, float(ratio), np)
+        while spacing > SYNC_PRECISION:
+            spacing = max(spacing // 10, SYNC_PRECISION)
+            offset = max(sorted(range(offset - 10 * spacing,
+                                      offset + 11 * spacing, spacing),
+                                key=lambda ms: abs(ms - offset)),
+                         key=lambda ms: overlap(ms / 1000))
+        results.append((overlap(offset / 1000), -i, framerate, ratio, offset))
+    common, _, framerate, ratio, offset = max(results)
+    speech = min(sum(end - start for start, end in reference),
+                 sum(end - start for start, end in intervals) * ratio)
+    shift = Fraction(round(offset / ratio), 1000)
+    return framerate, shift, min(common / float(speech), 1.0)
+
 def numslice(n, i, keep_sign=False):
     '''
     Return the slice of the *i* most significant digs of *n*
@@ -114,6 +479,264 @@ def skip_bytes(stream, nbytes):
     """Read nbytes from stream and return them."""
     return stream.read(nbytes)
 
+def sniff_type (stream, max_lines=SNIFF_LINES, max_size=SNIFF_SIZE):
+    """
+    Guess the subtitle type looking at most at the first *max_lines*
+    lines (or *max_size* characters) of the text *stream*.
+    Return a pair (type, lines) where type is 'srt', 'ass', 'sub'
+    or None if unknown and lines is an iterator over all the lines
+    of *stream*, the ones already read included, so nothing is read
+    twice (works on non-seekable streams too).
+    """
+    read = []
+    size = 0
+    subtype = None
+    while len(read) < max_lines and size < max_size:
+        line = stream.readline()
+        if not line:
+            break
+        read.append(line)
+        size += len(line)
+        if SNIFF_ASS.match(line):
+            subtype = 'ass'
+        elif SNIFF_SRT.match(line):
+            subtype = 'srt'
+        elif SNIFF_MICRODVD.match(line):
+            subtype = 'sub'
+        else:
+            continue
+        break
+    return subtype, itertools.chain(read, stream)
+
+def split_units (units, per_second):
+    """
+    Returns a tuple of integers (hour, minutes, secs, units) from
+    a time expressed in time units, *per_second* units in a second.
+    """
+    secs, units = divmod(units, per_second)
+    mins, secs = divmod(secs, 60)
+    hour, mins = divmod(mins, 60)
+    return hour, mins, secs, units
+
+def srt_time (hour, mins, secs, ms):
+    """
+    Returns the SubRip time string of the integer fields, the same
+    as '{:02d}:{:02d}:{:02d},{:03d}'.format(...), built from the
+    DIGITS tables (*mins*, *secs* and *ms* must be in their range).
+    """
+    return ''.join((DIGITS_2[hour] if 0 <= hour < 100
+                    else '{:02d}'.format(hour),
+                    ':', DIGITS_2[mins], ':', DIGITS_2[secs],
+                    ',', DIGITS_3[ms]))
+
+def ass_time (hour, mins, secs, hndrs, sep):
+    """
+    Returns the SubStation Alpha time string of the integer fields,
+    the same as '{:d}:{:02d}:{:02d}{sep}{:02d}'.format(...).
+    """
+    return ''.join((str(hour), ':', DIGITS_2[mins], ':', DIGITS_2[secs],
+                    sep, DIGITS_2[hndrs]))
+
+def raw_lines (file, encoding):
+    """
+    Iterate over the lines of the binary *file*, yielding pairs
+    (line_number, line) with the line's terminator removed.
+    Returns the name of the codec to use for decoding the lines
+    (no BOM is expected after the first line), removing the
+    UTF-8 BOM if *encoding* is utf-8-sig.
+    """
+    codec = codecs.lookup(encoding).name
+    bom = codecs.BOM_UTF8 if codec == 'utf-8-sig' else None
+    for numline, line in enumerate(file, 1):
+        if bom and numline == 1 and line.startswith(bom):
+            line = line[len(bom):]
+        yield numline, line.rstrip(b'\r\n')
+
+def cue_codec (encoding):
+    """Returns the codec used for decoding a single cue's text."""
+    codec = codecs.lookup(encoding).name
+    return 'utf-8' if codec == 'utf-8-sig' else codec
+
+def is_ascii_compatible (encoding):
+    """
+    True if the subtitle's syntax (digits, separators, line endings...)
+    is encoded as ASCII by *encoding*, so files can be parsed as bytes.
+    """
+    sample = '\r\n-0123456789:,.{}Dialogue'
+    return (sample.encode(cue_codec(encoding), 'replace')
+            == sample.encode('ascii'))
+
+def is_lf_only (data):
+    """
+    True if the bytes *data* (a whole file) are lines ended by LF only,
+    the last one too, as the subtitles are written: so the bytes of
+    the file can be copied unchanged along with the processed ones
+    (CRLF or CR line endings, or a missing final newline, would not
+    be the same as processing the whole file).
+    """
+    return not data or (data[-1:] == b'\n' and data.find(b'\r') < 0)
+
+@contextlib.contextmanager
+def mapped_file (file):
+    """
+    Context manager returning a read-only memory map of the whole
+    binary *file* (or an empty bytes object if the file is empty).
+    """
+    if not os.fstat(file.fileno()).st_size:
+        yield b''
+        return
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield data
+
+def hms_units (times, per_second):
+    """
+    Returns the list of the times (in units, *per_second* units in
+    a second) of the tuples *times* of bytes (hours, minutes, seconds,
+    units), as captured by a pattern.
+    """
+    return [((int(hour) * 60 + int(mins)) * 60 + int(secs)) * per_second
+            + int(units) for hour, mins, secs, units in times]
+
+def load_numpy ():
+    """
+    Returns the numpy module, imported on the first call,
+    or None if NumPy is not available (see --numpy).
+    """
+    global numpy, _numpy_loaded
+    if not _numpy_loaded:
+        _numpy_loaded = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+def file_digest (path):
+    """Returns the hash (used by the cue index) of the file *path*."""
+    import hashlib
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFSIZE), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+def copy_bytes (src, dst, start, stop):
+    """
+    Copy the bytes from *start* to *stop* of the binary file *src*
+    to the binary file *dst* (flushed first) using, if possible for
+    these files, os.copy_file_range or os.sendfile, otherwise in chunks.
+    """
+    dst.flush()
+    copies = []
+    try:
+        fd_in, fd_out = src.fileno(), dst.fileno()
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        pass
+    else:
+        if hasattr(os, 'copy_file_range'):
+            copies.append(
+                lambda size: os.copy_file_range(fd_in, fd_out, size, start))
+        if hasattr(os, 'sendfile'):
+            copies.append(
+                lambda size: os.sendfile(fd_out, fd_in, start, size))
+    for copy in copies:
+        try:
+            while start < stop:
+                copied = copy(min(COPY_BUFSIZE * 64, stop - start))
+                if not copied:
+                    break
+                start += copied
+            return
+        except OSError:
+            continue # not supported for these files, try another way
+    src.seek(start)
+    while start < stop:
+        chunk = src.read(min(COPY_BUFSIZE, stop - start))
+        if not chunk:
+            break
+        dst.write(chunk)
+        start += len(chunk)
+
+def _decode_penalty (text):
+    """
+    Return a number measuring how much *text* looks like the result
+    of a decoding made with the wrong codec: control, private and
+    unassigned characters, half-width katakana and words mixing
+    different scripts (e.g. greek letters in a latin word).
+    """
+    penalty = 0
+    for char in re.findall(r'[^\t\n\r\x0c\x20-\x7e]', text):
+        if unicodedata.category(char) in ('Cc', 'Co', 'Cn'):
+            penalty += 10
+    for word in re.findall(r'[^\W\d_]+', text):
+        if word.isascii():
+            continue
+        scripts = set()
+        for char in word:
+            if char.isascii():
+                scripts.add('LATIN')
+                continue
+            script = unicodedata.name(char, 'UNKNOWN').split()[0]
+            if script == 'HALFWIDTH':
+                penalty += 1
+            elif script in ('HIRAGANA', 'KATAKANA', 'CJK'):
+                script = 'CJK'
+            scripts.add(script)
+        penalty += len(scripts) - 1
+    return penalty
+
+def detect_encoding (sample, candidates=ENCODING_CANDIDATES):
+    """
+    Return the name of the encoding which better decodes
+    the bytes in *sample* (usually the beginning of a file).
+    Byte order marks are checked first, then *candidates* are tried
+    in order using incremental decoders (so a multibyte sequence
+    truncated at the end of the sample isn't an error), choosing
+    the one with the smaller _decode_penalty().
+    Raise LookupError if no candidate can decode *sample*.
+    """
+    for bom, encoding in ENCODING_BOMS:
+        if sample.startswith(bom):
+            return encoding
+    best = None
+    for encoding in candidates:
+        decoder = codecs.getincrementaldecoder(encoding)('strict')
+        try:
+            text = decoder.decode(sample, final=False)
+        except UnicodeDecodeError:
+            continue
+        penalty = _decode_penalty(text)
+        if best is None or penalty < best[0]:
+            best = penalty, encoding
+        if not penalty:
+            break
+    if best is None:
+        raise LookupError("can't detect the encoding (tried {})".format(
+            ', '.join(candidates)))
+    return best[1]
+
+def open_input (path, encoding, errors='strict'):
+    """
+    Open *path* (or the stdin, if None) for reading as text, with the
+    given *encoding* and *errors*. If *encoding* is ENCODING_AUTO, it
+    is detected from the first ENCODING_SAMPLE bytes, which are read
+    only once (non-seekable streams are fine too).
+    """
+    if encoding != ENCODING_AUTO:
+        if path is None:
+            return sys.stdin
+        return open(path, 'r', encoding=encoding, errors=errors)
+    raw = sys.stdin.buffer if path is None else open(path, 'rb')
+    sample = raw.read(ENCODING_SAMPLE)
+    try:
+        encoding = detect_encoding(sample)
+    except LookupError:
+        if path is not None:
+            raw.close()
+        raise
+    return io.TextIOWrapper(io.BufferedReader(PrefixReader(sample, raw)),
+                            encoding=encoding, errors=errors)
+
 def TempFileManager (methods):
     """Decorator for temp files."""
     def inner1 (cls):
@@ -131,6 +754,7 @@ def TempFileManager (methods):
 
 def get_parser():
     """Return an argparse's parser object."""
+    import argparse
     parser = argparse.ArgumentParser()
     parser.add_argument("--info", dest="info", action="store_true",
                         help="print informations about the program and exit.")
@@ -144,7 +768,10 @@ def get_parser():
         Must match the input file's encoding (default to utf-8-sig).
         If you want to get rid of the BOM in such a marked files use
         a bare 'utf-8' codec and the -s/--skip option (like -e utf-8 -s1)
-        to delete it.""")
+        to delete it. Use 'auto' to detect the input encoding (from the
+        BOM or trying some common encodings on the first bytes of the
+        file), the output (to the -o file or to the stdout) is written
+        with the same encoding.""")
     io_parser.add_argument("-E", "--encode-error",
         dest='enc_err', default='strict', metavar="NAME",
         choices=('strict', 'replace', 'ignore'), help="""
@@ -169,7 +796,9 @@ def get_parser():
     io_parser.add_argument("-t", "--type",
         dest="subtitle_type", metavar="TYPE",
         choices=('ass','ssa', 'srt', 'sub','microdvd'),
-        help="subtitle file type: (ass|ssa, srt, sub|microdvd).")
+        help="""subtitle file type: (ass|ssa, srt, sub|microdvd).
+        If omitted, the type is detected from the first lines of
+        the input.""")
     # subtiles options
     s_parser = parser.add_argument_group('Subtitle Options')
     srt_parser = parser.add_argument_group('Subrip (*.srt) Specific Options')
@@ -219,6 +848,25 @@ def get_parser():
             in milliseconds, for microDVD subtitle (*.sub) are understood
             as the number of frames to shift, while with SubStation Alpha
             subtitles (*.ass, *.ssa) are understood as centiseconds.""")
+    s_parser.add_argument("--anchors",
+        dest="anchors", nargs='+', metavar="ORIG=TARGET", help="""
+        resync the subtitle in a single pass through the given pairs of
+        times (in seconds or as [[H:]M:]S[.fff]): every time is moved
+        along the line joining the anchors around it (piecewise-linear
+        mapping), before the first and after the last anchor it's
+        shifted as the nearest one. For SubRip subtitles ORIG can be a
+        cue number, as #N: the cue's start time, read ahead in the
+        input. Conflicts with the other time options (-H, -M, -S, -m,
+        --stretch, -c and -f).""")
+    s_parser.add_argument("--sync-to",
+        dest="sync_to", metavar="REFERENCE", help="""
+        sync the input to the REFERENCE subtitle file, e.g. one already
+        synced to the video (even in another language or format): the
+        framerate change (between any of {}) and the shift matching
+        the most the times of the cues of both files are estimated and
+        applied, as with -c and the time options (printed with -w).
+        Requires a -i/--input-file or -O/--same-file, conflicts with
+        the other time options and -s.""".format(', '.join(SYNC_FRAMERATES)))
     ## srt
     srt_parser.add_argument("-B", "--back-to-the-block",
         action="store_true", dest="unsafe_number_mode", default=False,
@@ -257,12 +905,114 @@ def get_parser():
     mdv_parser.add_argument("-F", "--frames",
         type=int, default=25, dest="frames", metavar="NUMBER",
         help="movie's frame rate (eg. 25, 29.97, 23.976) (default: 25.")
+    # batch options
+    b_parser = parser.add_argument_group('Batch Options')
+    b_parser.add_argument("--batch",
+        dest="batch", nargs='+', metavar="FILE", help="""
+        process all the given FILEs (shell-style wildcards are expanded)
+        using the same options, in parallel. Conflicts with -i, -o and -O,
+        requires -D/--output-dir.""")
+    b_parser.add_argument("-R", "--recursive",
+        dest="recursive", metavar="PATH", help="""
+        process all the subtitles found in the PATH directory tree,
+        writing them in the same relative position under -D/--output-dir.
+        The subtitle type is chosen by the file extension (.srt, .ass,
+        .ssa, .sub), only files of the -t/--type type are processed if
+        given. Files already processed with the same options and not
+        changed since are skipped.""")
+    b_parser.add_argument("-D", "--output-dir",
+        dest="output_dir", metavar="PATH",
+        help="write the subtitles processed in batch mode in PATH.")
+    b_parser.add_argument("-j", "--jobs",
+        dest="jobs", type=int, default=os.cpu_count() or 1, metavar="NUM",
+        help="number of worker processes (default: %(default)s).")
+    b_parser.add_argument("--timeout",
+        dest="timeout", type=float, default=None, metavar="SECS",
+        help="abort any single job running for more than SECS seconds.")
+    b_parser.add_argument("--max-tasks-per-child",
+        dest="max_tasks", type=int, default=None, metavar="NUM",
+        help="""replace a worker process after it has processed NUM
+        files (default: never).""")
+    b_parser.add_argument("--serve",
+        action="store_true", dest="serve", default=False, help="""
+        stay resident as a co-process: read the jobs from the standard
+        input, one JSON object per line, writing the JSON result of
+        each one as a line on the standard output. A job has the
+        "input" path or the "text" of the subtitle, the optional
+        "output" path and the options "type", "shift" (in seconds),
+        "range", "stretch", "framerate", "encoding", "errors" and
+        "options" (any other option, by its name in the library API);
+        an "id" is copied in the result. Can be used only with
+        --serve-root, --socket and -j/--jobs.""")
+    b_parser.add_argument("--serve-root",
+        dest="serve_root", metavar="PATH", default=os.curdir, help="""
+        with --serve, the directory the "input" and "output" paths of
+        the jobs are relative to; paths outside of it (symbolic links
+        resolved) are refused (default: the current directory).""")
+    b_parser.add_argument("--socket",
+        dest="socket", metavar="PATH", help="""
+        with --serve, accept jobs from any number of clients on the
+        Unix-domain socket PATH instead, running them in a pool of
+        -j/--jobs worker processes. The socket is accessible only
+        by its owner.""")
     # other options
     m_parser = parser.add_argument_group('Misc Options')
     m_parser.add_argument("-T", "--tempdir",
-        dest="tempdir", metavar='PATH', default=tempfile.gettempdir(),
+        dest="tempdir", metavar='PATH', default=None,
         help="""Set the temporary directory (must exists) where store backup
-        files (default '%(default)s').""")
+        files (default: the system's temp directory).""")
+    m_parser.add_argument("--numpy",
+        action="store_true", dest="use_numpy", default=False,
+        help="""process the whole subtitle at once using NumPy arrays
+        (faster on big files, needs more memory). Falls back to the
+        default engine if NumPy is not available or the subtitle can't
+        be processed this way (e.g. for badly formatted files).""")
+    m_parser.add_argument("--buffer-size",
+        type=int, dest="buffer_size", default=OUTPUT_BUFSIZE, metavar="SIZE",
+        help="""write the output in chunks of about SIZE characters
+        (default %(default)s); 0 writes and flushes every subtitle
+        as soon as it's processed (e.g. for interactive pipes).""")
+    m_parser.add_argument("--live",
+        action="store_true", dest="live", default=False,
+        help="""low-latency mode for live streams: read the input
+        unbuffered and write (and flush) every subtitle as soon as it's
+        complete (the blank line ending a SubRip block, the line of the
+        other types), keeping in memory only the subtitle in progress.
+        The type is detected from the first lines telling it, the
+        encoding (-e auto) from the first bytes received. The --numpy,
+        --index, --mmap and --copy-tail options are not used. Conflicts
+        with -O, --batch, -R and --serve.""")
+    m_parser.add_argument("--index",
+        action="store_true", dest="use_index", default=False,
+        help="""with -r/--range, process only the subtitles in range,
+        found using an index of the input file saved in the sidecar
+        file INPUT{} (created, or rebuilt when the input changes);
+        the rest of the input is copied unchanged. Used only with
+        regular input files, ASCII-compatible encodings, LF line
+        endings and without -s or -N.""".format(INDEX_SUFFIX))
+    m_parser.add_argument("--mmap",
+        action="store_true", dest="use_mmap", default=False,
+        help="""like --index, but scanning the memory-mapped input for
+        the subtitles in range at each run, without saving the index.
+        Requires -r/--range: the whole input isn't read through the
+        memory map, only the search of the range uses it.""")
+    m_parser.add_argument("--copy-tail",
+        action="store_true", dest="copy_tail", default=False,
+        help="""with -r/--range, when the range END is passed (by block
+        number, start time or frame) copy the rest of the input unchanged,
+        without parsing it, if a quick scan shows no more subtitles in
+        range (otherwise the input is not sorted and it's processed as
+        usual). Used only with regular input files, ASCII-compatible
+        encodings, LF line endings and without -s.""")
+    m_parser.add_argument("--follow",
+        action="store_true", dest="follow", default=False,
+        help="""like --live, but for the -i/--input-file which keeps
+        growing (tail -f style): process it, then only the complete
+        subtitles appended to it, as they are written, until
+        interrupted. If the file is truncated or replaced (rotated)
+        the new one is processed from its start. Changes are watched
+        with inotify, where available, or checking the file at
+        increasing intervals (up to {}s).""".format(FOLLOW_MAX_POLL))
     m_parser.add_argument("-w", "--warn",
         action="store_true", dest="is_warn", default=False,
         help="enable warnings.")
@@ -284,9 +1034,12 @@ class TempFile:
                      'text': True,}
         self.opts.update(options or {})
         self.in_file = in_file
+        import tempfile
         self.fd, self.filepath = tempfile.mkstemp(**self.opts)
-        with open(self.in_file, 'rb') as _in:
-            self.fd_max_pos = os.write(self.fd, _in.read())
+        with open(self.in_file, 'rb') as _in, \
+             open(self.fd, 'wb', closefd=False) as _out:
+            self.fd_max_pos = os.fstat(_in.fileno()).st_size
+            copy_bytes(_in, _out, 0, self.fd_max_pos)
         self.seek(0, 0)
         self._closed = False
 
@@ -309,8 +1062,210 @@ class TempFile:
 
     def write_back (self):
         self.seek(0, 0)
-        with open(self.in_file, 'wb') as _in:
-            _in.write(self.read())
+        with open(self.fd, 'rb', closefd=False) as _tmp, \
+             open(self.in_file, 'wb') as _in:
+            copy_bytes(_tmp, _in, 0, self.fd_max_pos)
+
+
+class ReplaceFile (io.TextIOWrapper):
+    """
+    Text file (like the one returned by open(*path*, 'w', ...)) written
+    to a temp file in the directory of *path*, which replaces *path*
+    only by commit(); close() without commit() removes the temp file,
+    so the file at *path* is never left half-written (see -O).
+    """
+    def __init__ (self, path, encoding=None, errors=None):
+        self.path = os.path.realpath(path) # don't replace symlinks
+        self.committed = False
+        directory, name = os.path.split(self.path)
+        import tempfile
+        fd, self.tmppath = tempfile.mkstemp(
+            prefix='.{}.'.format(name), suffix='.csub-tmp', dir=directory)
+        try:
+            os.chmod(self.tmppath, os.stat(self.path).st_mode & 0o7777)
+            super().__init__(open(fd, 'wb'), encoding, errors)
+        except BaseException:
+            os.close(fd)
+            os.remove(self.tmppath)
+            raise
+
+    def commit (self):
+        """Close the file, moving it in place of the original one."""
+        super().close()
+        os.replace(self.tmppath, self.path)
+        self.committed = True
+
+    def isatty (self):
+        return False
+
+    def close (self):
+        if not self.closed:
+            super().close()
+        if not self.committed and os.path.exists(self.tmppath):
+            os.remove(self.tmppath)
+
+
+class ChunkWriter:
+    """
+    Output stage gathering the lines written to the text *file*: they
+    are joined in chunks of at least *size* characters, each one
+    written (so encoded and passed to the binary buffer) at once.
+    If *size* is 0 every write (a subtitle, or a SubRip block) is
+    flushed immediately, for interactive pipes. Call flush() at the
+    end to write the last chunk.
+    """
+    def __init__ (self, file, size=OUTPUT_BUFSIZE):
+        self.file = file
+        self.size = size
+        self.pending = []
+        self.pending_size = 0
+
+    @property
+    def encoding (self):
+        return self.file.encoding
+
+    @property
+    def buffer (self):
+        return self.file.buffer
+
+    def write (self, text):
+        if not self.size:
+            self.file.write(text)
+            self.file.flush()
+            return
+        self.pending.append(text)
+        self.pending_size += len(text)
+        if self.pending_size >= self.size:
+            self.write_pending()
+
+    def writelines (self, lines):
+        if not self.size:
+            for line in lines:
+                self.write(line)
+            return
+        lines = iter(lines)
+        pending = self.pending
+        while True:
+            count = len(pending)
+            try:
+                # on errors, keeps the lines got so far (to flush them)
+                pending.extend(itertools.islice(lines, OUTPUT_BATCH))
+            finally:
+                self.pending_size += sum(map(len, pending[count:]))
+            if len(pending) == count:
+                break
+            if self.pending_size >= self.size:
+                self.write_pending()
+
+    def write_pending (self):
+        """Write the gathered lines as a single chunk."""
+        if self.pending:
+            self.file.write(''.join(self.pending))
+            self.pending.clear()
+            self.pending_size = 0
+
+    def flush (self):
+        self.write_pending()
+        self.file.flush()
+
+
+class LineFeed:
+    """
+    Iterator over the lines of a text given in pieces to push(), for
+    the subtitles' parse_lines() generators: they must be advanced
+    only by the number of complete *units* pushed, the lines (or the
+    blocks of lines up to a blank one, if *blocks* is true) which
+    can be read without waiting for more input.
+    """
+    def __init__ (self, blocks=False):
+        self.blocks = blocks
+        self.lines = collections.deque()
+        self.partial = ''
+        self.block_size = 0
+        self.units = 0
+        self.closed = False
+
+    def __iter__ (self):
+        return self
+
+    def __next__ (self):
+        if self.lines:
+            return self.lines.popleft()
+        if self.closed:
+            raise StopIteration
+        raise RuntimeError("reading past the complete lines")
+
+    def push (self, text, final=False):
+        """Add *text* to the input, the last piece if *final*."""
+        lines = (self.partial + text).split('\n')
+        self.partial = lines.pop()
+        lines = [line + '\n' for line in lines]
+        if final:
+            if self.partial:
+                lines.append(self.partial)
+            self.partial = ''
+            self.closed = True
+        self.lines.extend(lines)
+        if not self.blocks:
+            self.units += len(lines)
+            return
+        for line in lines:
+            self.block_size += 1
+            # number and time lines, then the text up to a blank line
+            if self.block_size > 2 and not line.rstrip():
+                self.units += 1
+                self.block_size = 0
+
+
+class PrefixReader (io.RawIOBase):
+    """
+    Raw binary stream returning the bytes in *prefix*
+    followed by the bytes read from the *stream* file object.
+    """
+    def __init__ (self, prefix, stream):
+        super().__init__()
+        self.prefix = memoryview(prefix)
+        self.stream = stream
+
+    def readable (self):
+        return True
+
+    def readinto (self, buffer):
+        if self.prefix:
+            size = min(len(buffer), len(self.prefix))
+            buffer[:size] = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+            return size
+        data = self.stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def isatty (self):
+        return self.stream.isatty()
+
+    def close (self):
+        if not self.closed:
+            super().close()
+            if self.stream is not sys.stdin.buffer:
+                self.stream.close()
+
+
+class OptionError (Exception):
+    """Raised when the given options can't be applied to a subtitle."""
+    pass
+
+
+class TailCopy (Exception):
+    """
+    Raised by the subtitle's engines when the rest of the input
+    can be copied unchanged (see Subtitle.check_tail).
+    """
+    pass
+
+
+class JobTimeoutError (Exception):
+    """Raised when a batch job runs out of time."""
+    pass
 
 
 class BadFormatError (Exception):
@@ -357,16 +1312,523 @@ class GetFunc:
         return res
 
 
+class Cue:
+    """
+    Base class for the subtitle's cues yielded by the iter_cues()
+    methods. *start* and *end* are integers, expressed in the time
+    units of the subtitle format; the text is kept as the raw bytes
+    read from the file and decoded (using *encoding*) only when
+    the `text' attribute is accessed.
+    """
+    __slots__ = ('start', 'end', 'encoding', '_raw', '_text')
+
+    def __init__ (self, start, end, raw=b'', encoding='utf-8'):
+        self.start = start
+        self.end = end
+        self.encoding = encoding
+        self._raw = raw
+        self._text = None
+
+    def __repr__ (self):
+        return '<{} {}-{} {!r}>'.format(
+            type(self).__name__, self.start, self.end, self.raw)
+
+    @property
+    def raw (self):
+        if self._raw is None:
+            self._raw = self._text.encode(self.encoding)
+        return self._raw
+    @property
+    def text (self):
+        if self._text is None:
+            self._text = bytes(self._raw).decode(self.encoding)
+        return self._text
+    @text.setter
+    def text (self, text):
+        self._text = text
+        self._raw = None
+
+
+class SrtCue (Cue):
+    """
+    A SubRip block: *index* is the subtitle number, *extra* the raw
+    bytes following the end time (e.g. the position), the text is made
+    of the block's lines, joined with newlines.
+    """
+    __slots__ = ('index', 'extra')
+
+    def __init__ (self, index, start, end, raw=b'', encoding='utf-8',
+                  extra=b''):
+        super().__init__(start, end, raw, encoding)
+        self.index = index
+        self.extra = extra
+
+
+class AssEvent (Cue):
+    """
+    A SubStation Alpha Dialogue event: *head* is the raw event's
+    prefix (e.g. b'Dialogue: 0'), *seps* the pair of raw separators
+    used before the hundredths in the start and end times, *fields*
+    the raw fields between the times and the text (style, name,
+    margins and effect, commas included).
+    """
+    __slots__ = ('head', 'seps', 'fields')
+
+    def __init__ (self, start, end, raw=b'', encoding='utf-8',
+                  head=b'Dialogue: 0', seps=(b'.', b'.'), fields=b',,0,0,0,,'):
+        super().__init__(start, end, raw, encoding)
+        self.head = head
+        self.seps = seps
+        self.fields = fields
+
+
+class MicroDVDCue (Cue):
+    """A MicroDVD line: *start* and *end* are frames."""
+    __slots__ = ()
+
+
+class TailReader:
+    """
+    Iterator over the lines of the binary file *path* (with LF line
+    endings only), decoded using *encoding*, which keeps the
+    byte offset of the last line read, so that the rest of the file
+    can be copied unchanged starting from that line (see --copy-tail).
+    """
+    def __init__ (self, path, encoding, errors='strict'):
+        self.file = open(path, 'rb')
+        self.lines = iter(self.file)
+        self.decode = codecs.getincrementaldecoder(encoding)(errors).decode
+        self.offset = self.line_offset = 0
+        self.bom = (codecs.BOM_UTF8
+                    if codecs.lookup(encoding).name == 'utf-8-sig' else None)
+
+    def __iter__ (self):
+        return self
+
+    def __next__ (self):
+        raw = next(self.lines)
+        self.line_offset = self.offset
+        if not self.offset and self.bom and raw.startswith(self.bom):
+            self.line_offset = len(self.bom) # removed by the decoder
+        self.offset += len(raw)
+        return self.decode(raw)
+
+    def close (self):
+        self.file.close()
+
+    def tail_keys (self, pattern):
+        """
+        Returns the list of the matches of *pattern* (starting with
+        a newline) in the rest of the file, from the last line read.
+        """
+        start = self.line_offset
+        if os.fstat(self.file.fileno()).st_size <= start:
+            return []
+        with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if start and data[start-1:start] == b'\n':
+                return pattern.findall(data, start - 1)
+            end = data.find(b'\n', start)
+            if end < 0:
+                return pattern.findall(b'\n' + data[start:])
+            return (pattern.findall(b'\n' + data[start:end])
+                    + pattern.findall(data, end))
+
+
+class FileWatcher:
+    """
+    Wait for the changes of the file *path* (see --follow), using
+    inotify (through ctypes) where available, otherwise just sleeping
+    for the timeout, leaving the checks to the caller.
+    """
+    def __init__ (self, path):
+        self.path = path
+        self.fd = self.wd = None
+        try:
+            import ctypes
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        except (ImportError, OSError, AttributeError, TypeError):
+            return
+        if fd >= 0:
+            self.libc = libc
+            self.fd = fd
+            self.watch()
+
+    def watch (self):
+        """(Re)start watching the file at path, e.g. after a rotation."""
+        if self.fd is None:
+            return
+        if self.wd is not None:
+            self.libc.inotify_rm_watch(self.fd, self.wd)
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(self.path),
+                                         INOTIFY_MASK)
+        self.wd = wd if wd >= 0 else None
+
+    def wait (self, timeout):
+        """Wait for a change, for *timeout* seconds at most."""
+        if self.fd is None:
+            time.sleep(timeout)
+            return
+        import select
+        if select.select([self.fd], [], [], timeout)[0]:
+            try:
+                while os.read(self.fd, COPY_BUFSIZE):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close (self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class AnchorMap:
+    """
+    Piecewise-linear map of the integer times (in any unit) through
+    the anchors (original, target) added: between two anchors a time
+    is interpolated (rounding half up), before the first and after the
+    last one it's shifted as the nearest one (with no anchors it's
+    unchanged). The segment of a time is found with bisect, so with k
+    anchors mapping a time is O(log k). Raise ValueError adding an
+    anchor at the same time of another one or out of order (the
+    targets must increase with the original times).
+    """
+    def __init__ (self, pairs=()):
+        self.keys = []
+        self.targets = []
+        self.segments = [(0, 0, 1, 1)]
+        self.arrays = None
+        for key, target in pairs:
+            self.add(key, target)
+
+    def __len__ (self):
+        return len(self.keys)
+
+    def add (self, key, target):
+        """Add the anchor *key* -> *target*."""
+        keys, targets = self.keys, self.targets
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            raise ValueError("two anchors at the same time ({})".format(key))
+        if (i and targets[i-1] >= target
+            or i < len(keys) and targets[i] <= target):
+            raise ValueError("anchor {} -> {} out of order".format(
+                key, target))
+        keys.insert(i, key)
+        targets.insert(i, target)
+        # (start key, start target, target span, key span): a shift
+        # before the first and after the last anchor
+        self.segments = ([(keys[0], targets[0], 1, 1)]
+                         + [(k0, t0, t1 - t0, k1 - k0) for k0, t0, k1, t1
+                            in zip(keys, targets, keys[1:], targets[1:])]
+                         + [(keys[-1], targets[-1], 1, 1)])
+        self.arrays = None
+
+    def map_units (self, units, offset=None):
+        """
+        Returns the new time of *units* (an integer or a numpy array
+        of integers). *offset* is ignored (see Subtitle.map_units).
+        """
+        if not isinstance(units, int):
+            return self.map_array(units)
+        k0, t0, dt, dk = self.segments[bisect.bisect_right(self.keys, units)]
+        return t0 + (2 * (units - k0) * dt + dk) // (2 * dk)
+
+    def map_array (self, units):
+        """Vectorized map_units, for a numpy array of integers."""
+        if self.arrays is None:
+            self.arrays = (numpy.array(self.keys, dtype=numpy.int64),
+                           numpy.array(self.segments, dtype=numpy.int64).T)
+        keys, (k0, t0, dt, dk) = self.arrays
+        i = numpy.searchsorted(keys, units, side='right')
+        return t0[i] + (2 * (units - k0[i]) * dt[i] + dk[i]) // (2 * dk[i])
+
+
+class CueIndex:
+    """
+    Index of the cues of a subtitle file, saved in a binary sidecar
+    file (the subtitle's path plus INDEX_SUFFIX) and used to seek to
+    the cues in a range without parsing the whole file. For each cue
+    the index stores, as arrays of integers, the byte offset and the
+    line number of its first line, its number (the block number for
+    SubRip subtitles, the ordinal for the others) and its start and
+    end times (milliseconds, hundredths or frames).
+    An index is valid as long as the size, the mtime and the hash
+    of the file don't change.
+    """
+    FIELDS = ('offsets', 'numlines', 'numbers', 'starts', 'ends')
+
+    def __init__ (self, subtitle_type, codec, size, mtime_ns, digest):
+        self.subtitle_type = subtitle_type
+        self.codec = codec
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.digest = digest
+        for field in self.FIELDS:
+            setattr(self, field, array.array('q'))
+        self._sorted = {}
+
+    def __len__ (self):
+        return len(self.offsets)
+
+    @staticmethod
+    def sidecar (path):
+        """Returns the path of the index of the file *path*."""
+        return path + INDEX_SUFFIX
+
+    @classmethod
+    def get (cls, path, subtitle_type, encoding):
+        """
+        Returns the valid index of the *subtitle_type* file *path*,
+        loading it from the sidecar or building (and saving) a new one.
+        Returns None if the file can't be indexed.
+        """
+        index = cls.load(path, subtitle_type, encoding)
+        if index is None:
+            index = cls.build(path, subtitle_type, encoding)
+            if index is not None:
+                try:
+                    index.save(cls.sidecar(path))
+                except OSError:
+                    pass
+        return index
+
+    @classmethod
+    def load (cls, path, subtitle_type, encoding):
+        """
+        Returns the index of the file *path* read from its sidecar,
+        or None if missing, unreadable or invalid.
+        """
+        try:
+            with open(cls.sidecar(path), 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+                (magic, type_, codec, size, mtime_ns,
+                 digest, count) = INDEX_HEADER.unpack(header)
+                stat = os.stat(path)
+                if (magic != INDEX_MAGIC
+                    or type_.rstrip(b'\0').decode() != subtitle_type
+                    or codec.rstrip(b'\0').decode() != cue_codec(encoding)
+                    or (size, mtime_ns) != (stat.st_size, stat.st_mtime_ns)
+                    or digest != file_digest(path)):
+                    return None
+                index = cls(subtitle_type, cue_codec(encoding),
+                            size, mtime_ns, digest)
+                for field in cls.FIELDS:
+                    getattr(index, field).fromfile(f, count)
+        except (OSError, EOFError, struct.error,
+                LookupError, UnicodeDecodeError):
+            return None
+        if sys.byteorder == 'big':
+            for field in cls.FIELDS:
+                getattr(index, field).byteswap()
+        return index
+
+    def save (self, path):
+        """Atomically write the index in the file *path*."""
+        import tempfile
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path),
+                                        dir=os.path.dirname(path) or None)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(INDEX_HEADER.pack(
+                    INDEX_MAGIC, self.subtitle_type.encode(),
+                    self.codec.encode(), self.size, self.mtime_ns,
+                    self.digest, len(self)))
+                for field in self.FIELDS:
+                    values = getattr(self, field)
+                    if sys.byteorder == 'big':
+                        values = array.array('q', values)
+                        values.byteswap()
+                    values.tofile(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def build (cls, path, subtitle_type, encoding, complete=True):
+        """
+        Returns a new index of the *subtitle_type* file *path* or None
+        if the file can't be indexed: it must be well formed, using
+        an ASCII-compatible *encoding* and LF line endings only (see
+        is_lf_only).
+        The file is memory-mapped and scanned for the cues, decoding
+        only the text which may contain unicode spaces. If not
+        *complete*, the times not needed by find_range are left out
+        (and the index must not be saved).
+        """
+        codec = cue_codec(encoding)
+        if not is_ascii_compatible(encoding):
+            return None
+        scan = {'srt': cls._scan_srt, 'ass': cls._scan_ass,
+                'sub': cls._scan_microdvd}[subtitle_type]
+        with open(path, 'rb') as f, mapped_file(f) as data:
+            stat = os.fstat(f.fileno())
+            if len(data) != stat.st_size:
+                return None # changed while mapping
+            index = cls(subtitle_type, codec, stat.st_size,
+                        stat.st_mtime_ns, b'')
+            if not is_lf_only(data):
+                return None
+            pos = len(codecs.BOM_UTF8) if data[:3] == codecs.BOM_UTF8 else 0
+            try:
+                if not scan(index, data, pos, complete):
+                    return None
+            except UnicodeDecodeError:
+                return None
+            import hashlib
+            index.digest = hashlib.blake2b(data, digest_size=16).digest()
+        if pos and len(index) and index.offsets[0] == pos:
+            index.offsets[0] = 0 # the first line, with the BOM
+        return index
+
+    def _extend (self, offsets, numlines, numbers, starts, ends):
+        for field, values in zip(self.FIELDS,
+                                 (offsets, numlines, numbers, starts, ends)):
+            getattr(self, field).extend(values)
+
+    def _scan_srt (self, data, pos, complete=True):
+        """
+        Index the SubRip blocks of the buffer *data* from *pos*.
+        Returns False if the data is not a sequence of well formed
+        blocks, each one followed by a single blank line.
+        """
+        blocks = INDEX_SRT_BLOCK.findall(data, pos)
+        if not blocks:
+            return pos == len(data)
+        whole = list(map(operator.itemgetter(0), blocks))
+        if sum(map(len, whole)) != len(data) - pos:
+            return False # some data between the blocks
+        texts = map(operator.itemgetter(-1), blocks)
+        if not any(data.find(space, pos) >= 0 for space in INDEX_SPACES):
+            texts = itertools.filterfalse(bytes.isascii, texts)
+        for text in texts: # maybe with lines made of unicode spaces
+            if not all(line.rstrip() for line in
+                       text.decode(self.codec).rstrip('\n').split('\n')):
+                return False # the block ends with a unicode blank line
+        self._extend(
+            itertools.accumulate(map(len, whole[:-1]), initial=pos),
+            itertools.accumulate(map(bytes.count, whole[:-1],
+                                     itertools.repeat(b'\n')), initial=1),
+            map(int, map(operator.itemgetter(1), blocks)),
+            hms_units((block[2:6] for block in blocks), 1000)
+            if complete else (),
+            hms_units((block[6:10] for block in blocks), 1000)
+            if complete else ())
+        return True
+
+    def _scan_ass (self, data, pos, complete=True):
+        """
+        Index the SubStation Alpha events of the buffer *data* from
+        *pos*. Returns False if some Dialogue line isn't well formed
+        (or is the first line).
+        """
+        if data[pos:pos + len(b'Dialogue:')] == b'Dialogue:':
+            return False
+        events = list(INDEX_ASS_EVENT.finditer(data, pos))
+        if len(events) != len(INDEX_ASS_LINE.findall(data, pos)):
+            return False
+        if not events:
+            return True
+        offsets = [event.start() + 1 for event in events]
+        times = [event.groups() for event in events]
+        lines = map(bytes.count,
+                    map(data.__getitem__, map(slice, [0] + offsets, offsets)),
+                    itertools.repeat(b'\n'))
+        self._extend(
+            offsets, itertools.islice(
+                itertools.accumulate(lines, initial=1), 1, None),
+            range(1, len(offsets) + 1),
+            hms_units((time[:4] for time in times), 100),
+            hms_units((time[4:] for time in times), 100)
+            if complete else ())
+        return True
+
+    def _scan_microdvd (self, data, pos, complete=True):
+        """Index the MicroDVD lines of the buffer *data* from *pos*."""
+        lines = INDEX_MICRODVD.findall(data, pos)
+        if not lines:
+            return pos == len(data)
+        whole, starts, ends = zip(*lines)
+        if sum(map(len, whole)) != len(data) - pos:
+            return False # some lines not matching
+        self._extend(
+            itertools.accumulate(map(len, whole[:-1]), initial=pos),
+            range(1, len(lines) + 1), range(1, len(lines) + 1),
+            map(int, starts), map(int, ends) if complete else ())
+        return True
+
+    def is_sorted (self, field):
+        """True if the values of the array *field* are sorted."""
+        if field not in self._sorted:
+            values = getattr(self, field)
+            self._sorted[field] = all(map(
+                operator.le, values, itertools.islice(values, 1, None)))
+        return self._sorted[field]
+
+    def find (self, field, start=None, stop=None):
+        """
+        Returns the positions of the cues whose value of the array
+        *field* is in the [start, stop) range (None means unbounded),
+        using bisect if the values are sorted.
+        """
+        values = getattr(self, field)
+        if self.is_sorted(field):
+            return range(
+                0 if start is None else bisect.bisect_left(values, start),
+                len(values) if stop is None
+                else bisect.bisect_left(values, stop))
+        is_edit = Subtitle.edit_range(start, stop)
+        return [i for i, value in enumerate(values) if is_edit(value)]
+
+    def find_time (self, start=None, stop=None):
+        """Returns the positions of the cues starting in [start, stop)."""
+        return self.find('starts', start, stop)
+
+    def find_range (self, start=None, stop=None):
+        """
+        Returns the positions of the cues in the -r/--range [start, stop)
+        (block numbers, seconds or frames, by subtitle type).
+        """
+        if self.subtitle_type == 'srt':
+            return self.find('numbers', start, stop)
+        if self.subtitle_type == 'ass':
+            start, stop = (None if x is None else x * 100
+                           for x in (start, stop))
+        return self.find('starts', start, stop)
+
+    def regions (self, positions):
+        """
+        Returns a list of triples (begin, end, numline): the byte
+        offsets of the runs of consecutive cues at *positions*
+        and the line number of their first line.
+        """
+        regions = []
+        offsets, last = self.offsets, len(self) - 1
+        for pos in positions:
+            end = offsets[pos + 1] if pos < last else self.size
+            if regions and regions[-1][1] == offsets[pos]:
+                regions[-1][1] = end
+            else:
+                regions.append([offsets[pos], end, self.numlines[pos]])
+        return [tuple(r) for r in regions]
+
+
 class Subtitle:
     """
     Base class implementing common functions for time manipulation
     and subtitles formatting.
     """
+    # true if the subclass' parse_lines() generator (of the processed
+    # input lines) yields a string for each block of lines ending with
+    # a blank line, instead of each line (see LineFeed)
+    STREAM_BLOCKS = False
+
     def __init__ (self, str_format='', re_pattern='.*', output_line_format='{}\n'):
-        self.set_delta()
         self.STRING_FORMAT = str_format
         self.RE_MATCH_TIME = re.compile(re_pattern)
-        self.RE_MATCH_NUMBER = re.compile('^-{0,1}\d+$')
+        self.RE_MATCH_NUMBER = re.compile(r'^-{0,1}\d+$')
         self._delete_mode = False
         self.OUTPUT_LINE_FORMAT = output_line_format
         self.OUTPUT_LINE_FORMAT_DEL = ''
@@ -374,16 +1836,23 @@ class Subtitle:
         self.MAX_MIN = 60.0
         self.MAX_HNDRS = 100.0 # for SubStation Alpha
         self.MAX_MS = 1000.0
-        self.delta_hour = self.delta_min = self.delta_sec = 0.0
-        self.delta_ms = 0.0
+        self.UNITS = 1000 # time units (ms) per second
+        self.delta_hour = self.delta_min = self.delta_sec = 0
+        self.delta_ms = 0
         self.delta_framerate = 1.0
+        self.framerate_ratio = Fraction(1)
         self.delta_sub_num = 0
         self.IS_BLOCK = True
         self.IS_WARN = False
         self.IN_RANGE = True
         self.check_range_to_edit = self.edit_range()
+        self.range_start = self.range_stop = None
         self.actual_numline = 0
-        self.stretch_left = self.stretch_right = 0.0
+        self.stretch_left = self.stretch_right = 0
+        self.use_numpy = False
+        self.tail_reader = None
+        self.anchors = None
+        self.compile_times()
 
     @property
     def delete_mode (self):
@@ -402,9 +1871,42 @@ class Subtitle:
     @stretch.setter
     def stretch (self, pair):
         self.stretch_left, self.stretch_right = pair
+        self.compile_times()
+
+    def set_files (self, file_in, file_out):
+        """Set the input and output file-like objects."""
+        self.file_in = file_in
+        self.file_out = file_out
 
     def change_framerate (self, old, new):
         self.delta_framerate = float(new)/float(old)
+        # str() to get the exact decimal value (e.g. 23.976)
+        self.framerate_ratio = Fraction(str(new)) / Fraction(str(old))
+        self.compile_times()
+
+    def compile_times (self):
+        """
+        Compile the time options (the delta, the stretch and the
+        framerate change) into the affine map applied to every time:
+        new = (time_mul * units + offset) // time_div, with the offset
+        of the start times (start_offset), of the end times
+        (end_offset) or without stretch (time_offset). The result is
+        the same as adding the delta and the stretch to the time and
+        then scaling it by the framerate ratio, rounding half up.
+        Called whenever those options change, any option costs
+        nothing per time.
+        """
+        ratio = self.framerate_ratio
+        if ratio == 1:
+            mul, div, half = 1, 1, 0
+        else:
+            mul, div, half = 2 * ratio.numerator, 2 * ratio.denominator, \
+                             ratio.denominator
+        delta = self.delta_units()
+        self.time_mul, self.time_div = mul, div
+        self.time_offset, self.start_offset, self.end_offset = (
+            mul * (delta + stretch) + half
+            for stretch in (0, self.stretch_left, self.stretch_right))
 
     @staticmethod
     def edit_range(start=None, stop=None):
@@ -426,10 +1928,12 @@ class Subtitle:
         self.delta_sec = sec
         self.delta_ms = ms
         self.delta_sub_num = sub_number
+        self.compile_times()
 
     def set_subs_range (self, start=None, end=None):
         """Set blocks range to edit, from `start' to `end' (excluded)."""
         self.check_range_to_edit = self.edit_range(start, end)
+        self.range_start, self.range_stop = start, end
 
     def make_iter_blocks (self, *methods):
         """Returns an itertools.cycle object for *methods."""
@@ -477,79 +1981,284 @@ class Subtitle:
                     ((ms + self.delta_ms) / self.MAX_MS)
                    )) * self.delta_framerate
 
-    def parse (self, lines, itertools_cycle_iterator):
-        """Iterate over subtitle's *lines*, using
-        *itertools_cycle_iterator* for get the right function
-        to manipulate the given line.
+    def set_anchors (self, pairs):
         """
-        get_func = GetFunc(itertools_cycle_iterator)
-        for line, self.actual_numline in zip(lines, itertools.count(1)):
-            yield self.output_line_fmt.format(get_func(line))
+        Map the times through the AnchorMap of the (original, target)
+        *pairs* of times in seconds (see --anchors), in place of the
+        time options.
+        """
+        self.anchors = AnchorMap(
+            (seconds_to_units(orig, self.UNITS),
+             seconds_to_units(target, self.UNITS)) for orig, target in pairs)
+        self.map_units = self.anchors.map_units
 
-    def times_from_secs (self, seconds):
+    def new_units (self, hour, min_, sec, units):
         """
-        Returns a tuple of (hour, minutes, secs, ms)
-        from a time expressed in seconds.
+        Integer version of new_time: returns the new time, according
+        to the delta, expressed in time units (see UNITS), computed
+        with integer (or, changing the framerate, rational) arithmetic.
         """
-        hour, _ = divmod(seconds, self.MAX_H)
-        m, _ = divmod(_, self.MAX_MIN)
-        ms, s = math.modf(_)
-        return hour, m, s, round(ms*self.MAX_MS)
+        return self.map_units(((hour * 60 + min_) * 60 + sec) * self.UNITS
+                              + units, self.time_offset)
 
+    def delta_units (self):
+        """Returns the time delta expressed in time units."""
+        return (((self.delta_hour * 60 + self.delta_min) * 60
+                 + self.delta_sec) * self.UNITS + self.delta_ms)
 
-class MicroDVD (Subtitle):
-    """
-    Class to manage MicroDVD (*.sub) subtitle.
-    """
-    def __init__ (self, file_in, file_out, frames=25,
-                  unsafe_time_mode=False, use_secs=False):
-        """file_in and file_out must be file-like objects."""
+    def map_units (self, units, offset):
+        """
+        Returns the new time of the integer *units* (or a numpy array
+        of integers) with the compiled map (see compile_times), using
+        *offset* (time_offset, start_offset or end_offset).
+        """
+        return (self.time_mul * units + offset) // self.time_div
+
+    def times_from_units (self, units):
+        """
+        Returns a tuple of integers (hour, minutes, secs, units)
+        from a time expressed in time units.
+        """
+        return split_units(units, self.UNITS)
+
+    def check_tail (self, key):
+        """
+        Called with the range *key* of a cue not in range: if the
+        range end has been passed and no cue in range is found in the
+        rest of the input, read by *tail_reader* (the range keys given
+        by the subclass' tail_keys method), raise TailCopy.
+        Otherwise (the input is not sorted) tail_reader is dropped
+        and processing goes on as usual.
+        """
+        if self.range_stop is None or key < self.range_stop:
+            return
+        reader, self.tail_reader = self.tail_reader, None
+        if not any(map(self.check_range_to_edit, self.tail_keys(reader))):
+            raise TailCopy
+        if self.IS_WARN:
+            warnings.warn("the input is not sorted, tail copy disabled")
+
+    def finish (self):
+        """Called at the end of the input, once parse_lines() is done."""
+        pass
+
+    def numpy_run (self, file_in, file_out):
+        """
+        Process the lines of *file_in* with the vectorized numpy_main(),
+        writing the result in *file_out*. Returns None on success,
+        otherwise the list of the lines read, for the default engine.
+        """
+        lines = list(file_in)
+        text = self.numpy_main(lines)
+        if text is None:
+            return lines
+        file_out.write(text)
+        self.actual_numline = len(lines)
+        return None
+
+    def numpy_main (self, lines):
+        """
+        Returns the processed *lines* as a string, computed using NumPy
+        arrays, or None if the subtitle can't be processed this way.
+        Must be implemented by subclasses.
+        """
+        return None
+
+    def numpy_range_mask (self, values):
+        """Returns a boolean array: *values* in the range to edit."""
+        mask = numpy.ones(len(values), dtype=bool)
+        if self.range_start is not None:
+            mask &= values >= self.range_start
+        if self.range_stop is not None:
+            mask &= values < self.range_stop
+        return mask
+
+    def parse (self, lines, itertools_cycle_iterator):
+        """Iterate over subtitle's *lines*, using
+        *itertools_cycle_iterator* for get the right function
+        to manipulate the given line.
+        """
+        get_func = GetFunc(itertools_cycle_iterator)
+        for line, self.actual_numline in zip(lines, itertools.count(1)):
+            yield self.output_line_fmt.format(get_func(line))
+
+    def times_from_secs (self, seconds):
+        """
+        Returns a tuple of (hour, minutes, secs, ms)
+        from a time expressed in seconds.
+        """
+        hour, _ = divmod(seconds, self.MAX_H)
+        m, _ = divmod(_, self.MAX_MIN)
+        ms, s = math.modf(_)
+        return hour, m, s, round(ms*self.MAX_MS)
+
+
+class MicroDVD (Subtitle):
+    """
+    Class to manage MicroDVD (*.sub) subtitle.
+    """
+    def __init__ (self, file_in, file_out, frames=25,
+                  unsafe_time_mode=False, use_secs=False):
+        """file_in and file_out must be file-like objects."""
         str_fmt = '{{{start:.0f}}}{{{end:.0f}}}{rest}\n'
-        reg = '^{(\d+)}{(\d+)}(.*)$'
-        reg_unsafe = '^{(-{0,1}\d+)}{(-{0,1}\d+)}(.*)$'
-        super().__init__(str_fmt, reg if not unsafe_time_mode else reg_unsafe, str_fmt)
+        reg = r'^{(\d+)}{(\d+)}(.*)$'
+        reg_unsafe = r'^{(-{0,1}\d+)}{(-{0,1}\d+)}(.*)$'
+        # before the base class' init, used by compile_times
         self.frames = frames
         self.delta_frames = 0
+        self._use_sec = use_secs
+        super().__init__(str_fmt, reg if not unsafe_time_mode else reg_unsafe, str_fmt)
         self.infile = file_in
         self.outfile = file_out
-        self._use_sec = use_secs
 
-    def frame_use_secs(self, frame):
-        secs, r = divmod(frame, self.frames)
-        return r + (sum((self.delta_hour * self.MAX_H,
-                            self.delta_min * self.MAX_MIN,
-                            secs + self.delta_sec,
-                            self.delta_ms))
-                       * self.frames
-                       * self.delta_framerate)
+    def set_files (self, file_in, file_out):
+        """Set the input and output file-like objects."""
+        self.infile = file_in
+        self.outfile = file_out
+
+    def compile_times (self):
+        """
+        Compile the time options into the map of the frames (see
+        Subtitle.compile_times): the new frame is
+        (frame + time_delta) * time_mul + offset, where the offset is
+        the stretch (start_offset, end_offset or time_offset, zero).
+        With a time delta (use_secs) the frame is split in seconds and
+        the rest: rest + (secs + time_delta) * frames * time_mul +
+        offset, the delta in seconds (with the ms counted as seconds).
+        The float arithmetic, in the same order, gives the same frames
+        as applying the options in turn.
+        """
+        if self._use_sec:
+            self.time_delta = float((self.delta_hour * 60 + self.delta_min)
+                                    * 60 + self.delta_sec + self.delta_ms)
+        else:
+            self.time_delta = self.delta_frames
+        self.time_mul = self.delta_framerate
+        self.time_offset = 0
+        self.start_offset, self.end_offset = self.stretch
+
+    def map_frame (self, frame, offset):
+        """
+        Returns the new (not rounded) frame of *frame* (or of a numpy
+        array of frames, without use_secs) with the compiled map (see
+        compile_times), using *offset*.
+        """
+        if self._use_sec:
+            secs, rest = divmod(frame, self.frames)
+            return (rest + (secs + self.time_delta) * self.frames
+                    * self.time_mul + offset)
+        return (frame + self.time_delta) * self.time_mul + offset
 
-    def _new_time(self, frames):
-        return list(self.frame_use_secs(f) for f in frames)
+    def set_anchors (self, pairs):
+        """See Subtitle.set_anchors, the times mapped in frames."""
+        fps = Fraction(str(self.frames))
+        self.anchors = AnchorMap(
+            (seconds_to_units(orig, fps), seconds_to_units(target, fps))
+            for orig, target in pairs)
+        self.map_frame = self.anchors.map_units
 
-    def _new_frames(self, frames):
+    def new_time (self, frames):
+        """
+        Returns the list of the new *frames* (floats), according to
+        delta_frames and the framerate (like Subtitle.new_time, the
+        subtitle is processed using the compiled map, see map_frame).
+        """
         return [(x + self.delta_frames) * self.delta_framerate for x in frames]
 
-    new_time = _new_frames
-
     def set_delta (self, hour=0, min_=0, sec=0, ms=0, delta_frames=0):
         """Set time's attribute."""
-        super(MicroDVD, self).set_delta(hour, min_, sec, ms, 0)
         self.delta_frames = delta_frames
+        super(MicroDVD, self).set_delta(hour, min_, sec, ms, 0)
+
+    def numpy_main (self, lines):
+        """Vectorized main() (see Subtitle.numpy_main)."""
+        if self._use_sec or self.delete_mode:
+            return None
+        matches = [self.RE_MATCH_TIME.match(line) for line in lines]
+        if not all(matches):
+            return None
+        n = len(matches)
+        starts = numpy.fromiter((int(m.group(1)) for m in matches),
+                                numpy.int64, n)
+        ends = numpy.fromiter((int(m.group(2)) for m in matches),
+                              numpy.int64, n)
+        mask = self.numpy_range_mask(starts)
+        new_starts = self.map_frame(starts, self.start_offset)
+        new_ends = self.map_frame(ends, self.end_offset)
+        if (new_starts[mask] < 0).any() or (new_ends[mask] < 0).any():
+            return None # '{:.0f}' gives '-0' for small negatives
+        new_starts = map(str, numpy.rint(new_starts).astype(int).tolist())
+        new_ends = map(str, numpy.rint(new_ends).astype(int).tolist())
+        out = []
+        for line, match, edit, start, end in zip(
+                lines, matches, mask.tolist(), new_starts, new_ends):
+            if edit:
+                out.append('{' + start + '}{' + end + '}'
+                           + match.group(3) + '\n')
+            else:
+                out.append(line)
+        return ''.join(out)
 
     def main(self):
         """Do the job."""
-        if self._use_sec:
-            self.new_time = self._new_time
-        for self.actual_numline, line in zip(itertools.count(1), self.infile):
-            *time, rest = self.match_time(line).groups()
-            if self.check_range_to_edit(int(time[0])):
-                start, end = self.new_time(map(int, time))
-                self.outfile.write(self.output_line_fmt.format(
-                    start=start+self.stretch_left,
-                    end=end+self.stretch_right,
-                    rest=rest))
+        lines = self.infile
+        if self.use_numpy and load_numpy() is not None:
+            lines = self.numpy_run(lines, self.outfile)
+            if lines is None:
+                return
+        self.outfile.writelines(self.parse_lines(lines))
+
+    def parse_lines (self, lines):
+        """Generator of the output lines from the input *lines*."""
+        map_frame = self.map_frame
+        start_offset, end_offset = self.start_offset, self.end_offset
+        for self.actual_numline, line in zip(itertools.count(1), lines):
+            start, end, rest = self.match_time(line).groups()
+            start = int(start)
+            if self.check_range_to_edit(start):
+                yield self.format_line(map_frame(start, start_offset),
+                                       map_frame(int(end), end_offset),
+                                       rest)
             else:
-                self.outfile.write(line)
+                if self.tail_reader is not None:
+                    self.check_tail(start)
+                yield line
+
+    def format_line (self, start, end, rest):
+        """
+        Returns the output line for the new *start* and *end* frames
+        (like output_line_fmt, using printf-style formatting).
+        """
+        if self.IN_RANGE and self.delete_mode:
+            return self.OUTPUT_LINE_FORMAT_DEL
+        return '{%.0f}{%.0f}%s\n' % (start, end, rest)
+
+    def tail_keys (self, reader):
+        """See Subtitle.tail_keys."""
+        return list(map(int, reader.tail_keys(TAIL_MICRODVD)))
+
+    @classmethod
+    def iter_cues (cls, file, encoding='utf-8'):
+        """
+        Generator of MicroDVDCue objects read from the binary *file*
+        (*encoding* must be ASCII-compatible).
+        Raise MismatchTimeError on malformed lines.
+        """
+        codec = cue_codec(encoding)
+        for numline, line in raw_lines(file, encoding):
+            match = CUE_MICRODVD.fullmatch(line)
+            if match is None:
+                raise MismatchTimeError("[at line {}] {!r} (in {})".format(
+                    numline, line, "iter_cues"))
+            start, end, text = match.groups()
+            yield MicroDVDCue(int(start), int(end), text, codec)
+
+    @classmethod
+    def write_cues (cls, file, cues):
+        """Write the MicroDVDCue objects *cues* in the binary *file*."""
+        for cue in cues:
+            file.write(b'{%d}{%d}%s\n' % (cue.start, cue.end, cue.raw))
+
 
 class AssSub (Subtitle):
     """
@@ -558,12 +2267,14 @@ class AssSub (Subtitle):
     """
     def __init__ (self, file_in, file_out, unsafe_time_mode=False):
         """`file_in' and `file_out' must be file-like objects."""
-        reg = '(^Dialogue: \d+),(\d{1}:\d{2}:\d{2}([:\.])\d{2}),'\
-              '(\d{1}:\d{2}:\d{2}([:.])\d{2}),(.*$)'
-        reg_unsafe = '(^Dialogue: \d+),(-{0,1}\d+:\d{2}:\d{2}([:\.])\d{2}),'\
-                     '(-{0,1}\d+:\d{2}:\d{2}([:.])\d{2}),(.*$)'
-        time_reg = '(\d{1}):(\d{2}):(\d{2})[:\.](\d{2})'
-        time_reg_unsafe = '(-{0,1}\d+):(\d{2}):(\d{2})[:\.](\d{2})'
+        # groups: init, start time (hour, min, sec, sep, hundredths),
+        # end time (same), rest of the line
+        reg = r'(^Dialogue: \d+),((\d{1}):(\d{2}):(\d{2})([:\.])(\d{2})),'\
+              r'((\d{1}):(\d{2}):(\d{2})([:.])(\d{2})),(.*$)'
+        reg_unsafe = r'(^Dialogue: \d+),((-{0,1}\d+):(\d{2}):(\d{2})([:\.])(\d{2})),'\
+                     r'((-{0,1}\d+):(\d{2}):(\d{2})([:.])(\d{2})),(.*$)'
+        time_reg = r'(\d{1}):(\d{2}):(\d{2})[:\.](\d{2})'
+        time_reg_unsafe = r'(-{0,1}\d+):(\d{2}):(\d{2})[:\.](\d{2})'
         # Why these regex? well...
         # The spec for ass/ssa file talk about a time format like
         # 0:00:00:00  (so, *1* digit for hours and the colon as divider)
@@ -580,6 +2291,7 @@ class AssSub (Subtitle):
         self.file_out = file_out
         self.actual_numline = 0
         self.MAX_MS = self.MAX_HNDRS
+        self.UNITS = 100
         # NOTE: since ass/ssa use 2-digit precision for fraction of seconds
         # *MAX_MS* is used as an alias for *MAX_HNDRS* and *self.delta_ms*
         # used in various methods of the base class refer to hundreds, not
@@ -591,13 +2303,22 @@ class AssSub (Subtitle):
             int, self.time_reg.match(time_string).groups()))
         return self.check_range_to_edit(h * self.MAX_H + m * self.MAX_MIN + s)
 
-    def new_time_string (self, time_string, sec_sep, stretch):
-        """Return a string representing the subtitle time."""
+    def new_time_string (self, time_string, sec_sep, offset):
+        """
+        Return a string representing the subtitle time, mapped
+        using *offset* (see Subtitle.compile_times).
+        """
         h, m, s, hndrs = list(map(
             int, self.time_reg.match(time_string).groups()))
-        return '{:.0f}:{:02.0f}:{:02.0f}{sep}{:02.0f}'.format(
-            *self.times_from_secs(self.new_time(h, m, s, hndrs + stretch)),
-             sep=sec_sep)
+        return self.new_time_fields(h, m, s, hndrs, sec_sep, offset)
+
+    def new_time_fields (self, h, m, s, hndrs, sec_sep, offset):
+        """
+        Return a string representing the subtitle time, mapped
+        using *offset* (see Subtitle.compile_times).
+        """
+        return ass_time(*self.times_from_units(self.map_units(
+            ((h * 60 + m) * 60 + s) * 100 + hndrs, offset)), sec_sep)
 
     def parse_line (self, line):
         """
@@ -607,33 +2328,144 @@ class AssSub (Subtitle):
         """
         line = line.rstrip()
         if line.startswith('Dialogue:'):
+            match = self.reg.match(line)
+            if match is None:
+                raise MismatchTimeError(
+                    ("You probably need to --back-to-the-future"
+                     "ERR LINE IS: {}").format(line))
+            (init, _, h, m, s, start_sep, hs,
+             _, eh, em, es, end_sep, ehs, rest) = match.groups()
             try:
-                match = self.reg.match(line)
-                init, start, start_sep, end, end_sep, rest = match.groups()
-                if self._is_in_range(start):
-                    new_start = self.new_time_string(
-                        start, start_sep, self.stretch_left)
-                    new_end = self.new_time_string(
-                        end, end_sep, self.stretch_right)
-                    line = ','.join((init, new_start, new_end, rest))
+                h, m, s = int(h), int(m), int(s)
+                secs = h * 3600 + m * 60 + s
+                if self.check_range_to_edit(secs):
+                    line = ','.join((
+                        init,
+                        self.new_time_fields(h, m, s, int(hs), start_sep,
+                                             self.start_offset),
+                        self.new_time_fields(int(eh), int(em), int(es),
+                                             int(ehs), end_sep,
+                                             self.end_offset),
+                        rest))
+                elif self.tail_reader is not None:
+                    self.check_tail(secs)
             except ValueError as err:
                 raise MismatchTimeError(
                     "({}) Something went wrong computing this line: {}".format(
                         err, line))
-            except AttributeError as err:
-                raise MismatchTimeError(
-                    ("You probably need to --back-to-the-future"
-                     "ERR LINE IS: {}").format(line))
         return line
 
     def set_delta (self, hour=0, min_=0, sec=0, hndrs=0, *not_used):
-        super(AssSub, self).set_delta(hour, min_, sec)
-        self.delta_ms = hndrs
+        super(AssSub, self).set_delta(hour, min_, sec, hndrs)
+
+    def tail_keys (self, reader):
+        """See Subtitle.tail_keys."""
+        return [int(h) * 3600 + int(m) * 60 + int(s)
+                for h, m, s in reader.tail_keys(TAIL_ASS)]
+
+    def numpy_main (self, lines):
+        """Vectorized main() (see Subtitle.numpy_main)."""
+        if self.delete_mode:
+            return None
+        lines = [line.rstrip() for line in lines]
+        index = [i for i, line in enumerate(lines)
+                 if line.startswith('Dialogue:')]
+        matches = [self.reg.match(lines[i]) for i in index]
+        if not all(matches):
+            return None
+        n = len(matches)
+        try:
+            times = ''.join(m.group(2) + m.group(8)
+                            for m in matches).encode('ascii')
+        except UnicodeEncodeError:
+            return None
+        if len(times) != n * 20:
+            return None # not 1-digit hours
+        grid = numpy.frombuffer(times, dtype=numpy.uint8).reshape(n, 20)
+        if n and not ((grid[:, ASS_SEP_COLS] == ASS_SEPS).all()
+                      and (grid[:, ASS_DIGIT_COLS] >= 48).all()
+                      and (grid[:, ASS_DIGIT_COLS] <= 57).all()):
+            return None
+        d = grid[:, ASS_DIGIT_COLS].astype(numpy.int64) - 48
+        secs = (d[:, 0] * 3600 + (d[:, 1] * 10 + d[:, 2]) * 60
+                + d[:, 3] * 10 + d[:, 4])
+        mask = self.numpy_range_mask(secs)
+        new = []
+        for col, offset in ((0, self.start_offset), (7, self.end_offset)):
+            units = (((d[:, col] * 60 + d[:, col+1] * 10 + d[:, col+2]) * 60
+                      + d[:, col+3] * 10 + d[:, col+4]) * 100
+                     + d[:, col+5] * 10 + d[:, col+6])
+            units = self.map_units(units, offset)
+            if ((units[mask] < 0) | (units[mask] >= 36000 * 100)).any():
+                return None
+            h, units = numpy.divmod(units, 360000)
+            m, units = numpy.divmod(units, 6000)
+            s, hs = numpy.divmod(units, 100)
+            new.extend((h, m // 10, m % 10, s // 10, s % 10,
+                        hs // 10, hs % 10))
+        out = grid.copy()
+        rows = numpy.flatnonzero(mask)
+        out[numpy.ix_(rows, ASS_DIGIT_COLS)] = (
+            numpy.stack(new, axis=1)[rows] + 48)
+        times = out.tobytes().decode('ascii')
+        for k in rows.tolist():
+            i, m = index[k], matches[k]
+            lines[i] = '{},{},{},{}'.format(m.group(1), times[k*20:k*20+10],
+                                            times[k*20+10:k*20+20], m.group(14))
+        lines.append('')
+        return '\n'.join(lines)
 
     def main (self):
-        for self.actual_numline, line in zip(
-            itertools.count(1), self.file_in):
-            self.file_out.write(self.output_line_fmt.format(self.parse_line(line)))
+        lines = self.file_in
+        if self.use_numpy and load_numpy() is not None:
+            lines = self.numpy_run(lines, self.file_out)
+            if lines is None:
+                return
+        self.file_out.writelines(self.parse_lines(lines))
+
+    def parse_lines (self, lines):
+        """Generator of the output lines from the input *lines*."""
+        for self.actual_numline, line in zip(itertools.count(1), lines):
+            yield self.output_line_fmt.format(self.parse_line(line))
+
+    @classmethod
+    def iter_cues (cls, file, encoding='utf-8'):
+        """
+        Generator of AssEvent objects for the Dialogue lines read
+        from the binary *file* (*encoding* must be ASCII-compatible);
+        all the other lines (headers, styles, comments...) are skipped.
+        Raise MismatchTimeError on malformed Dialogue lines.
+        """
+        codec = cue_codec(encoding)
+        for numline, line in raw_lines(file, encoding):
+            if not line.startswith(b'Dialogue:'):
+                continue
+            match = CUE_ASS_EVENT.fullmatch(line)
+            if match is None:
+                raise MismatchTimeError("[at line {}] {!r} (in {})".format(
+                    numline, line, "iter_cues"))
+            (head, h, m, s, start_sep, hs, eh, em, es, end_sep, ehs,
+             fields, text) = match.groups()
+            yield AssEvent(
+                ((int(h) * 60 + int(m)) * 60 + int(s)) * 100 + int(hs),
+                ((int(eh) * 60 + int(em)) * 60 + int(es)) * 100 + int(ehs),
+                text, codec, head, (start_sep, end_sep), fields)
+
+    @classmethod
+    def write_cues (cls, file, cues):
+        """
+        Write the AssEvent objects *cues* in the binary *file*
+        as Dialogue lines (the script's headers are not written).
+        Raises BadFormatError on negative times.
+        """
+        for cue in cues:
+            if cue.start < 0 or cue.end < 0:
+                raise BadFormatError("negative time in {!r}".format(cue))
+            file.write(b'%s,%d:%02d:%02d%s%02d,%d:%02d:%02d%s%02d,%s%s\n' % (
+                (cue.head,) + split_units(cue.start, 100)[:3]
+                + (cue.seps[0], cue.start % 100)
+                + split_units(cue.end, 100)[:3]
+                + (cue.seps[1], cue.end % 100, cue.fields, cue.raw)))
 
 
 class SrtSub (Subtitle):
@@ -641,6 +2473,8 @@ class SrtSub (Subtitle):
     Class to manage SubRip (*.srt) subtitle.
     Inherit from Subtitle.
     """
+    STREAM_BLOCKS = True
+
     def __init__ (self, file_in, file_out, unsafe_time_mode=False,
                   unsafe_number_mode=False, ignore_extra=False,
                   make_progressive_num_block=False, start_sub_num=1,
@@ -656,36 +2490,78 @@ class SrtSub (Subtitle):
         self.re_pattern = (reg_unsafe if unsafe_time_mode else reg_safe)[_s]
         self.unsafe_number_mode = unsafe_number_mode
         super().__init__(self.string_format, self.re_pattern)
-        self.end_t_reg = (self.RE_MATCH_TIME if not keep_pos
-                          else re.compile(
-                          r'^(\d{2}):(\d{2}):(\d{2}),(\d{3})(?=\s|$)(.*)?$'))
-        self._keep_pos_group = (1,2,3,4,5) if keep_pos else (1,2,3,4)
+        # the whole time line, 'start --> end[extra]': groups are the
+        # eight time fields and the extra tail to keep (maybe empty).
+        # Extra text (if allowed) must not contain another separator.
+        t_safe = r'(\d{2}):(\d{2}):(\d{2}),(\d{3})'
+        t_start = (r'(-?\d+):(\d{2}):(\d{2}),(\d{3})' if unsafe_time_mode
+                   else t_safe)
+        if keep_pos:
+            t_end = t_safe + r'(|\s+\S.*?)\s*'
+        else:
+            t_end = t_start + (r'.*()' if ignore_extra else r'\s*()')
+        t_start += r'(?:(?! --> ).)*' if ignore_extra else r'\s*'
+        self.time_line_reg = re.compile(
+            r'\s*' + t_start + self.time_sep
+            + (r'(?!.* --> )' if ignore_extra or keep_pos else '')
+            + r'\s*' + t_end, re.DOTALL)
         self.file_in = file_in
         self.file_out = file_out
-        self._sl = self._ml = self._sr = self._mr = 0 # stretch
+        self.index_anchors = []
         if make_progressive_num_block:
             self.new_sub_num = self.progressive_num_block
 
-    @property
-    def stretch (self):
-        return self.stretch_left, self.stretch_right
-    @stretch.setter
-    def stretch (self, pair):
-        self.stretch_left, self.stretch_right = pair
-        if abs(self.stretch_left) >= self.MAX_MS:
-            self._sl, self._ml = divmod(abs(self.stretch_left), self.MAX_MS)
-            if self.stretch_left < 0:
-                self._sl = -self._sl
-                self._ml = -self._ml
-        else:
-            self._ml = self.stretch_left
-        if abs(self.stretch_right) >= self.MAX_MS:
-            self._sr, self._mr = divmod(abs(self.stretch_right), self.MAX_MS)
-            if self.stretch_right < 0:
-                self._sr = -self._sr 
-                self._mr = -self._mr 
-        else:
-            self._mr = self.stretch_right
+    def set_anchors (self, pairs, cues=()):
+        """
+        See Subtitle.set_anchors, with the (cue number, target) *cues*
+        pairs too: the start time of each of those cues is added to
+        the anchors reading ahead the input (see resolve_anchors).
+        """
+        super().set_anchors(pairs)
+        self.index_anchors = sorted(
+            (num, seconds_to_units(target, self.UNITS))
+            for num, target in cues)
+
+    def resolve_anchors (self, lines):
+        """
+        Generator of the *lines*, reading ahead in the buffer up to the
+        time line of the cue of each cue number anchor, to add it to
+        the anchors before the cues preceding it are processed (the
+        lines of the anchor's block are kept for the next one, the
+        cues ending after it are mapped knowing the next anchor too).
+        """
+        buffer = collections.deque()
+        lines = iter(lines)
+        size = 0 # lines of the block read
+        number = None
+        for num, target in self.index_anchors:
+            for line in lines:
+                buffer.append(line)
+                size += 1
+                if size == 1:
+                    number = line.strip()
+                elif size == 2:
+                    match = self.time_line_reg.fullmatch(line)
+                    if match is not None and number == str(num):
+                        h, m, s, ms = map(int, match.groups()[:4])
+                        try:
+                            self.anchors.add(
+                                ((h * 60 + m) * 60 + s) * 1000 + ms, target)
+                        except ValueError as e:
+                            raise BadFormatError(
+                                "cue #{} anchor: {}".format(num, e))
+                        break
+                elif not line.rstrip():
+                    size = 0
+            else:
+                if self.IS_WARN:
+                    warnings.warn("anchor cue #{} not found".format(num))
+                break
+            for _ in range(len(buffer) - size):
+                yield buffer.popleft()
+        yield from buffer
+        buffer.clear()
+        yield from lines
 
     @iterdec()
     def num_block (self, num_string):
@@ -706,24 +2582,31 @@ class SrtSub (Subtitle):
     @iterdec()
     def time_block (self, time_string):
         """Check the time lines."""
+        return self.new_time_line(time_string)
+
+    def new_time_line (self, time_string):
+        """
+        Returns the new time line (rstripped) or raise MismatchTimeError.
+        Lines of blocks not in range are returned unchecked.
+        """
         if not self.IN_RANGE:
             return time_string.rstrip()
-        try:
-            start, end = list(
-                map(str.strip, time_string.split(self.time_sep)))
-        except ValueError:
+        match = self.time_line_reg.fullmatch(time_string)
+        if match is None:
             raise MismatchTimeError("[at line {}] '{}' (in {})".format(
-                 self.actual_numline, time_string, "time_block"))
-        h, m, s, ms = list(map(int, self.match_time(start).group(1, 2, 3, 4)))
-        new_start = self.string_format.format(*map(int, self.times_from_secs(
-            self.new_time(h, m, s+self._sl, ms+self._ml))))
-        h, m, s, ms, *extra = self.match_time(
-            end, self.end_t_reg).group(*self._keep_pos_group)
-        h, m, s, ms = list(map(int, (h, m, s, ms)))
-        extra = extra[0] if extra else ''
-        new_end = self.string_format.format(*map(int, self.times_from_secs(
-            self.new_time(h, m, s+self._sr, ms+self._mr))))
-        return self.time_sep.join((new_start, new_end)) + extra
+                 self.actual_numline, time_string, "new_time_line"))
+        h, m, s, ms, eh, em, es, ems, extra = match.groups()
+        new_start = srt_time(*self.times_from_units(self.map_units(
+            ((int(h) * 60 + int(m)) * 60 + int(s)) * 1000 + int(ms),
+            self.start_offset)))
+        new_end = srt_time(*self.times_from_units(self.map_units(
+            ((int(eh) * 60 + int(em)) * 60 + int(es)) * 1000 + int(ems),
+            self.end_offset)))
+        return new_start + self.time_sep + new_end + extra
+
+    def tail_keys (self, reader):
+        """See Subtitle.tail_keys."""
+        return list(map(int, reader.tail_keys(TAIL_SRT)))
 
     @iterdec(multicall=True)
     def text_block (self, line):
@@ -731,15 +2614,1277 @@ class SrtSub (Subtitle):
         self.IS_BLOCK = False
         return line.rstrip()
 
+    def parse_blocks (self, lines):
+        """
+        Iterate over the subtitle's *lines* a block at a time (the
+        number and time lines, then the text lines up to the blank
+        line) yielding each processed block as a string: only the
+        number and time lines are changed, text lines are rstripped.
+        """
+        lines = iter(lines)
+        if self.index_anchors:
+            lines = self.resolve_anchors(lines)
+        new_sub_num = self.new_sub_num
+        new_time_line = self.new_time_line
+        numline = 0
+        for num_string in lines:
+            numline += 1
+            self.actual_numline = numline
+            self.IS_BLOCK = True
+            num = new_sub_num(num_string)
+            if not self.IN_RANGE and self.tail_reader is not None:
+                self.check_tail(num)
+            block = [str(num)]
+            for time_string in lines:
+                numline += 1
+                self.actual_numline = numline
+                block.append(new_time_line(time_string))
+                for line in lines:
+                    line = line.rstrip()
+                    block.append(line)
+                    if not line:
+                        break
+                if len(block) > 2:
+                    self.IS_BLOCK = False
+                    numline += len(block) - 2
+                    self.actual_numline = numline
+                break
+            if self.IN_RANGE and self.delete_mode:
+                yield '' # a string for each block (see LineFeed)
+            else:
+                block.append('')
+                yield '\n'.join(block)
+
+    def parse_lines (self, lines):
+        """Generator of the output blocks (see parse_blocks)."""
+        return self.parse_blocks(lines)
+
+    def numpy_main (self, lines):
+        """Vectorized main() (see Subtitle.numpy_main)."""
+        if self.delete_mode or self.index_anchors:
+            return None
+        lines = [line.rstrip() for line in lines]
+        nlines = len(lines)
+        if not nlines:
+            return ''
+        lens = numpy.fromiter(map(len, lines), numpy.int64, nlines)
+        starts = numpy.concatenate(([0], numpy.flatnonzero(lens == 0) + 1))
+        starts = starts[starts < nlines]
+        times = starts + 1
+        if (times[-1] >= nlines or (numpy.diff(starts) < 3).any()
+            or (lens[starts] == 0).any()):
+            return None
+        n = len(starts)
+        num_lines = [lines[i] for i in starts.tolist()]
+        if not SRT_NUMBERS.fullmatch('\n'.join(num_lines)):
+            return None
+        try:
+            nums = numpy.fromiter(map(int, num_lines), numpy.int64, n)
+            grid = ('\n'.join(lines[i] for i in times.tolist())
+                    + '\n').encode('ascii')
+        except (OverflowError, UnicodeEncodeError):
+            return None
+        if len(grid) != n * 30:
+            return None
+        grid = numpy.frombuffer(grid, dtype=numpy.uint8).reshape(n, 30)
+        if not ((grid[:, SRT_SEP_COLS] == SRT_SEPS).all()
+                and (grid[:, SRT_DIGIT_COLS] >= 48).all()
+                and (grid[:, SRT_DIGIT_COLS] <= 57).all()):
+            return None
+        progressive = self.new_sub_num == self.progressive_num_block
+        if progressive:
+            mask = numpy.ones(n, dtype=bool)
+            nums = numpy.arange(self.sub_num, self.sub_num + n)
+        else:
+            mask = self.numpy_range_mask(nums)
+            nums = nums + mask * self.delta_sub_num
+        d = grid[:, SRT_DIGIT_COLS].astype(numpy.int64) - 48
+        new = []
+        for col, offset in ((0, self.start_offset), (9, self.end_offset)):
+            units = ((((d[:, col] * 10 + d[:, col+1]) * 60
+                       + d[:, col+2] * 10 + d[:, col+3]) * 60
+                      + d[:, col+4] * 10 + d[:, col+5]) * 1000
+                     + d[:, col+6] * 100 + d[:, col+7] * 10 + d[:, col+8])
+            units = self.map_units(units, offset)
+            if ((units[mask] < 0) | (units[mask] >= 100 * 3600000)).any():
+                return None
+            h, units = numpy.divmod(units, 3600000)
+            m, units = numpy.divmod(units, 60000)
+            s, ms = numpy.divmod(units, 1000)
+            new.extend((h // 10, h % 10, m // 10, m % 10, s // 10, s % 10,
+                        ms // 100, ms // 10 % 10, ms % 10))
+        out = grid.copy()
+        rows = numpy.flatnonzero(mask)
+        out[numpy.ix_(rows, SRT_DIGIT_COLS)] = (
+            numpy.stack(new, axis=1)[rows] + 48)
+        out = out.tobytes().decode('ascii').split('\n')
+        for i, num, time in zip(starts.tolist(), map(str, nums.tolist()), out):
+            lines[i] = num
+            lines[i+1] = time
+        self.IS_BLOCK = nlines - 1 in (starts[-1], times[-1])
+        if progressive:
+            self.sub_num += n
+        lines.append('')
+        return '\n'.join(lines)
+
     def main (self):
         """Doing the job. """       
-        cycle = self.make_iter_blocks(self.num_block,
-                                      self.time_block,
-                                      self.text_block)
-        self.file_out.writelines(self.parse(self.file_in, cycle))
+        lines = self.file_in
+        if self.use_numpy and load_numpy() is not None:
+            lines = self.numpy_run(lines, self.file_out)
+        if lines is not None:
+            self.file_out.writelines(self.parse_blocks(lines))
+        self.finish()
+
+    def finish (self):
+        """See Subtitle.finish."""
         if self.IS_BLOCK and self.IS_WARN:
             warnings.warn("Incomplete block at EOF", IncompleteBlockError)
 
+    @classmethod
+    def iter_cues (cls, file, encoding='utf-8'):
+        """
+        Generator of SrtCue objects read from the binary *file*
+        (*encoding* must be ASCII-compatible). Blank lines between
+        blocks are skipped; raise IndexNumError or MismatchTimeError
+        on malformed number or time lines.
+        """
+        codec = cue_codec(encoding)
+        index = start = end = extra = None
+        text = []
+        for numline, line in raw_lines(file, encoding):
+            if index is None:
+                if not line.strip():
+                    continue
+                match = CUE_NUMBER.fullmatch(line)
+                if match is None:
+                    raise IndexNumError("[at line {}] {}".format(
+                        numline, line.decode(codec, 'replace')))
+                index = int(match.group(1))
+            elif start is None:
+                match = CUE_SRT_TIME.fullmatch(line)
+                if match is None:
+                    raise MismatchTimeError("[at line {}] {!r} (in {})".format(
+                        numline, line, "iter_cues"))
+                h, m, s, ms, eh, em, es, ems = map(int, match.groups()[:8])
+                start = ((h * 60 + m) * 60 + s) * 1000 + ms
+                end = ((eh * 60 + em) * 60 + es) * 1000 + ems
+                extra = match.group(9)
+            elif line:
+                text.append(line)
+            else:
+                yield SrtCue(index, start, end, b'\n'.join(text), codec, extra)
+                index = start = end = extra = None
+                text = []
+        if start is not None:
+            yield SrtCue(index, start, end, b'\n'.join(text), codec, extra)
+        elif index is not None:
+            raise MismatchTimeError("[at line {}] missing time line "
+                                    "(in {})".format(numline, "iter_cues"))
+
+    @classmethod
+    def write_cues (cls, file, cues):
+        """
+        Write the SrtCue objects *cues* in the binary *file*.
+        Raises BadFormatError on negative times.
+        """
+        for cue in cues:
+            if cue.start < 0 or cue.end < 0:
+                raise BadFormatError("negative time in {!r}".format(cue))
+            file.write(b'%d\n%02d:%02d:%02d,%03d --> %02d:%02d:%02d,%03d%s\n'
+                       % ((cue.index,) + split_units(cue.start, 1000)
+                          + split_units(cue.end, 1000) + (cue.extra,)))
+            if cue.raw:
+                file.write(cue.raw + b'\n')
+            file.write(b'\n')
+
+
+###########
+# J O B S #
+###########
+
+def get_subtitle (opts, in_file, out_file):
+    """
+    Return a subtitle object of the type requested in *opts* (an
+    argparse's Namespace), reading from *in_file* and writing
+    to *out_file*, configured with all the time options.
+    Raise OptionError if the options can't be applied.
+    """
+    if opts.subtitle_type == 'srt':
+        newsub = SrtSub(in_file, out_file, opts.unsafe_time_mode,
+                        opts.unsafe_number_mode, opts.ignore_extra,
+                        opts.prog_sub_num != None,
+                        opts.prog_sub_num, opts.preserve_extra)
+        newsub.set_delta(opts.hour, opts.min, opts.sec, opts.ms, opts.num)
+    elif opts.subtitle_type in ('sub', 'microdvd'):
+        use_secs = any((opts.hour, opts.min, opts.sec, opts.ms))
+        if opts.delta_frames and use_secs:
+            raise OptionError("You can't use frames and time delta together")
+        newsub = MicroDVD(in_file, out_file, opts.frames,
+                          opts.unsafe_time_mode, use_secs)
+        newsub.set_delta(opts.hour, opts.min, opts.sec,
+                         opts.ms, opts.delta_frames)
+    elif opts.subtitle_type in ('ass', 'ssa'):
+        newsub = AssSub(in_file, out_file, opts.unsafe_time_mode)
+        newsub.set_delta(opts.hour, opts.min, opts.sec, opts.ms, opts.num)
+    else:
+        raise OptionError(
+            "unknown subtitle type: {!r}".format(opts.subtitle_type))
+    newsub.IS_WARN = opts.is_warn
+    newsub.use_numpy = opts.use_numpy
+    try:
+        start_sub, end_sub = opts.range.split(':')
+        newsub.set_subs_range(int(start_sub) if start_sub else None,
+                              int(end_sub) if end_sub else None)
+    except Exception as e:
+        raise OptionError('invalid -r/--range option: {val} [{err}]'.format(
+            val=opts.range, err=str(e)))
+    if opts.stretch:
+        try:
+            newsub.stretch = get_stretch(opts.stretch)
+        except Exception as e:
+            raise OptionError('invalid --stretch option: {val} [{err}]'.format(
+                val=opts.stretch, err=str(e)))
+    if opts.change_framerate:
+        newsub.change_framerate(*opts.change_framerate)
+    if opts.anchors:
+        if (any((opts.hour, opts.min, opts.sec, opts.ms, opts.delta_frames,
+                 opts.change_framerate)) or any(newsub.stretch)):
+            raise OptionError("--anchors can't be used with the other "
+                              "time options")
+        times, cues = get_anchors(opts.anchors)
+        try:
+            if cues:
+                newsub.set_anchors(times, cues)
+            else:
+                newsub.set_anchors(times)
+        except ValueError as e:
+            raise OptionError('invalid --anchors option: {}'.format(e))
+    return newsub
+
+
+def check_type_options (opts):
+    """
+    Raise OptionError if some of the options in *opts* can't
+    be used with the subtitle type opts.subtitle_type.
+    """
+    if opts.subtitle_type in (None, 'srt'):
+        return
+    opt_err = "Can't use {what} with {subtype} subtitles"
+    if opts.anchors and get_anchors(opts.anchors)[1]:
+        raise OptionError(opt_err.format(subtype=opts.subtitle_type,
+                                         what='cue number --anchors'))
+    for value, name in ((opts.ignore_extra, '-I/--ignore-extra'),
+                        (opts.unsafe_number_mode, '-B/--back-to-the-block'),
+                        (opts.num, '-n/--num')):
+        if value:
+            raise OptionError(
+                opt_err.format(subtype=opts.subtitle_type, what=name))
+
+
+def get_type (in_file):
+    """
+    Detect the type of the subtitle read from *in_file*. Return a pair
+    (type, lines) as sniff_type() does, raise OptionError if unknown.
+    """
+    subtype, lines = sniff_type(in_file)
+    if subtype is None:
+        raise OptionError("can't detect the subtitle type, "
+                          "use the -t/--type option")
+    return subtype, lines
+
+
+def speech_intervals (path, subtitle_type=None, encoding=ENCODING_AUTO,
+                      frames=25):
+    """
+    Returns the times (in seconds) of the cues of the subtitle file
+    *path* as merged intervals (see merge_intervals), detecting its
+    type (if None) and encoding (if ENCODING_AUTO); *frames* is the
+    framerate of MicroDVD subtitles. Raise OptionError if the file
+    can't be read or has no cues.
+    """
+    try:
+        with open_input(path, encoding) as in_file:
+            if subtitle_type is None:
+                subtitle_type = get_type(in_file)[0]
+            encoding = in_file.encoding
+        subtitle_type = TYPE_ALIASES.get(subtitle_type, subtitle_type)
+        if subtitle_type not in ('srt', 'ass', 'sub'):
+            raise OptionError(
+                "unknown subtitle type: {!r}".format(subtitle_type))
+        if not is_ascii_compatible(encoding):
+            raise OptionError("unsupported encoding: {}".format(encoding))
+        cls, per_second = {'srt': (SrtSub, 1000), 'ass': (AssSub, 100),
+                           'sub': (MicroDVD, frames)}[subtitle_type]
+        with open(path, 'rb') as file:
+            intervals = merge_intervals(
+                (cue.start / per_second, cue.end / per_second)
+                for cue in cls.iter_cues(file, encoding))
+    except (OptionError, OSError, LookupError,
+            UnicodeError, BadFormatError) as e:
+        raise OptionError("can't read the cues of '{}': {}".format(path, e))
+    if not intervals:
+        raise OptionError("no cues in '{}'".format(path))
+    return intervals
+
+
+def set_sync (opts, path):
+    """
+    Set in *opts* the time options syncing the subtitle file *path*
+    (of type opts.subtitle_type) to the --sync-to reference, estimated
+    by estimate_sync: the -c/--change-framerate and the time delta
+    (-m in the time units of the type, -f for MicroDVD). Returns the
+    estimate. Raise OptionError if the other time options are used
+    or the files can't be read.
+    """
+    try:
+        stretch = any(get_stretch(opts.stretch or OPT_RANGE))
+    except ValueError:
+        stretch = True
+    if (any((opts.hour, opts.min, opts.sec, opts.ms, opts.delta_frames,
+             opts.change_framerate, opts.anchors)) or stretch):
+        raise OptionError("--sync-to can't be used with the other "
+                          "time options")
+    if opts.skip_bytes:
+        raise OptionError("--sync-to can't be used with -s/--skip-bytes")
+    framerate, shift, overlap = estimate_sync(
+        opts.sync_to, path, opts.subtitle_type, opts.encoding, opts.frames)
+    opts.change_framerate = framerate or False
+    if opts.subtitle_type in ('sub', 'microdvd'):
+        opts.delta_frames = seconds_to_units(shift, opts.frames)
+    elif opts.subtitle_type in ('ass', 'ssa'):
+        opts.ms = seconds_to_units(shift, 100)
+    else:
+        opts.ms = seconds_to_units(shift, 1000)
+    return framerate, shift, overlap
+
+
+def get_index(opts, path, subtitle_type, in_encoding, out_encoding):
+    """
+    Returns the CueIndex of the subtitle file *path* if it can be used
+    with the options *opts* (see the --index and --mmap options) and
+    the input and output encodings, otherwise None.
+    """
+    if (not (opts.use_index or opts.use_mmap) or opts.range == OPT_RANGE
+        or opts.skip_bytes or opts.prog_sub_num is not None
+        or (opts.anchors and get_anchors(opts.anchors)[1])
+        or not (path and os.path.isfile(path))
+        or cue_codec(in_encoding) != cue_codec(out_encoding)):
+        return None
+    subtitle_type = TYPE_ALIASES.get(subtitle_type, subtitle_type)
+    if opts.use_index:
+        return CueIndex.get(path, subtitle_type, in_encoding)
+    return CueIndex.build(path, subtitle_type, in_encoding, complete=False)
+
+
+def process_indexed (newsub, index, path, encoding, out_file,
+                     errors='strict'):
+    """
+    Process with *newsub* only the cues of the file *path* (encoded
+    with *encoding*) in its range, found using the CueIndex *index*,
+    writing them in the text file *out_file*; all the other bytes are
+    copied unchanged through the out_file's binary buffer. Only the
+    regions in range of the memory-mapped file are decoded.
+    """
+    regions = index.regions(
+        index.find_range(newsub.range_start, newsub.range_stop))
+    out_file.write('') # the BOM, if any
+    out_file.flush()
+    with open(path, 'rb') as raw_in, mapped_file(raw_in) as data:
+        pos = 0
+        if (codecs.lookup(encoding).name == 'utf-8-sig'
+            and data[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8):
+            pos = len(codecs.BOM_UTF8)
+        for begin, end, numline in regions:
+            copy_bytes(raw_in, out_file.buffer, pos, begin)
+            newsub.set_files(io.StringIO(
+                data[begin:end].decode(encoding, errors), None), out_file)
+            try:
+                newsub.main()
+            finally:
+                newsub.actual_numline += numline - 1
+            out_file.flush()
+            pos = end
+        copy_bytes(raw_in, out_file.buffer, pos, index.size)
+
+
+def get_tail_reader (opts, newsub, path, in_encoding, out_encoding):
+    """
+    Returns a TailReader of the subtitle file *path* if the tail copy
+    can be used by *newsub* (finding the range keys with its tail_keys
+    method) with the options *opts* (see the --copy-tail option), the
+    input and output encodings and the file's line endings (see
+    is_lf_only), otherwise None.
+    """
+    if (not opts.copy_tail or not opts.range.partition(':')[2].strip()
+        or not hasattr(newsub, 'tail_keys')
+        or opts.skip_bytes or not (path and os.path.isfile(path))
+        or not is_ascii_compatible(in_encoding)
+        or cue_codec(in_encoding) != cue_codec(out_encoding)):
+        return None
+    with open(path, 'rb') as f, mapped_file(f) as data:
+        if not is_lf_only(data):
+            return None
+    return TailReader(path, in_encoding, opts.enc_err)
+
+
+def process_tail (newsub, reader, out_file):
+    """
+    Process with *newsub* the lines read by the TailReader *reader*,
+    writing them in the text file *out_file*, until the range end is
+    passed: then the rest of the input is copied unchanged through
+    the out_file's binary buffer (see Subtitle.check_tail).
+    """
+    newsub.set_files(reader, out_file)
+    newsub.tail_reader = reader
+    out_file.write('') # the BOM, if any
+    try:
+        newsub.main()
+    except TailCopy:
+        newsub.IS_BLOCK = False
+        out_file.flush()
+        copy_bytes(reader.file, out_file.buffer, reader.line_offset,
+                   os.fstat(reader.file.fileno()).st_size)
+    finally:
+        reader.close()
+
+
+def run_subtitle (opts, newsub, path, in_file, writer):
+    """
+    Process with *newsub* the subtitle read from the text file *in_file*
+    (the file *path*, if any) writing it to *writer* (a ChunkWriter),
+    through the cue index or the tail copy if they can be used with
+    the options *opts* (see get_index and get_tail_reader).
+    """
+    index = get_index(opts, path, opts.subtitle_type,
+                      in_file.encoding, writer.encoding)
+    reader = (get_tail_reader(opts, newsub, path, in_file.encoding,
+                              writer.encoding)
+              if index is None else None)
+    if index is not None:
+        process_indexed(newsub, index, path, in_file.encoding,
+                        writer, opts.enc_err)
+    elif reader is not None:
+        process_tail(newsub, reader, writer)
+    else:
+        newsub.main()
+    writer.flush()
+
+
+def _job_timeout (signum, frame):
+    raise JobTimeoutError("job timed out")
+
+
+def process_file (opts, infile, outfile, subtitle_type=None):
+    """
+    Process the subtitle *infile* writing the result in *outfile*,
+    using the options in *opts* (and *subtitle_type*, if given, in
+    place of opts.subtitle_type). Return None on success, otherwise
+    a string describing the error. Used as a batch worker.
+    """
+    import signal
+    if subtitle_type is not None:
+        opts = copy.copy(opts)
+        opts.subtitle_type = subtitle_type
+    timer = bool(opts.timeout) and hasattr(signal, 'setitimer')
+    newsub = None
+    if timer:
+        signal.signal(signal.SIGALRM, _job_timeout)
+        signal.setitimer(signal.ITIMER_REAL, opts.timeout)
+    try:
+        os.makedirs(os.path.dirname(outfile) or os.curdir, exist_ok=True)
+        with open_input(infile, opts.encoding, opts.enc_err) as in_file, \
+             open(outfile, 'w', encoding=in_file.encoding,
+                  errors=opts.enc_err) as out_file:
+            if opts.skip_bytes:
+                skip_bytes(in_file, opts.skip_bytes)
+            sub_in = in_file
+            if not opts.subtitle_type:
+                opts = copy.copy(opts)
+                opts.subtitle_type, sub_in = get_type(in_file)
+                check_type_options(opts)
+            writer = ChunkWriter(out_file, opts.buffer_size)
+            newsub = get_subtitle(opts, sub_in, writer)
+            run_subtitle(opts, newsub, infile, in_file, writer)
+    except Exception as e:
+        if os.path.exists(outfile):
+            os.remove(outfile)
+        return "{err}: [at line {line}] {msg}".format(
+            err=e.__class__.__name__,
+            line=newsub.actual_numline if newsub else 0, msg=str(e))
+    finally:
+        if timer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return None
+
+
+def get_batch_jobs (patterns, output_dir):
+    """
+    Return a list of (input, output, None) jobs for the files
+    matching *patterns*, with the outputs placed in *output_dir*.
+    Raise OptionError on missing files, clashing output names or
+    outputs which are the input files themselves.
+    """
+    import glob
+    jobs = {}
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)) or [pattern]:
+            if not os.path.isfile(path):
+                raise OptionError("invalid input file '{}'".format(path))
+            out = os.path.join(output_dir, os.path.basename(path))
+            if os.path.exists(out) and os.path.samefile(out, path):
+                raise OptionError("the output of '{}' is the input file "
+                                  "itself".format(path))
+            if out in jobs and jobs[out] != path:
+                raise OptionError("files '{}' and '{}' have the same "
+                                  "output '{}'".format(jobs[out], path, out))
+            jobs[out] = path
+    return [(i, o, None) for o, i in jobs.items()]
+
+
+def get_fingerprint (opts):
+    """
+    Return a string identifying the options in *opts*
+    which affects the content of the processed files.
+    """
+    import hashlib
+    items = sorted((k, v) for k, v in vars(opts).items()
+                   if k not in FINGERPRINT_EXCLUDE)
+    return hashlib.sha1(repr(items).encode('utf-8')).hexdigest()
+
+
+def load_manifest (output_dir):
+    """Return the manifest dict stored in *output_dir*, if any."""
+    import json
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def save_manifest (output_dir, manifest):
+    """Atomically write *manifest* in *output_dir*."""
+    import json
+    import tempfile
+    fd, path = tempfile.mkstemp(prefix=MANIFEST_NAME, dir=output_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, sort_keys=True)
+    os.replace(path, os.path.join(output_dir, MANIFEST_NAME))
+
+
+def get_tree_jobs (input_dir, output_dir, manifest, fingerprint,
+                   subtitle_type=None):
+    """
+    Walk the *input_dir* tree and return a pair (jobs, skipped), where
+    jobs is a list of (input, output, type) for the subtitles which
+    must be processed, mirroring the tree in *output_dir*, and skipped
+    the number of files up to date, i.e. with an output newer than the
+    input and made with the same options *fingerprint* in *manifest*.
+    If *subtitle_type* is given, only files of that type are considered.
+    """
+    jobs = []
+    skipped = 0
+    output_root = os.path.realpath(output_dir)
+    wanted = TYPE_ALIASES.get(subtitle_type, subtitle_type)
+    dirs = ['']
+    while dirs:
+        reldir = dirs.pop()
+        with os.scandir(os.path.join(input_dir, reldir)) as it:
+            entries = sorted(it, key=lambda e: e.name)
+        for entry in entries:
+            relpath = os.path.join(reldir, entry.name)
+            if entry.is_dir():
+                if os.path.realpath(entry.path) != output_root:
+                    dirs.append(relpath)
+                continue
+            subtype = EXT_TYPES.get(os.path.splitext(entry.name)[1].lower())
+            if subtype is None or not entry.is_file():
+                continue
+            if wanted and wanted != TYPE_ALIASES.get(subtype, subtype):
+                continue
+            outpath = os.path.join(output_dir, relpath)
+            if manifest.get(relpath) == fingerprint:
+                try:
+                    if (os.stat(outpath).st_mtime_ns
+                        > entry.stat().st_mtime_ns):
+                        skipped += 1
+                        continue
+                except FileNotFoundError:
+                    pass
+            jobs.append((entry.path, outpath, subtype))
+    return jobs, skipped
+
+
+def run_batch (opts, jobs):
+    """
+    Process the (input, output, type) *jobs* in a pool of *opts.jobs*
+    processes. Return a sorted list of (input, error_message)
+    pairs for the failed jobs.
+    """
+    import concurrent.futures
+    errors = []
+    pool_args = {'max_workers': max(1, opts.jobs)}
+    if opts.max_tasks:
+        pool_args['max_tasks_per_child'] = opts.max_tasks
+    with concurrent.futures.ProcessPoolExecutor(**pool_args) as pool:
+        futures = {pool.submit(process_file, opts, *job): job[0]
+                   for job in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                err = future.result()
+            except Exception as e:
+                err = "{}: {}".format(e.__class__.__name__, e)
+            if err is not None:
+                errors.append((futures[future], err))
+    return sorted(errors)
+
+
+#########
+# A P I #
+#########
+
+class Transformer:
+    """
+    A configured subtitle transformation, usable in place of the
+    command line: the options are checked once, then the object can
+    be called any number of times (from several threads too) as
+    transformer(src, dst=None), see __call__.
+
+    *fmt* is the subtitle type ('srt', 'ass', 'ssa', 'sub' or
+    'microdvd'; if None it's detected for every input). *shift* is
+    the time delta in seconds (a number or a datetime.timedelta),
+    rounded to the time units of the subtitle (ms for SubRip,
+    hundredths for SubStation Alpha, frames for MicroDVD). *range*
+    is a 'START:END' string or a (start, end) pair (None for no
+    bound), *stretch* a 'LSHIFT:RSHIFT' string or a (left, right)
+    pair and *framerate* an (old, new) pair, as in the -r/--range,
+    --stretch and -c/--change-framerate options. *encoding* and
+    *errors* are the ones of the -e and -E options. Any other
+    command line option can be given by its *options* name (the
+    attributes of get_parser().parse_args(), e.g. unsafe_time_mode=True),
+    but the ones about batches and files (see TRANSFORM_EXCLUDE).
+    Raise OptionError if the options are invalid.
+    """
+    def __init__ (self, fmt=None, shift=0, range=None, stretch=None,
+                  framerate=None, encoding=None, errors=None, **options):
+        import argparse
+        import datetime
+        opts = argparse.Namespace(**get_defaults())
+        for name, value in options.items():
+            if name in TRANSFORM_EXCLUDE or not hasattr(opts, name):
+                raise OptionError("unknown option: {!r}".format(name))
+            setattr(opts, name, value)
+        opts.subtitle_type = fmt
+        if encoding is not None:
+            opts.encoding = encoding
+        if errors is not None:
+            opts.enc_err = errors
+        try:
+            if range is not None:
+                opts.range = (range if isinstance(range, str) else
+                              ':'.join('' if x is None else str(int(x))
+                                       for x in range))
+            if stretch is not None:
+                opts.stretch = (stretch if isinstance(stretch, str) else
+                                ':'.join(str(int(x)) for x in stretch))
+            if framerate is not None:
+                opts.change_framerate = tuple(map(float, framerate))
+            if isinstance(shift, datetime.timedelta):
+                shift = Fraction(shift // datetime.timedelta(microseconds=1),
+                                 10**6)
+            self.shift = Fraction(str(shift) if isinstance(shift, float)
+                                  else shift)
+            if opts.encoding != ENCODING_AUTO:
+                codecs.lookup(opts.encoding)
+            codecs.lookup_error(opts.enc_err)
+        except (TypeError, ValueError, LookupError) as e:
+            raise OptionError(str(e))
+        if (opts.prog_sub_num is not None
+            and (opts.num or opts.range != OPT_RANGE)):
+            raise OptionError('prog_sub_num conflicts with {}'.format(
+                ('range', 'num')[bool(opts.num)]))
+        if opts.skip_bytes is not None and opts.skip_bytes < 0:
+            raise OptionError('skip_bytes must be a positive value')
+        if opts.buffer_size < 0:
+            raise OptionError('buffer_size must be a positive value')
+        check_type_options(opts)
+        self.opts = opts
+        # check the time options on a subtitle of the given type
+        probe = copy.copy(opts)
+        probe.subtitle_type = fmt or 'srt'
+        self.get_subtitle(probe, None, None)
+
+    def get_subtitle (self, opts, in_file, out_file):
+        """Returns the subtitle object (see get_subtitle), shifted."""
+        newsub = get_subtitle(opts, in_file, out_file)
+        if not self.shift:
+            return newsub
+        if newsub.anchors is not None:
+            raise OptionError("--anchors can't be used with a shift")
+        if isinstance(newsub, MicroDVD):
+            if newsub._use_sec:
+                raise OptionError(
+                    "You can't use frames and time delta together")
+            newsub.delta_frames += round(self.shift * newsub.frames)
+        else:
+            newsub.delta_ms += round(self.shift * newsub.UNITS)
+        newsub.compile_times()
+        return newsub
+
+    def open_input (self, src):
+        """
+        Returns a pair (file, path): the text file to read *src* from
+        (see __call__) and its path, if any.
+        """
+        opts = self.opts
+        if isinstance(src, os.PathLike):
+            path = os.fspath(src)
+            if not os.path.isfile(path):
+                raise OptionError("invalid input file '{}'".format(path))
+            return open_input(path, opts.encoding, opts.enc_err), path
+        if not isinstance(src, (str, bytes, bytearray, memoryview)):
+            if not hasattr(src, 'read'):
+                raise TypeError('invalid input: {!r}'.format(src))
+            src = src.read()
+        if isinstance(src, str):
+            return io.StringIO(src, None), None
+        src = bytes(src)
+        encoding = opts.encoding
+        if encoding == ENCODING_AUTO:
+            encoding = detect_encoding(src[:ENCODING_SAMPLE])
+        return io.TextIOWrapper(io.BytesIO(src), encoding, opts.enc_err), None
+
+    def open_output (self, dst, encoding):
+        """
+        Returns the text file to write *dst* (see __call__, a path
+        or a file object) to, using *encoding* if it's encoded.
+        """
+        errors = self.opts.enc_err
+        if isinstance(dst, os.PathLike):
+            path = os.fspath(dst)
+            if os.path.exists(path):
+                return ReplaceFile(path, encoding, errors)
+            return open(path, 'w', encoding=encoding, errors=errors)
+        if not hasattr(dst, 'write'):
+            raise TypeError('invalid output: {!r}'.format(dst))
+        if (isinstance(dst, (io.RawIOBase, io.BufferedIOBase))
+            or 'b' in getattr(dst, 'mode', '')):
+            return io.TextIOWrapper(dst, encoding, errors)
+        return dst
+
+    def __call__ (self, src, dst=None):
+        """
+        Transform the subtitle *src*: a path (any os.PathLike object,
+        e.g. a pathlib.Path), a text or binary file object, the text
+        of the subtitle (a str) or its encoded content (bytes). The
+        result is written to *dst*, a path (replaced only on success)
+        or a text or binary file object, or returned if *dst* is None
+        (as str, or as bytes if *src* are bytes). Raise OptionError
+        for invalid inputs (e.g. of unknown type), BadFormatError (or
+        its subclasses) and UnicodeError for invalid subtitles: these
+        have the number of the wrong line as the *line* attribute.
+        """
+        opts = self.opts
+        newsub = None
+        in_file, path = self.open_input(src)
+        encoding = in_file.encoding
+        if encoding is None:
+            encoding = ('utf-8' if opts.encoding == ENCODING_AUTO
+                        else opts.encoding)
+        if dst is not None:
+            out_file = self.open_output(dst, encoding)
+        elif isinstance(src, (bytes, bytearray, memoryview)):
+            out_file = io.TextIOWrapper(io.BytesIO(), encoding, opts.enc_err)
+        else:
+            out_file = io.StringIO()
+        try:
+            if opts.skip_bytes:
+                skip_bytes(in_file, opts.skip_bytes)
+            sub_in = in_file
+            if not opts.subtitle_type:
+                opts = copy.copy(opts)
+                opts.subtitle_type, sub_in = get_type(in_file)
+                check_type_options(opts)
+            writer = ChunkWriter(out_file, opts.buffer_size)
+            newsub = self.get_subtitle(opts, sub_in, writer)
+            run_subtitle(opts, newsub,
+                         path if hasattr(out_file, 'buffer') else None,
+                         in_file, writer)
+            if isinstance(out_file, ReplaceFile):
+                out_file.commit()
+        except (BadFormatError, UnicodeError) as e:
+            e.line = newsub.actual_numline if newsub else 0
+            self.close_output(dst, out_file, False)
+            raise
+        except BaseException:
+            self.close_output(dst, out_file, False)
+            raise
+        finally:
+            if path is not None:
+                in_file.close()
+        if dst is None:
+            if isinstance(out_file, io.StringIO):
+                return out_file.getvalue()
+            out_file.flush()
+            return out_file.detach().getvalue()
+        self.close_output(dst, out_file, True)
+        return None
+
+    @staticmethod
+    def close_output (dst, out_file, success):
+        """
+        Close *out_file* if opened for the path *dst* (removing it on
+        failure, if not *success*) or detach it from a binary *dst*.
+        """
+        if out_file is dst or dst is None:
+            return
+        if not isinstance(dst, os.PathLike):
+            if success:
+                out_file.flush()
+            out_file.detach()
+        elif isinstance(out_file, ReplaceFile) or success:
+            out_file.close()
+        else:
+            out_file.close()
+            os.remove(out_file.name)
+
+    def incremental (self, sample_size=ENCODING_SAMPLE):
+        """Returns an IncrementalTransform using this transformer."""
+        return IncrementalTransform(self, sample_size)
+
+    async def stream (self, chunks):
+        """
+        Asynchronous generator of the transformed subtitle, in chunks
+        of bytes, read from *chunks*: an asyncio.StreamReader (or any
+        object with a read() coroutine) or an async iterable of bytes.
+        The subtitle is processed as its cues are received, without
+        threads (see IncrementalTransform), so any number of streams
+        can run concurrently in one event loop.
+        """
+        job = self.incremental()
+        read = getattr(chunks, 'read', None)
+        if read is not None:
+            while True:
+                chunk = await read(OUTPUT_BUFSIZE)
+                if not chunk:
+                    break
+                data = job.push(chunk)
+                if data:
+                    yield data
+        else:
+            async for chunk in chunks:
+                data = job.push(chunk)
+                if data:
+                    yield data
+        data = job.push(b'', True)
+        if data:
+            yield data
+
+
+class IncrementalTransform:
+    """
+    Transform a subtitle received in pieces, with the options of the
+    Transformer *transformer*: push() is called with every chunk of
+    bytes, returning the output ready so far. The subtitle's engine
+    (parse_lines) runs on the complete cues received (see LineFeed),
+    so the parsing is the same as reading the whole file and so are
+    the errors, with the number of the wrong line as *line*. The
+    input is buffered for the type detection, if the type is not
+    given, up to the first line telling it, and for the encoding
+    detection (-e auto), up to *sample_size* bytes. The --numpy,
+    --index, --mmap and --copy-tail options, which need the whole
+    input, are not used. The output is encoded as the input, unless
+    *output_encoding* is set (e.g. to the one of sys.stdout), or with
+    the *encoder* already set (e.g. by a previous job on the same
+    output, which wrote the BOM).
+    """
+    def __init__ (self, transformer, sample_size=ENCODING_SAMPLE):
+        self.transformer = transformer
+        self.sample_size = sample_size
+        self.opts = transformer.opts
+        self.encoding = (None if self.opts.encoding == ENCODING_AUTO
+                         else self.opts.encoding)
+        self.output_encoding = None
+        self.skip = self.opts.skip_bytes or 0
+        self.raw = b''
+        self.text = ''
+        self.decoder = self.encoder = None
+        self.newsub = self.feed = self.output = None
+        self.pending = []
+        self.pending_size = 0
+
+    def push (self, data, final=False):
+        """
+        Add the bytes *data* to the input (the last chunk if *final*)
+        and returns the bytes of output ready, gathered in chunks of
+        the --buffer-size size (all of them if *final*).
+        """
+        if self.decoder is None:
+            self.raw += data
+            if (self.encoding is None and not final
+                and len(self.raw) < self.sample_size):
+                return b''
+            data, self.raw = self.raw, b''
+            if self.encoding is None:
+                self.encoding = detect_encoding(data[:ENCODING_SAMPLE])
+            errors = self.opts.enc_err
+            self.decoder = io.IncrementalNewlineDecoder(
+                codecs.getincrementaldecoder(self.encoding)(errors), True)
+            if self.encoder is None:
+                self.encoder = codecs.getincrementalencoder(
+                    self.output_encoding or self.encoding)(errors)
+        try:
+            self.push_text(self.decoder.decode(data, final), final)
+        except (BadFormatError, UnicodeError) as e:
+            e.line = self.newsub.actual_numline if self.newsub else 0
+            raise
+        if not final and self.pending_size < self.opts.buffer_size:
+            return b''
+        data = self.encoder.encode(''.join(self.pending), final)
+        self.pending.clear()
+        self.pending_size = 0
+        return data
+
+    def push_text (self, text, final):
+        """Process the decoded *text*, gathering the output."""
+        if self.skip:
+            size = min(self.skip, len(text))
+            text = text[size:]
+            self.skip -= size
+        if self.newsub is None:
+            self.text += text
+            if not (self.opts.subtitle_type or final or self.sniffed()):
+                return
+            text, self.text = self.text, ''
+            self.start(text)
+        self.feed.push(text, final)
+        output = self.output
+        pending = self.pending
+        count = len(pending)
+        for _ in range(self.feed.units):
+            pending.append(next(output))
+        self.feed.units = 0
+        if final:
+            pending.extend(output)
+            self.newsub.finish()
+        self.pending_size += sum(map(len, itertools.islice(
+            pending, count, None)))
+
+    def sniffed (self):
+        """
+        True if the subtitle type can be detected from the text read so
+        far: one of its complete lines tells it (sniff_type stops at the
+        first one) or the text is as long as the detection limits.
+        """
+        text = self.text
+        if len(text) >= SNIFF_SIZE or text.count('\n') >= SNIFF_LINES:
+            return True
+        return sniff_type(io.StringIO(text[:text.rfind('\n') + 1]))[0] \
+            is not None
+
+    def start (self, text):
+        """Make the subtitle, detecting its type from *text* if needed."""
+        opts = self.opts
+        if not opts.subtitle_type:
+            opts = copy.copy(opts)
+            opts.subtitle_type, _ = get_type(io.StringIO(text))
+            check_type_options(opts)
+        self.newsub = self.transformer.get_subtitle(opts, None, None)
+        if getattr(self.newsub, 'index_anchors', None):
+            raise OptionError("cue number --anchors can't be used "
+                              "on streams")
+        self.feed = LineFeed(self.newsub.STREAM_BLOCKS)
+        self.output = self.newsub.parse_lines(self.feed)
+
+
+@functools.lru_cache(maxsize=None)
+def get_defaults ():
+    """
+    Returns a dict of the default options (the parser
+    is built only once, the first time it's needed).
+    """
+    return vars(get_parser().parse_args([]))
+
+
+@functools.lru_cache(maxsize=TRANSFORM_CACHE)
+def get_transformer (*args, **kwords):
+    """
+    Returns a Transformer of the given arguments, reusing the ones
+    already made for the same arguments (which must be hashable).
+    """
+    return Transformer(*args, **kwords)
+
+
+def find_transformer (fmt, shift, range, stretch, framerate,
+                      encoding, errors, options):
+    """
+    Returns the cached Transformer (see get_transformer) of the given
+    arguments, the sequences *range*, *stretch* and *framerate* as
+    tuples (so hashable).
+    """
+    if range is not None and not isinstance(range, str):
+        range = tuple(range)
+    if stretch is not None and not isinstance(stretch, str):
+        stretch = tuple(stretch)
+    if framerate is not None:
+        framerate = tuple(framerate)
+    if options.get('anchors') is not None:
+        options['anchors'] = tuple(a if isinstance(a, str) else tuple(a)
+                                   for a in options['anchors'])
+    return get_transformer(fmt, shift, range, stretch, framerate,
+                           encoding, errors, **options)
+
+
+def transform (src, dst=None, fmt=None, shift=0, range=None, stretch=None,
+               framerate=None, encoding=None, errors=None, **options):
+    """
+    Transform the subtitle *src* writing it to *dst*, or returning it
+    if None: the library version of the command line. See Transformer
+    for the arguments and the exceptions raised, Transformer.__call__
+    for the types of *src* and *dst*. The configured transformers are
+    cached, so repeated calls with the same options are cheap.
+    """
+    return find_transformer(fmt, shift, range, stretch, framerate,
+                            encoding, errors, options)(src, dst)
+
+
+def atransform (chunks, fmt=None, shift=0, range=None, stretch=None,
+                framerate=None, encoding=None, errors=None, **options):
+    """
+    Asynchronous version of transform(): returns an async generator
+    of the transformed subtitle, in chunks of bytes, read from
+    *chunks* (see Transformer.stream).
+    """
+    return find_transformer(fmt, shift, range, stretch, framerate,
+                            encoding, errors, options).stream(chunks)
+
+
+def estimate_sync (reference, src, fmt=None, encoding=ENCODING_AUTO,
+                   frames=25, use_numpy=True):
+    """
+    Estimate the framerate change and the shift syncing the subtitle
+    file *src* (of type *fmt*, detected if None, and *encoding*) to the
+    *reference* subtitle file (any type and encoding, detected): their
+    cues are compared as speech signals (see find_sync), using NumPy
+    if available and *use_numpy* is true. Returns a triple (framerate,
+    shift, overlap), the first two usable as the same arguments of
+    transform(). *frames* is the framerate of MicroDVD files.
+    Raise OptionError if the files can't be read.
+    """
+    reference = speech_intervals(os.fspath(reference), frames=frames)
+    intervals = speech_intervals(os.fspath(src), fmt, encoding, frames)
+    return find_sync(reference, intervals,
+                     load_numpy() if use_numpy else None)
+
+
+def serve_path (root, path):
+    """
+    Returns the pathlib.Path of the job's *path*, relative to the
+    directory *root*; raise OptionError if it's outside of *root*.
+    """
+    import pathlib
+    root = os.path.realpath(root)
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath((root, full)) != root:
+        raise OptionError("path outside of the served directory: "
+                          "{!r}".format(path))
+    return pathlib.Path(full)
+
+
+def serve_job (line, root=os.curdir):
+    """
+    Run the job in *line* (a JSON object, see --serve), its paths
+    relative to the directory *root* (see serve_path), and returns
+    its result as a dict, with the "id" of the job (if any), the
+    "status" ("ok" or "error") and the "elapsed" time in seconds.
+    On success it has the output "text" too, if the job has no
+    "output" path, otherwise the "error" (the exception's name), the
+    "message" and the "line" (of the subtitle) of the failure.
+    The transformers are cached between jobs (see transform()).
+    """
+    import json
+    start = time.perf_counter()
+    result = {'id': None}
+    try:
+        job = json.loads(line)
+        if not isinstance(job, dict):
+            raise OptionError('the job must be a JSON object')
+        result['id'] = job.get('id')
+        if ('input' in job) == ('text' in job):
+            raise OptionError('the job needs either "input" or "text"')
+        src = (serve_path(root, job['input']) if 'input' in job
+               else job['text'])
+        dst = serve_path(root, job['output']) if job.get('output') else None
+        # JSON arrays to tuples, for the transformers cache
+        options = {name: tuple(value) if isinstance(value, list) else value
+                   for name, value in (job.get('options') or {}).items()}
+        text = transform(src, dst, job.get('type'), job.get('shift', 0),
+                         job.get('range'), job.get('stretch'),
+                         job.get('framerate'), job.get('encoding'),
+                         job.get('errors'), **options)
+        result['status'] = 'ok'
+        if text is not None:
+            result['text'] = text
+    except Exception as e:
+        result.update(status='error', error=e.__class__.__name__,
+                      message=str(e), line=getattr(e, 'line', None))
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+
+def serve (in_file, out_file, root=os.curdir):
+    """
+    Run the jobs read from the binary file *in_file*, one per line,
+    writing the results as JSON lines in the text file *out_file*
+    (see serve_job for *root*).
+    """
+    import json
+    for line in in_file:
+        if line.strip():
+            print(json.dumps(serve_job(line, root)), file=out_file,
+                  flush=True)
+
+
+def serve_connection (conn, pool, root=os.curdir):
+    """
+    Run the jobs read from the socket *conn* in the process *pool*,
+    writing back the results (see serve), then close *conn*. The
+    "total" time of a result includes the wait for a free worker.
+    """
+    import json
+    with conn, conn.makefile('rb') as in_file, \
+         conn.makefile('w', encoding='utf-8') as out_file:
+        try:
+            for line in in_file:
+                if not line.strip():
+                    continue
+                start = time.perf_counter()
+                result = pool.submit(serve_job, line, root).result()
+                result['total'] = time.perf_counter() - start
+                print(json.dumps(result), file=out_file, flush=True)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def serve_socket (path, jobs, root=os.curdir):
+    """
+    Accept the connections of any number of clients on the Unix-domain
+    socket *path* (made with mode 0600), each one served by a thread
+    (see serve_connection) running the jobs in a pool of *jobs*
+    processes, until terminated (by SIGTERM or SIGINT); the socket
+    file is then removed. See serve_job for *root*.
+    """
+    import concurrent.futures
+    import multiprocessing
+    import signal
+    import socket
+    import threading
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    # spawned, not forked: a worker started while serving a connection
+    # must not inherit its socket (the client would never get the EOF)
+    context = multiprocessing.get_context('spawn')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server, \
+         concurrent.futures.ProcessPoolExecutor(max(1, jobs),
+                                                context) as pool:
+        umask = os.umask(0o177)
+        try:
+            server.bind(path)
+        finally:
+            os.umask(umask)
+        try:
+            server.listen()
+            while True:
+                conn, _ = server.accept()
+                threading.Thread(target=serve_connection,
+                                 args=(conn, pool, root), daemon=True).start()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(path)
+
+
+def run_live (job, in_fd, out_file):
+    """
+    Run the IncrementalTransform *job* on the input read unbuffered
+    from the file descriptor *in_fd*, as the data arrives, writing
+    and flushing the output to the binary file object *out_file*
+    after every read (see --live).
+    """
+    while True:
+        data = os.read(in_fd, OUTPUT_BUFSIZE)
+        out = job.push(data, not data)
+        if out:
+            out_file.write(out)
+            out_file.flush()
+        if not data:
+            break
+
+
+def follow (path, make_job, out_file, is_warn=False):
+    """
+    Follow the file *path* while it grows (see --follow), pushing the
+    bytes appended to the IncrementalTransform returned by *make_job*
+    and writing (and flushing) its output to the binary file object
+    *out_file*. If the file is truncated or replaced, after reading
+    the rest of the old one, the new content is processed from the
+    start with a new job, going on with the encoder of the previous
+    one (the output is a single stream). Runs until interrupted.
+    """
+    def restart (job):
+        new = make_job()
+        if job is not None:
+            new.encoder = job.encoder
+        return new
+    watcher = FileWatcher(path)
+    in_file = job = None
+    delay = FOLLOW_POLL
+    try:
+        while True:
+            changed = False
+            while in_file is not None:
+                data = in_file.read(OUTPUT_BUFSIZE)
+                if not data:
+                    break
+                changed = True
+                out = job.push(data)
+                if out:
+                    out_file.write(out)
+                    out_file.flush()
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stat = None
+            if stat is not None:
+                if in_file is None or not os.path.samestat(
+                        stat, os.fstat(in_file.fileno())):
+                    if in_file is not None:
+                        in_file.close()
+                        if is_warn:
+                            warnings.warn("'{}' has been replaced, "
+                                          "following the new file".format(
+                                              path))
+                    in_file = open(path, 'rb', buffering=0)
+                    job = restart(job)
+                    watcher.watch()
+                    delay = FOLLOW_POLL
+                    continue
+                if stat.st_size < in_file.tell():
+                    if is_warn:
+                        warnings.warn("'{}' has been truncated".format(path))
+                    in_file.seek(0)
+                    job = restart(job)
+                    delay = FOLLOW_POLL
+                    continue
+            delay = FOLLOW_POLL if changed else min(delay * 2,
+                                                    FOLLOW_MAX_POLL)
+            watcher.wait(delay)
+    finally:
+        watcher.close()
+        if in_file is not None:
+            in_file.close()
+
 
 ###########
 # M A I N #
@@ -748,14 +3893,96 @@ class SrtSub (Subtitle):
 if __name__ == '__main__':
     parser = get_parser()
     opts = parser.parse_args()
-    opt_err = Template("Can't use $what with $subtype subtitles\n")
-    opt_err_pairs = (
-        [opts.ignore_extra, '-I/--ignore-extra'],
-        [opts.unsafe_number_mode, '-B/--back-to-the-block'],
-        [opts.num, '-n/--num'])
     if opts.info:
         print(__doc__)
         sys.exit(0)
+    if opts.batch and opts.recursive:
+        parser.error("--batch and -R/--recursive are mutually exclusive")
+    if opts.socket and not opts.serve:
+        parser.error("--socket requires --serve")
+    if opts.sync_to and any((opts.serve, opts.live, opts.follow,
+                             opts.batch, opts.recursive)):
+        parser.error("--sync-to can not be used in conjunction with "
+                     "--serve, --live, --follow, --batch or -R/--recursive")
+    if opts.serve:
+        defaults = get_defaults()
+        if any(value != defaults[name] for name, value in vars(opts).items()
+               if name not in SERVE_OPTIONS):
+            parser.error("--serve can be used only with --serve-root, "
+                         "--socket and -j/--jobs (the other options "
+                         "are given by the jobs)")
+        if not os.path.isdir(opts.serve_root):
+            parser.error("invalid --serve-root directory '{}'".format(
+                opts.serve_root))
+        if opts.socket and os.path.exists(opts.socket):
+            parser.error("socket '{}' already exists".format(opts.socket))
+        if opts.socket:
+            serve_socket(opts.socket, opts.jobs, opts.serve_root)
+        else:
+            try:
+                serve(sys.stdin.buffer, sys.stdout, opts.serve_root)
+            except KeyboardInterrupt:
+                print('csub: User Interrupt', file=sys.stderr)
+        sys.exit(0)
+    if opts.live or opts.follow:
+        mode = '--follow' if opts.follow else '--live'
+        if any((opts.same_file, opts.batch, opts.recursive)):
+            parser.error("{} can not be used in conjunction with "
+                         "-O/--same-file, --batch or -R/--recursive".format(
+                             mode))
+        if opts.follow and not opts.infile:
+            parser.error("--follow requires -i/--input-file")
+        if (opts.infile and opts.outfile
+            and all(map(os.path.exists, (opts.infile, opts.outfile)))
+            and os.path.samefile(opts.infile, opts.outfile)):
+            parser.error("{} can't write the output to the input file "
+                         "(see -O/--same-file)".format(mode))
+        try:
+            if opts.anchors and get_anchors(opts.anchors)[1]:
+                parser.error("cue number --anchors can't be used with "
+                             "{}".format(mode))
+        except OptionError as e:
+            parser.error(str(e))
+        options = {k: v for k, v in vars(opts).items()
+                   if k not in TRANSFORM_EXCLUDE}
+        options['buffer_size'] = 0
+        try:
+            transformer = Transformer(opts.subtitle_type, **options)
+        except OptionError as e:
+            parser.error(str(e))
+        def make_job ():
+            job = transformer.incremental(0)
+            if not opts.outfile and opts.encoding != ENCODING_AUTO:
+                job.output_encoding = sys.stdout.encoding
+            return job
+        try:
+            out_file = (open(opts.outfile, 'wb') if opts.outfile
+                        else sys.stdout.buffer)
+            if opts.follow:
+                follow(opts.infile, make_job, out_file, opts.is_warn)
+            else:
+                in_fd = (os.open(opts.infile, os.O_RDONLY) if opts.infile
+                         else sys.stdin.fileno())
+                run_live(make_job(), in_fd, out_file)
+        except OptionError as e: # the type detection
+            parser.error(str(e))
+        except (BadFormatError, UnicodeError) as e:
+            print("{err}: [at line {line}] {msg}\n".format(
+                err=e.__class__.__name__, line=e.line, msg=str(e)),
+                  file=sys.stderr)
+            sys.exit(1)
+        except (OSError, LookupError) as e:
+            print('{prog}: {err}'.format(prog=sys.argv[0], err=e),
+                  file=sys.stderr)
+            sys.exit(1)
+        except KeyboardInterrupt:
+            print('csub: User Interrupt')
+        sys.exit(0)
+    if ((opts.batch or opts.recursive)
+        and any((opts.infile, opts.outfile, opts.same_file))):
+        parser.error("--batch and -R/--recursive can not be used in "
+                     "conjunction with -i/--input-file, -o/--output-file "
+                     "or -O/--same-file")
     if opts.same_file:
         if any((opts.infile, opts.outfile)):
             print(('{}: -O/--same-file can not be used in conjunction with '
@@ -764,7 +3991,7 @@ if __name__ == '__main__':
             sys.exit(1)
         else:
             opts.infile = opts.outfile = opts.same_file
-    if opts.subtitle_type == 'srt':
+    if opts.subtitle_type in ('srt', None):
         if ((opts.prog_sub_num is not None)
             and (opts.num or (opts.range != OPT_RANGE))):
             co = ('-r/--range', '-n/--number')[bool(opts.num)]
@@ -773,66 +4000,104 @@ if __name__ == '__main__':
                       sys.argv[0], co), file=sys.stderr)
             sys.exit(1)
     try:
-        codecs.lookup(opts.encoding.lower())
+        if opts.encoding != ENCODING_AUTO:
+            codecs.lookup(opts.encoding.lower())
     except LookupError as le:
         print('{prog}: {err}'.format(prog=sys.argv[0], err=le),
               file=sys.stderr)
         sys.exit(1)
-    if not (os.path.exists(opts.tempdir) and os.path.isdir(opts.tempdir)):
-        parser.error("tempdir must be an existing directory!")
-    else:
+    if opts.tempdir is not None:
+        if not os.path.isdir(opts.tempdir):
+            parser.error("tempdir must be an existing directory!")
+        import tempfile
         tempfile.tempdir = opts.tempdir
-    if not opts.subtitle_type:
-        parser.error("subtitle type (-t/--type) must be specified!")
     if opts.infile and not os.path.isfile(opts.infile):
         parser.error("invalid input file '{}'".format(opts.infile))
-    if opts.subtitle_type != 'srt':
-        for o, s in opt_err_pairs:
-            if o:
-                parser.error(
-                    opt_err.substitute(
-                        subtype=opts.subtitle_type, what=s))
+    if opts.sync_to:
+        if not opts.infile:
+            parser.error("--sync-to requires -i/--input-file "
+                         "or -O/--same-file")
+        if not os.path.isfile(opts.sync_to):
+            parser.error("invalid reference file '{}'".format(opts.sync_to))
+    try:
+        check_type_options(opts)
+    except OptionError as e:
+        parser.error(str(e))
+    if opts.skip_bytes is not None and opts.skip_bytes < 0:
+        parser.error('-s|--skip-byte argument must be a positive value')
+    if opts.buffer_size < 0:
+        parser.error('--buffer-size argument must be a positive value')
+    if opts.use_mmap and opts.range == OPT_RANGE:
+        parser.error('--mmap requires -r/--range')
+    if opts.batch or opts.recursive:
+        if not (opts.output_dir and os.path.isdir(opts.output_dir)):
+            parser.error("--batch and -R/--recursive requires "
+                         "an existing -D/--output-dir")
+        if opts.recursive:
+            if not os.path.isdir(opts.recursive):
+                parser.error("invalid input directory '{}'".format(
+                    opts.recursive))
+            if os.path.samefile(opts.recursive, opts.output_dir):
+                parser.error("input and output directories must differ")
+            fingerprint = get_fingerprint(opts)
+            manifest = load_manifest(opts.output_dir)
+            jobs, skipped = get_tree_jobs(opts.recursive, opts.output_dir,
+                                          manifest, fingerprint,
+                                          opts.subtitle_type)
+        else:
+            try:
+                jobs = get_batch_jobs(opts.batch, opts.output_dir)
+            except OptionError as e:
+                parser.error(str(e))
+        errors = run_batch(opts, jobs) if jobs else []
+        if opts.recursive:
+            failed = set(infile for infile, _ in errors)
+            for infile, outfile, _ in jobs:
+                relpath = os.path.relpath(infile, opts.recursive)
+                if infile in failed:
+                    manifest.pop(relpath, None)
+                else:
+                    manifest[relpath] = fingerprint
+            save_manifest(opts.output_dir, manifest)
+            if opts.is_warn:
+                print("{}: {} files processed, {} up to date".format(
+                    sys.argv[0], len(jobs), skipped), file=sys.stderr)
+        for infile, err in errors:
+            print("{}: {}".format(infile, err), file=sys.stderr)
+        if errors:
+            print("{}: {} of {} files failed".format(
+                sys.argv[0], len(errors), len(jobs)), file=sys.stderr)
+            sys.exit(1)
+        sys.exit(0)
     in_file = sys.stdin
     out_file = sys.stdout
-    if opts.infile == opts.outfile and all((opts.infile, opts.outfile)):
-        tmpfile = TempFile(opts.infile)
-        atexit.register(clean_backup, tmpfile)
-        in_file = open(tmpfile.filepath, 'r',
-                       encoding=opts.encoding, errors=opts.enc_err)
-        out_file = open(opts.infile, 'w',
-                        encoding=opts.encoding, errors=opts.enc_err)
-    else:
-        tmpfile = TempFile(None)
-        atexit.register(clean_backup, tmpfile)
-        if opts.infile:
-            in_file = open(opts.infile, "r",
-                           encoding=opts.encoding, errors=opts.enc_err)
-        if opts.outfile:
-            out_file = open(opts.outfile, "w",
-                            encoding=opts.encoding, errors=opts.enc_err)
-    if opts.subtitle_type == 'srt':
-        newsub = SrtSub(in_file, out_file, opts.unsafe_time_mode,
-                        opts.unsafe_number_mode, opts.ignore_extra,
-                        opts.prog_sub_num != None,
-                        opts.prog_sub_num, opts.preserve_extra)
-        newsub.set_delta(opts.hour, opts.min, opts.sec, opts.ms, opts.num)
-    elif opts.subtitle_type in ('sub', 'microdvd'):
-        use_secs = any((opts.hour, opts.min, opts.sec, opts.ms))
-        newsub = MicroDVD(in_file, out_file, opts.frames,
-                          opts.unsafe_time_mode, use_secs)
-        if opts.delta_frames and use_secs:
-            save_on_error(in_file, out_file, tmpfile)
-            parser.error("You can't use frames and time delta together")
-        newsub.set_delta(opts.hour, opts.min, opts.sec,
-                         opts.ms, opts.delta_frames)
-    elif opts.subtitle_type in ('ass', 'ssa'):
-        newsub = AssSub(in_file, out_file, opts.unsafe_time_mode)
-        newsub.set_delta(opts.hour, opts.min, opts.sec, opts.ms, opts.num)
-    newsub.IS_WARN = opts.is_warn
+    try:
+        if opts.infile == opts.outfile and all((opts.infile, opts.outfile)):
+            # no backup needed, the input is replaced only on success
+            tmpfile = TempFile(None)
+            in_file = open_input(opts.infile, opts.encoding, opts.enc_err)
+            out_file = ReplaceFile(opts.infile, encoding=in_file.encoding,
+                                   errors=opts.enc_err)
+            atexit.register(out_file.close)
+        else:
+            tmpfile = TempFile(None)
+            atexit.register(clean_backup, tmpfile)
+            in_file = open_input(opts.infile, opts.encoding, opts.enc_err)
+            if opts.outfile:
+                out_file = open(opts.outfile, "w",
+                                encoding=(in_file.encoding
+                                          if opts.encoding == ENCODING_AUTO
+                                          else opts.encoding),
+                                errors=opts.enc_err)
+            elif opts.encoding == ENCODING_AUTO:
+                # nothing written yet, the stdout can switch encoding
+                sys.stdout.reconfigure(encoding=in_file.encoding,
+                                       errors=opts.enc_err)
+    except LookupError as le:
+        print('{prog}: {err}'.format(prog=sys.argv[0], err=le),
+              file=sys.stderr)
+        sys.exit(1)
     if opts.skip_bytes:
-        if opts.skip_bytes < 0:
-            save_on_error(in_file, out_file, tmpfile)
-            parser.error('-s|--skip-byte argument must be a positive value')
         try:
             skip_bytes(in_file, opts.skip_bytes)
         except Exception as e:
@@ -841,25 +4106,30 @@ if __name__ == '__main__':
                     err=e.__class__.__name__, msg=str(e)), file=sys.stderr)
             sys.exit(1)
     try:
-        start_sub, end_sub = opts.range.split(':')
-        newsub.set_subs_range(int(start_sub) if start_sub else None,
-                              int(end_sub) if end_sub else None)
-    except Exception as e:
+        sub_in = in_file
+        if not opts.subtitle_type:
+            opts.subtitle_type, sub_in = get_type(in_file)
+            check_type_options(opts)
+        if opts.sync_to:
+            framerate, shift, overlap = set_sync(opts, opts.infile)
+            if opts.is_warn:
+                print("{}: sync to '{}': shift {:+.3f}s, framerate {}, "
+                      "{:.1%} of the speech overlapping".format(
+                          sys.argv[0], opts.sync_to, float(shift),
+                          '{:g} -> {:g}'.format(*framerate) if framerate
+                          else 'unchanged', overlap), file=sys.stderr)
+        writer = ChunkWriter(out_file, opts.buffer_size)
+        newsub = get_subtitle(opts, sub_in, writer)
+    except OptionError as e:
         save_on_error(in_file, out_file, tmpfile)
-        parser.error('invalid -r/--range option: {val} [{err}]'.format(
-            val=opts.range, err=str(e)))
-    if opts.stretch:
-        try:
-            sl, sr = get_stretch(opts.stretch)
-            newsub.stretch = sl, sr
-        except Exception as e:
-            save_on_error(in_file, out_file, tmpfile)
-            parser.error('invalid --stretch option: {val} [{err}]'.format(
-                val=opts.stretch, err=str(e)))
-    if opts.change_framerate:
-        newsub.change_framerate(*opts.change_framerate)
+        parser.error(str(e))
+    except UnicodeDecodeError as e:
+        save_on_error(in_file, out_file, tmpfile)
+        print("{err}: [at line 0] {msg}\n".format(
+            err=e.__class__.__name__, msg=str(e)), file=sys.stderr)
+        sys.exit(1)
     try:
-        newsub.main()
+        run_subtitle(opts, newsub, opts.infile, in_file, writer)
     except (BadFormatError, MismatchTimeError,
             IndexNumError, UnicodeDecodeError) as e:
         print("{err}: [at line {line}] {msg}\n".format(
@@ -878,4 +4148,6 @@ if __name__ == '__main__':
         save_on_error(in_file, out_file, tmpfile)
         sys.exit(255)
     else:
+        if isinstance(out_file, ReplaceFile):
+            out_file.commit()
         close_files((in_file, out_file))
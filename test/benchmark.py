@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+benchmarks for csub
+
+usage: benchmark.py [-n NUMBER] [--max-import MS] [NAME ...]
+  run the benchmarks NAME (default: all of them) and print, for each
+  one, the best time (of 5 runs) of NUMBER loops (default: 3).
+  Running all of them (or import_csub), check also the import time
+  of csub (as reported by python -X importtime, the best of 5 runs)
+  and exit with status 1 if it's over MS milliseconds.
+"""
+
+import argparse
+import io
+import itertools
+import os.path as op
+import pathlib
+import subprocess
+import sys
+import tempfile
+import timeit
+
+
+CWD = op.dirname(op.realpath(__file__))
+REPEAT = 5
+CUES = 20000
+# max import time of csub (ms, compiling it too if the bytecode
+# isn't cached), see --max-import; importing NumPy alone exceeds it
+IMPORT_THRESHOLD = 100
+
+BENCHMARKS = {}
+
+
+def benchmark (function):
+    """Register *function* (returning the callable to time) as benchmark."""
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def make_srt (cues=CUES, extra=''):
+    """Returns a SubRip subtitle (a string) of *cues* blocks."""
+    block = '{}\n{:02d}:{:02d}:{:02d},{:03d} --> {:02d}:{:02d}:{:02d},{:03d}{}\n'\
+            'first line of text\nsecond line\n\n'
+    return ''.join(
+        block.format(n, n // 3600 % 100, n // 60 % 60, n % 60, n % 1000,
+                     n // 3600 % 100, n // 60 % 60, (n + 2) % 60, n % 1000,
+                     extra)
+        for n in range(1, cues + 1))
+
+
+def make_ass (cues=CUES):
+    """Returns the events of a SubStation Alpha subtitle (a string)."""
+    event = 'Dialogue: 0,{}:{:02d}:{:02d}.{:02d},{}:{:02d}:{:02d}.{:02d},'\
+            'Default,,0000,0000,0000,,{{\\k20}}some {{\\k30}}karaoke text\n'
+    return '[Events]\n' + ''.join(
+        event.format(n // 3600 % 10, n // 60 % 60, n % 60, n % 100,
+                     n // 3600 % 10, n // 60 % 60, (n + 2) % 60, n % 100)
+        for n in range(1, cues + 1))
+
+
+def srt_time_lines (extra='', **options):
+    sub = csub.SrtSub(None, None, **options)
+    sub.set_delta(0, 1, 2, 345)
+    lines = make_srt(extra=extra).splitlines()[1::5]
+    new_time_line = sub.new_time_line
+    def run ():
+        for line in lines:
+            new_time_line(line)
+    return run
+
+@benchmark
+def srt_time_line_safe ():
+    return srt_time_lines()
+
+@benchmark
+def srt_time_line_unsafe ():
+    return srt_time_lines(unsafe_time_mode=True)
+
+@benchmark
+def srt_time_line_ignore_extra ():
+    return srt_time_lines(' X1:10 X2:20', ignore_extra=True)
+
+@benchmark
+def srt_time_line_preserve_extra ():
+    return srt_time_lines(' X1:10 X2:20', keep_pos=True)
+
+def time_fields ():
+    """Returns CUES tuples of SubRip time fields."""
+    return [(n // 3600 % 100, n // 60 % 60, n % 60, n % 1000)
+            for n in range(1, CUES + 1)]
+
+@benchmark
+def srt_time_format ():
+    fields = time_fields()
+    fmt = '{:02d}:{:02d}:{:02d},{:03d}'.format
+    def run ():
+        for time in fields:
+            fmt(*time)
+    return run
+
+@benchmark
+def srt_time_tables ():
+    fields = time_fields()
+    srt_time = csub.srt_time
+    def run ():
+        for time in fields:
+            srt_time(*time)
+    return run
+
+@benchmark
+def srt_file ():
+    text = make_srt()
+    def run ():
+        sub = csub.SrtSub(io.StringIO(text), io.StringIO())
+        sub.set_delta(0, 1, 2, 345)
+        sub.main()
+    return run
+
+@benchmark
+def ass_file ():
+    text = make_ass()
+    def run ():
+        sub = csub.AssSub(io.StringIO(text), io.StringIO())
+        sub.set_delta(0, 1, 2, 34)
+        sub.main()
+    return run
+
+@benchmark
+def ass_file_out_of_range ():
+    text = make_ass()
+    def run ():
+        sub = csub.AssSub(io.StringIO(text), io.StringIO())
+        sub.set_delta(0, 1, 2, 34)
+        sub.set_subs_range(None, 0)
+        sub.main()
+    return run
+
+@benchmark
+def microdvd_file ():
+    text = ''.join('{{{}}}{{{}}}some text|second line\n'.format(n, n + 50)
+                   for n in range(0, CUES * 100, 100))
+    def run ():
+        sub = csub.MicroDVD(io.StringIO(text), io.StringIO())
+        sub.change_framerate(25, 23.976)
+        sub.set_delta(delta_frames=30)
+        sub.main()
+    return run
+
+@benchmark
+def ass_file_to_disk ():
+    text = make_ass()
+    def run ():
+        with tempfile.TemporaryFile('w', encoding='utf-8') as out:
+            sub = csub.AssSub(io.StringIO(text), out)
+            sub.set_delta(0, 1, 2, 34)
+            sub.main()
+    return run
+
+@benchmark
+def ass_file_to_disk_chunked ():
+    text = make_ass()
+    def run ():
+        with tempfile.TemporaryFile('w', encoding='utf-8') as out:
+            writer = csub.ChunkWriter(out)
+            sub = csub.AssSub(io.StringIO(text), writer)
+            sub.set_delta(0, 1, 2, 34)
+            sub.main()
+            writer.flush()
+    return run
+
+@benchmark
+def srt_file_anchors ():
+    # 500 anchors (time and cue number ones), a segment every 40 cues
+    text = make_srt()
+    anchors = ['{}{}={}'.format('#' if i % 2 else '', n, n * 1.001)
+               for i, n in enumerate(range(1, CUES, 40))]
+    def run ():
+        sub = csub.SrtSub(io.StringIO(text), io.StringIO())
+        times, cues = csub.get_anchors(anchors)
+        sub.set_anchors(times, cues)
+        sub.main()
+    return run
+
+@benchmark
+def srt_sync_estimate ():
+    # a feature-length movie (2 hours, 1500 cues), the input shifted
+    # and at another framerate
+    import atexit
+    import random
+    import shutil
+    tmpdir = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, tmpdir)
+    rnd = random.Random(1)
+    times = sorted(rnd.sample(range(7200000), 1500))
+    cues = ['{}\n{} --> {}\ntext\n\n'.format(n, *(
+        csub.srt_time(*csub.split_units(t, 1000))
+        for t in (start, start + (end - start) * 7 // 10)))
+        for n, (start, end) in enumerate(zip(times, times[1:]), 1)]
+    ref = op.join(tmpdir, 'ref.srt')
+    path = op.join(tmpdir, 'in.srt')
+    with open(ref, 'w') as out:
+        out.writelines(cues)
+    csub.transform(pathlib.Path(ref), pathlib.Path(path),
+                   shift=-12.3, framerate=(25, 23.976))
+    def run ():
+        csub.estimate_sync(ref, path)
+    return run
+
+@benchmark
+def transform_calls ():
+    text = make_srt(50)
+    def run ():
+        for _ in range(100):
+            csub.transform(text, shift=1.5, range=(10, 40))
+    return run
+
+@benchmark
+def import_csub ():
+    cmd = [sys.executable, '-c', 'import csub']
+    def run ():
+        subprocess.check_call(cmd, cwd=op.split(CWD)[0])
+    return run
+
+@benchmark
+def srt_transform ():
+    data = make_srt().encode('utf-8')
+    def run ():
+        csub.transform(data, fmt='srt', shift=1.5)
+    return run
+
+@benchmark
+def srt_stream ():
+    import asyncio
+    data = make_srt().encode('utf-8')
+    async def chunks ():
+        for pos in range(0, len(data), 4096):
+            yield data[pos:pos+4096]
+    async def collect ():
+        async for _ in csub.atransform(chunks(), fmt='srt', shift=1.5):
+            pass
+    def run ():
+        asyncio.run(collect())
+    return run
+
+@benchmark
+def srt_live_latency ():
+    import atexit
+    cmd = [sys.executable, op.join(op.split(CWD)[0], 'csub.py'),
+           '--live', '-t', 'srt', '-S', '1']
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, bufsize=0)
+    atexit.register(proc.wait)
+    atexit.register(proc.stdin.close)
+    cue = make_srt(1).encode('utf-8')
+    size = len(cue)
+    def run ():
+        # round trip of 100 cues, each one sent after the previous is out
+        for _ in range(100):
+            proc.stdin.write(cue)
+            data = b''
+            while len(data) < size:
+                data += proc.stdout.read(size - len(data))
+    return run
+
+
+def import_time ():
+    """
+    Returns the cumulative import time of csub in ms (the best
+    of REPEAT runs) as reported by python -X importtime.
+    """
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import csub']
+    times = []
+    for _ in range(REPEAT):
+        err = subprocess.run(cmd, cwd=op.split(CWD)[0], check=True,
+                             stderr=subprocess.PIPE,
+                             universal_newlines=True).stderr
+        for line in err.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == 'csub':
+                times.append(int(fields[1]) / 1000)
+    return min(times)
+
+
+def main ():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=3)
+    parser.add_argument('--max-import', type=float,
+                        default=IMPORT_THRESHOLD, metavar='MS')
+    parser.add_argument('names', nargs='*', metavar='NAME')
+    args = parser.parse_args()
+    for name in set(args.names) - set(BENCHMARKS):
+        parser.error('unknown benchmark: {!r} (choose from {})'.format(
+            name, ', '.join(sorted(BENCHMARKS))))
+    for name in args.names or sorted(BENCHMARKS):
+        run = BENCHMARKS[name]()
+        best = min(timeit.repeat(run, number=args.number, repeat=REPEAT))
+        print('{:<32} {:10.2f} ms'.format(name, best / args.number * 1000))
+    if not args.names or 'import_csub' in args.names:
+        elapsed = import_time()
+        print('{:<32} {:10.2f} ms'.format('import time (-X importtime)',
+                                          elapsed))
+        if elapsed > args.max_import:
+            sys.exit('import time over the threshold ({} ms)'.format(
+                args.max_import))
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, op.split(CWD)[0])
+    import csub
+    main()
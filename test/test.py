@@ -23,12 +23,39 @@ import shutil
 import operator
 import platform
 import tempfile
+import datetime
+import asyncio
+import pathlib
+import json
+import time
+import math
+from fractions import Fraction
 
 
 PYTHON_EXE = sys.executable
 PROGFILE = 'csub.py'
 DATA_DIR = 'data'
 CWD = op.dirname(op.realpath(__file__))
+# the encoding of the _enc_ENCODING.srt data files
+ENC_FILE = re.compile(r'_enc_([-\w]+)\..*$')
+
+
+class TempDirMixin:
+    """Tests using a temporary directory (self.tmpdir)."""
+
+    def setUp (self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown (self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_csub (self, sub, *options):
+        """Returns the output (bytes) of csub on *sub* with *options*."""
+        out = op.join(self.tmpdir, 'out')
+        cmd = [PYTHON_EXE, PROGFILE, '-i', sub, '-o', out]
+        self.assertEqual(sbp.call(cmd + list(options)), 0, options)
+        with open(out, 'rb') as f:
+            return f.read()
 
 
 class TempFileTest (unittest.TestCase):
@@ -78,8 +105,7 @@ class TempFileTest (unittest.TestCase):
                 newsub.main()
 
     def testCmdLineOnFailSrt (self):
-        commands = ["{exe} {prog} -i {input} -o {output}",
-                    "{exe} {prog} -i {input} -o {output} -t srt --stretch",
+        commands = ["{exe} {prog} -i {input} -o {output} -t srt --stretch",
                     "{exe} {prog} -i {input} -o {output} -r 1:foo",
                     "{exe} {prog} -i {input} -o {output} -r 3",
                     "{exe} {prog} -i __FAIL__{input} -o {output} -t ass",
@@ -113,8 +139,7 @@ class TempFileTest (unittest.TestCase):
                                      "sub file shouldn't be modified!")
 
     def testCmdLineOnFailAss (self):
-        commands = ["{exe} {prog} -i {input} -o {output}",
-                    "{exe} {prog} -i {input} -o {output} -t srt",
+        commands = ["{exe} {prog} -i {input} -o {output} -t srt",
                     "{exe} {prog} -i {input} -o {output} -t sub -I",
                     "{exe} {prog} -i {input} -o {output} -t ass -n 11",
                     "{exe} {prog} -i {input} -o {output} -t ass -B",]
@@ -140,8 +165,7 @@ class TempFileTest (unittest.TestCase):
                                      "sub file shouldn't be modified!")
 
     def testCmdLineOnFailMicroDVD (self):
-        commands = ["{exe} {prog} -i {input} -o {output}",
-                    "{exe} {prog} -i {input} -o {output} -t srt",
+        commands = ["{exe} {prog} -i {input} -o {output} -t srt",
                     "{exe} {prog} -i {input} -o {output} -t sub -f foo",
                     "{exe} {prog} -i {input} -o {output} -t sub -F",
                     "{exe} {prog} -i {input} -o {output} -t sub -f",
@@ -241,6 +265,35 @@ class TestCommandLine (unittest.TestCase):
                                  "Sub file changed! ARGGGGH!!!")
             os.remove(o)
 
+    def testSameFileReplace (self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            sub = op.join(tmpdir, 'sub.srt')
+            link = op.join(tmpdir, 'link.srt')
+            shutil.copy(op.join(CWD, DATA_DIR, 'fail_sub_1.srt'), sub)
+            os.chmod(sub, 0o640)
+            os.symlink('sub.srt', link)
+            with open(sub, 'rb') as f:
+                orig = f.read()
+            cmdline = [PYTHON_EXE, PROGFILE, '-O', link, '-t', 'srt']
+            pipe = sbp.Popen(cmdline + ['-S', '1'],
+                             stdout=sbp.PIPE, stderr=sbp.PIPE)
+            pipe.communicate()
+            self.assertNotEqual(pipe.returncode, 0)
+            with open(sub, 'rb') as f:
+                self.assertEqual(f.read(), orig)
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ['link.srt', 'sub.srt'])
+            self.assertEqual(sbp.call(cmdline + ['-S', '1', '-b']), 0)
+            self.assertTrue(op.islink(link))
+            self.assertEqual(os.stat(sub).st_mode & 0o777, 0o640)
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ['link.srt', 'sub.srt'])
+            with open(sub, 'rb') as f:
+                self.assertNotEqual(f.read(), orig)
+        finally:
+            shutil.rmtree(tmpdir)
+
     def testSameFileFail (self):
         commands = [
             "{exe} {prog} -i {input} -o {output} -t {type} -O {io}",
@@ -263,6 +316,958 @@ class TestCommandLine (unittest.TestCase):
                                 "instead): {c}".format(c=' '.join(cmdline)))
 
 
+class BatchTest (TempDirMixin, unittest.TestCase):
+
+    def setUp (self):
+        super().setUp()
+        self.outdir = op.join(self.tmpdir, 'out')
+        self.refdir = op.join(self.tmpdir, 'ref')
+        os.mkdir(self.outdir)
+        os.mkdir(self.refdir)
+
+    def testBatchOk (self):
+        subs = gglob(op.join(CWD, DATA_DIR, 'test*.srt'))
+        cmdline = [PYTHON_EXE, PROGFILE, '-t', 'srt', '-S', '3', '-j', '2',
+                   '--max-tasks-per-child', '1', '--timeout', '60',
+                   '-D', self.outdir, '--batch',
+                   op.join(CWD, DATA_DIR, 'test*.srt')]
+        pipe = sbp.Popen(cmdline, stdout=sbp.PIPE, stderr=sbp.PIPE)
+        pipe.communicate()
+        self.assertEqual(pipe.returncode, 0, cmdline)
+        for sub in subs:
+            ref = op.join(self.refdir, op.basename(sub))
+            cmd = [PYTHON_EXE, PROGFILE, '-t', 'srt', '-S', '3',
+                   '-i', sub, '-o', ref]
+            self.assertEqual(sbp.call(cmd), 0)
+            with open(ref, 'rb') as r:
+                with open(op.join(self.outdir, op.basename(sub)), 'rb') as o:
+                    self.assertEqual(r.read(), o.read())
+
+    def testBatchErrors (self):
+        fail = op.join(CWD, DATA_DIR, 'fail_sub_1.srt')
+        ok = op.join(CWD, DATA_DIR, 'test_sub_1.srt')
+        cmdline = [PYTHON_EXE, PROGFILE, '-t', 'srt',
+                   '-D', self.outdir, '--batch', fail, ok]
+        pipe = sbp.Popen(cmdline, stdout=sbp.PIPE, stderr=sbp.PIPE)
+        err = pipe.communicate()[1].decode()
+        self.assertNotEqual(pipe.returncode, 0)
+        self.assertIn(fail, err)
+        self.assertIn('MismatchTimeError', err)
+        self.assertNotIn(ok, err)
+        self.assertTrue(op.exists(op.join(self.outdir, op.basename(ok))))
+        self.assertFalse(op.exists(op.join(self.outdir, op.basename(fail))))
+        for cmd in (['--batch', ok],
+                    ['-D', self.outdir, '--batch', ok, '-i', ok],
+                    ['-D', self.outdir, '--batch', ok + '__FAIL__'],):
+            pipe = sbp.Popen([PYTHON_EXE, PROGFILE, '-t', 'srt'] + cmd,
+                             stdout=sbp.PIPE, stderr=sbp.PIPE)
+            pipe.communicate()
+            self.assertNotEqual(pipe.returncode, 0, cmd)
+
+    def testSameFile (self):
+        # -D is the directory of the input: refused, the input unchanged
+        sub = op.join(self.outdir, 'test_sub_1.srt')
+        shutil.copy(op.join(CWD, DATA_DIR, 'test_sub_1.srt'), sub)
+        with open(sub, 'rb') as f:
+            data = f.read()
+        for outdir in (self.outdir, op.join(self.outdir, '.')):
+            proc = sbp.run([PYTHON_EXE, PROGFILE, '-t', 'srt', '-S', '2',
+                            '-D', outdir, '--batch', sub],
+                           stdout=sbp.PIPE, stderr=sbp.PIPE)
+            self.assertEqual(proc.returncode, 2)
+            self.assertIn(b'is the input file', proc.stderr)
+            with open(sub, 'rb') as f:
+                self.assertEqual(f.read(), data)
+
+
+class IndexTest (TempDirMixin, unittest.TestCase):
+
+    def setUp (self):
+        super().setUp()
+        self.subs = {}
+        for name in ('test_sub_1.srt', 'test_sub_2.ass', 'test_sub_4.sub'):
+            self.subs[name] = op.join(self.tmpdir, name)
+            shutil.copy(op.join(CWD, DATA_DIR, name), self.tmpdir)
+
+    def testSameOutput (self):
+        for name, ranges in (('test_sub_1.srt', ('440:450', ':435', '449:')),
+                             ('test_sub_2.ass', ('160:180', ':0', '7000:')),
+                             ('test_sub_4.sub', ('4000:9000', '50000:'))):
+            sub = self.subs[name]
+            for rng in ranges:
+                expected = self.run_csub(sub, '-S', '3', '-r', rng)
+                self.assertEqual(
+                    self.run_csub(sub, '-S', '3', '-r', rng, '--mmap'),
+                    expected, (name, rng))
+                if rng == ranges[0]: # before the --index runs
+                    self.assertFalse(op.exists(csub.CueIndex.sidecar(sub)))
+                for i in range(2): # build the index, then use it
+                    self.assertEqual(
+                        self.run_csub(sub, '-S', '3', '-r', rng, '--index'),
+                        expected, (name, rng))
+                    self.assertTrue(op.exists(csub.CueIndex.sidecar(sub)))
+
+    def testInvalidation (self):
+        sub = self.subs['test_sub_1.srt']
+        index = csub.CueIndex.get(sub, 'srt', 'utf-8-sig')
+        self.assertEqual(len(index), 19)
+        self.assertEqual(list(index.find_range(440, 442)), [7, 8])
+        self.assertIsNotNone(csub.CueIndex.load(sub, 'srt', 'utf-8-sig'))
+        self.assertIsNone(csub.CueIndex.load(sub, 'ass', 'utf-8-sig'))
+        with open(sub, 'r+b') as f: # same size and mtime, changed data
+            stat = os.stat(sub)
+            f.write(b'933\n')
+        os.utime(sub, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertIsNone(csub.CueIndex.load(sub, 'srt', 'utf-8-sig'))
+        index = csub.CueIndex.get(sub, 'srt', 'utf-8-sig')
+        self.assertEqual(index.numbers[0], 933)
+        with open(sub, 'ab') as f:
+            f.write(b'\n\n')
+        self.assertIsNone(csub.CueIndex.load(sub, 'srt', 'utf-8-sig'))
+        self.assertIsNone(csub.CueIndex.get(sub, 'srt', 'utf-8-sig'))
+
+    def testBuild (self):
+        sub = op.join(self.tmpdir, 'build.srt')
+        blocks = ('1\n00:00:01,000 --> 00:00:02,000\na\n\n',
+                  '2\n00:00:03,000 --> 00:00:04,500 X1:1\n\n',
+                  '3\n00:00:05,000 --> 00:00:06,000\nb\nc\n')
+        with open(sub, 'w', encoding='utf-8', newline='') as f:
+            f.write(''.join(blocks))
+        index = csub.CueIndex.build(sub, 'srt', 'utf-8')
+        self.assertEqual(list(index.offsets), [0, 35, 73])
+        self.assertEqual(list(index.numlines), [1, 5, 8])
+        self.assertEqual(list(index.ends), [2000, 4500, 6000])
+        self.assertEqual(len(csub.CueIndex.build(sub, 'srt', 'utf-8',
+                                                 complete=False).ends), 0)
+        for data in ('1\n00:00:01,000 --> 00:00:02,000\na\n\u3000\n'
+                     '2\n00:00:03,000 --> 00:00:04,000\nb\n', # unicode blank
+                     '1\n00:00:01,000 --> 00:00:02,000\na\n\n\n'
+                     '2\n00:00:03,000 --> 00:00:04,000\nb\n', # two blanks
+                     '1\n00:00:01,000 --> 00:00:02,000\ra\n', # lone CR
+                     ''.join(blocks).replace('\n', '\r\n'), # CRLF
+                     ''.join(blocks)[:-1]): # no final newline
+            with open(sub, 'w', encoding='utf-8', newline='') as f:
+                f.write(data)
+            self.assertIsNone(csub.CueIndex.build(sub, 'srt', 'utf-8'), data)
+
+    def check_newlines (self, option):
+        """
+        Check that *option* gives the same output as the default engine
+        on subtitles with CRLF line endings or no final newline.
+        """
+        for name, rng in (('test_sub_1.srt', '440:450'),
+                          ('test_sub_2.ass', '160:180'),
+                          ('test_sub_4.sub', '4000:9000')):
+            with open(op.join(CWD, DATA_DIR, name), 'rb') as f:
+                data = f.read().replace(b'\r\n', b'\n')
+            for newline, final in ((b'\r\n', b'\r\n'), (b'\n', b'')):
+                sub = op.join(self.tmpdir, 'newlines' + op.splitext(name)[1])
+                with open(sub, 'wb') as f:
+                    f.write(data.rstrip(b'\n').replace(b'\n', newline)
+                            + final)
+                self.assertEqual(
+                    self.run_csub(sub, '-S', '3', '-r', rng, option),
+                    self.run_csub(sub, '-S', '3', '-r', rng),
+                    (name, newline, final))
+
+    def testNewlines (self):
+        self.check_newlines('--index')
+
+    def testNewlinesMmap (self):
+        self.check_newlines('--mmap')
+
+    def testMmapWithoutRange (self):
+        sub = self.subs['test_sub_1.srt']
+        proc = sbp.run([PYTHON_EXE, PROGFILE, '-i', sub, '--mmap'],
+                       stdout=sbp.DEVNULL, stderr=sbp.PIPE,
+                       universal_newlines=True)
+        self.assertEqual(proc.returncode, 2)
+        self.assertIn('--mmap requires -r/--range', proc.stderr)
+
+    def testFind (self):
+        sub = op.join(self.tmpdir, 'unsorted.sub')
+        with open(sub, 'w') as f:
+            f.write('{30}{40}a\n{10}{20}b\n{35}{45}c\n{50}{60}d\n')
+        index = csub.CueIndex.get(sub, 'sub', 'utf-8')
+        self.assertFalse(index.is_sorted('starts'))
+        self.assertEqual(index.find_range(30, 50), [0, 2])
+        self.assertEqual(index.regions([0, 2, 3]),
+                         [(0, 10, 1), (20, 40, 3)])
+        self.assertEqual(index.find_range(), [0, 1, 2, 3])
+        self.assertEqual(index.find_time(None, 30), [1])
+        self.assertEqual(self.run_csub(sub, '-f', '1', '-r', '30:40',
+                                       '-e', 'utf-8', '--index'),
+                         b'{31}{41}a\n{10}{20}b\n{36}{46}c\n{50}{60}d\n')
+
+
+class TailCopyTest (TempDirMixin, unittest.TestCase):
+
+    def write_sub (self, name, data):
+        sub = op.join(self.tmpdir, name)
+        with open(sub, 'wb') as f:
+            f.write(data)
+        return sub
+
+    def testSameOutput (self):
+        for name, ranges in (('test_sub_1.srt', ('440:450', ':435', '449:')),
+                             ('test_sub_2.ass', ('160:180', ':0', '7000:')),
+                             ('test_sub_4.sub', ('4000:9000', ':0'))):
+            sub = op.join(CWD, DATA_DIR, name)
+            for rng in ranges:
+                self.assertEqual(
+                    self.run_csub(sub, '-S', '3', '-r', rng, '--copy-tail'),
+                    self.run_csub(sub, '-S', '3', '-r', rng), (name, rng))
+
+    def testUnsorted (self):
+        sub = self.write_sub('unsorted.sub',
+                             b'{30}{40}a\n{10}{20}b\n{50}{60}c\n{35}{45}d\n')
+        self.assertEqual(self.run_csub(sub, '-f', '1', '-r', '30:40',
+                                       '-e', 'utf-8', '--copy-tail'),
+                         b'{31}{41}a\n{10}{20}b\n{50}{60}c\n{36}{46}d\n')
+        sub = self.write_sub('unsorted.srt', (
+            b'1\n00:00:01,000 --> 00:00:02,000\na\n\n'
+            b'3\n00:00:03,000 --> 00:00:04,000\nb\n\n'
+            b'2\n00:00:05,000 --> 00:00:06,000\nc\n'))
+        self.assertEqual(self.run_csub(sub, '-S', '1', '-r', ':3',
+                                       '-e', 'utf-8', '--copy-tail'), (
+            b'1\n00:00:02,000 --> 00:00:03,000\na\n\n'
+            b'3\n00:00:03,000 --> 00:00:04,000\nb\n\n'
+            b'2\n00:00:06,000 --> 00:00:07,000\nc\n'))
+
+    def testNewlines (self):
+        # CRLF and lone CR line endings, no final newline
+        for data, rng in ((b'{1}{2}a\r\n{3}{4}b\r\n{5}{6}c\r\n', ':3'),
+                          (b'{1}{2}a\n{3}{4}b\n{5}{6}c', ':3'),
+                          (b'{0}{40}a\r{250}{290}b\r{600}{640}c\r'
+                           b'{900}{940}d\r', '200:600')):
+            sub = self.write_sub('newlines.sub', data)
+            self.assertEqual(
+                self.run_csub(sub, '-S', '2', '-r', rng, '-e', 'utf-8',
+                              '--copy-tail'),
+                self.run_csub(sub, '-S', '2', '-r', rng, '-e', 'utf-8'),
+                data)
+        for newline in (b'\r\n', b'\r'):
+            sub = self.write_sub('newlines.srt', (
+                b'1\n00:00:01,000 --> 00:00:02,000\na\n\n'
+                b'2\n00:00:03,000 --> 00:00:04,000\nb\n\n'
+                b'3\n00:00:05,000 --> 00:00:06,000\nc\n').replace(
+                    b'\n', newline))
+            self.assertEqual(
+                self.run_csub(sub, '-S', '1', '-r', ':2', '-e', 'utf-8',
+                              '--copy-tail'),
+                self.run_csub(sub, '-S', '1', '-r', ':2', '-e', 'utf-8'),
+                newline)
+
+    def testReader (self):
+        sub = self.write_sub('reader.sub', b'{1}{2}a\n{3}{4}b\n{5}{6}c\n')
+        reader = csub.TailReader(sub, 'utf-8', 'strict')
+        try:
+            self.assertEqual(next(reader), '{1}{2}a\n')
+            self.assertEqual(reader.line_offset, 0)
+            self.assertEqual(reader.tail_keys(csub.TAIL_MICRODVD),
+                             [b'1', b'3', b'5'])
+        finally:
+            reader.close()
+
+
+class TransformTest (TempDirMixin, unittest.TestCase):
+
+    def testSameOutput (self):
+        for name, options, kwords in (
+                ('test_sub_1.srt', ('-S', '2', '-m', '345', '-r', '440:445'),
+                 {'shift': 2.345, 'range': (440, 445)}),
+                ('test_sub_2.srt', ('-M', '-1', '--stretch', '10:-20'),
+                 {'shift': datetime.timedelta(minutes=-1),
+                  'stretch': (10, -20), 'fmt': 'srt'}),
+                ('test_sub_2.ass', ('-S', '1', '-m', '50', '-c', '25', '30'),
+                 {'shift': 1.5, 'framerate': (25, 30)}),
+                ('test_sub_4.sub', ('-f', '50'), {'shift': 2}),
+                ('_enc_CP932.srt', ('-S', '3', '-e', 'auto'),
+                 {'shift': 3, 'encoding': 'auto'})):
+            path = op.join(CWD, DATA_DIR, name)
+            expected = self.run_csub(path, *options)
+            with open(path, 'rb') as f:
+                data = f.read()
+            self.assertEqual(csub.transform(data, **kwords), expected, name)
+            self.assertEqual(csub.transform(pathlib.Path(path), **kwords),
+                             expected.decode(kwords.get('encoding') != 'auto'
+                                             and 'utf-8-sig' or 'cp932'),
+                             name)
+            out = io.BytesIO()
+            with open(path, 'rb') as f:
+                self.assertIsNone(csub.transform(f, out, **kwords))
+            self.assertEqual(out.getvalue(), expected, name)
+            out = pathlib.Path(self.tmpdir, name)
+            csub.transform(pathlib.Path(path), out, **kwords)
+            self.assertEqual(out.read_bytes(), expected, name)
+        sub = '1\n00:00:01,000 --> 00:00:02,000\na\n\n'
+        self.assertEqual(csub.transform(sub, shift=-0.5, use_numpy=True),
+                         '1\n00:00:00,500 --> 00:00:01,500\na\n\n')
+        out = io.StringIO()
+        csub.transform(io.StringIO(sub), out, 'srt', 1)
+        self.assertEqual(out.getvalue(),
+                         '1\n00:00:02,000 --> 00:00:03,000\na\n\n')
+
+    def testReuse (self):
+        transformer = csub.Transformer('sub', shift=1, frames=10)
+        for n in range(3):
+            self.assertEqual(transformer('{%d}{20}a\n' % n),
+                             '{%d}{30}a\n' % (n + 10))
+        self.assertIs(csub.get_transformer('srt', 2),
+                      csub.get_transformer('srt', 2))
+
+    def testErrors (self):
+        for args, kwords in (((), {'range': 'x:1'}),
+                             ((), {'stretch': 'a:b'}),
+                             ((), {'shift': 'ten'}),
+                             ((), {'encoding': 'no-such-codec'}),
+                             ((), {'infile': 'x.srt'}),
+                             ((), {'not_an_option': 1}),
+                             (('ass',), {'num': 2}),
+                             (('ssh',), {}),
+                             (('sub',), {'shift': 1, 'sec': 3})):
+            with self.assertRaises(csub.OptionError, msg=(args, kwords)):
+                csub.Transformer(*args, **kwords)('{1}{2}a\n')
+        with self.assertRaises(csub.OptionError):
+            csub.transform('no subtitle here\n')
+        with self.assertRaises(TypeError):
+            csub.transform(42)
+        with self.assertRaises(csub.MismatchTimeError) as cm:
+            csub.transform('1\n00:00:01,000 --> 00:00:02,000\na\n\n'
+                           '2\n00:00:0x,000 --> 00:00:04,000\nb\n', shift=1)
+        self.assertEqual(cm.exception.line, 6)
+        with self.assertRaises(UnicodeDecodeError) as cm:
+            csub.transform(b'1\n00:00:01,000 --> 00:00:02,000\n\xff\n',
+                           shift=1, fmt='srt', encoding='utf-8')
+        self.assertEqual(cm.exception.line, 0)
+        sub = pathlib.Path(self.tmpdir, 'fail.srt')
+        out = pathlib.Path(self.tmpdir, 'new.srt')
+        data = b'1\n00:00:01,000 --> 00:00:02,000\na\n\n2\nx\n'
+        sub.write_bytes(data)
+        for dst in (out, sub):
+            with self.assertRaises(csub.BadFormatError):
+                csub.transform(sub, dst, shift=1)
+        self.assertEqual(sub.read_bytes(), data)
+        self.assertEqual(os.listdir(self.tmpdir), ['fail.srt'])
+        sub.write_bytes(data[:-4])
+        csub.transform(sub, sub, shift=1)
+        self.assertEqual(sub.read_bytes(),
+                         b'\xef\xbb\xbf1\n00:00:02,000 --> 00:00:03,000\na\n\n')
+
+
+class StreamTest (unittest.TestCase):
+
+    async def chunks (self, data, rnd):
+        pos = 0
+        while pos < len(data):
+            size = rnd.randint(1, 40)
+            yield data[pos:pos+size]
+            pos += size
+            await asyncio.sleep(0)
+
+    async def collect (self, stream):
+        return b''.join([chunk async for chunk in stream])
+
+    def result (self, function, *args, **kwords):
+        try:
+            return function(*args, **kwords)
+        except Exception as e:
+            return e.__class__, getattr(e, 'line', None)
+
+    def testSameOutput (self):
+        async def run_all (jobs):
+            return await asyncio.gather(
+                *(self.collect(csub.atransform(self.chunks(data, rnd), **kw))
+                  for data, rnd, kw in jobs), return_exceptions=True)
+        jobs = []
+        for file in gglob(op.join(CWD, DATA_DIR, '*.[sa][rus][tsb]')):
+            with open(file, 'rb') as f:
+                data = f.read()
+            for kw in ({'shift': 1.5}, {'shift': -2, 'range': (2, 300)},
+                       {'shift': 1, 'encoding': 'auto'},
+                       {'shift': 3, 'buffer_size': 0,
+                        'fmt': op.splitext(file)[1][1:]}):
+                for sub in (data, data.replace(b'\n', b'\r\n')):
+                    jobs.append((sub, random.Random(len(jobs)), kw))
+        results = asyncio.run(run_all(jobs)) # concurrently, in one loop
+        for (data, _, kw), result in zip(jobs, results):
+            if isinstance(result, Exception):
+                result = result.__class__, getattr(result, 'line', None)
+            self.assertEqual(result,
+                             self.result(csub.transform, data, None, **kw),
+                             kw)
+
+    def testStreamReader (self):
+        data = b'1\n00:00:01,000 --> 00:00:02,000\na\n\n' * 3
+        async def run ():
+            reader = asyncio.StreamReader()
+            for i in range(0, len(data), 7):
+                reader.feed_data(data[i:i+7])
+            reader.feed_eof()
+            return await self.collect(csub.atransform(reader, 'srt', 1))
+        self.assertEqual(asyncio.run(run()),
+                         csub.transform(data, fmt='srt', shift=1))
+
+    def testIncremental (self):
+        sub = ('1\n00:00:01,000 --> 00:00:02,000\na\n\n'
+               '2\n00:00:03,000 --> 00:00:04,000\nb\nc\n\n')
+        job = csub.Transformer('srt', 1, buffer_size=0,
+                               encoding='utf-8').incremental()
+        self.assertEqual(job.push(sub[:20].encode()), b'')
+        self.assertEqual(job.push(sub[20:-1].encode()),
+                         b'1\n00:00:02,000 --> 00:00:03,000\na\n\n')
+        self.assertEqual(job.push(b'\n', True),
+                         b'2\n00:00:04,000 --> 00:00:05,000\nb\nc\n\n')
+        feed = csub.LineFeed(blocks=True)
+        feed.push('1\n2\n\n\n3\n4\nx\n \n5')
+        self.assertEqual(feed.units, 2)
+        self.assertEqual(len(list(itertools.islice(feed, 8))), 8)
+        self.assertRaises(RuntimeError, next, feed)
+        feed.push('', True)
+        self.assertEqual(list(feed), ['5'])
+
+
+class ServeTest (TempDirMixin, unittest.TestCase):
+
+    JOBS = ({'id': 1, 'text': '1\n00:00:01,000 --> 00:00:02,000\na\n\n',
+             'shift': 1.5},
+            {'id': 'ass', 'input': op.join(CWD, DATA_DIR, 'test_sub_3.ass'),
+             'shift': 2, 'range': [1, None], 'options': {'is_warn': False}},
+            {'id': 3, 'text': '{1}{2}a\n', 'type': 'sub', 'shift': 1,
+             'options': {'frames': 10}},
+            {'id': 4, 'text': '1\n00:00:0x,000 --> 00:00:02,000\na\n\n',
+             'type': 'srt'},
+            {'id': 5, 'text': 'x', 'input': 'y'})
+    ROOT = op.join(CWD, DATA_DIR)
+
+    def check_results (self, results):
+        self.assertEqual([r['id'] for r in results],
+                         [1, 'ass', 3, 4, 5, None])
+        self.assertEqual([r['status'] for r in results],
+                         ['ok'] * 3 + ['error'] * 3)
+        self.assertEqual(results[0]['text'],
+                         '1\n00:00:02,500 --> 00:00:03,500\na\n\n')
+        self.assertEqual(
+            results[1]['text'],
+            csub.transform(pathlib.Path(self.JOBS[1]['input']),
+                           shift=2, range=(1, None)))
+        self.assertEqual(results[2]['text'], '{11}{12}a\n')
+        self.assertEqual((results[3]['error'], results[3]['line']),
+                         ('MismatchTimeError', 2))
+        self.assertEqual((results[4]['error'], results[4]['line']),
+                         ('OptionError', None))
+        self.assertEqual(results[5]['error'], 'JSONDecodeError')
+        for result in results:
+            self.assertGreaterEqual(result['elapsed'], 0)
+
+    def jobs_input (self):
+        return ''.join(json.dumps(job) + '\n'
+                       for job in self.JOBS) + '\n[not json\n'
+
+    def testStdin (self):
+        out = sbp.check_output([PYTHON_EXE, PROGFILE, '--serve',
+                                '--serve-root', self.ROOT],
+                               input=self.jobs_input(),
+                               universal_newlines=True)
+        self.check_results([json.loads(line) for line in out.splitlines()])
+        with open(op.join(self.tmpdir, 'in.srt'), 'w') as f:
+            f.write(self.JOBS[0]['text'])
+        out = io.StringIO()
+        csub.serve(io.BytesIO(json.dumps({
+            'input': 'in.srt', 'output': op.join(self.tmpdir, 'out.srt'),
+            'shift': -1, 'encoding': 'utf-8'}).encode()), out, self.tmpdir)
+        self.assertEqual(json.loads(out.getvalue())['status'], 'ok')
+        with open(op.join(self.tmpdir, 'out.srt')) as f:
+            self.assertEqual(f.read(),
+                             '1\n00:00:00,000 --> 00:00:01,000\na\n\n')
+
+    def testSocket (self):
+        import socket
+        path = op.join(self.tmpdir, 'csub.sock')
+        server = sbp.Popen([PYTHON_EXE, PROGFILE, '--serve', '--serve-root',
+                            self.ROOT, '--socket', path, '-j', '2'])
+        try:
+            for _ in range(100):
+                if op.exists(path):
+                    break
+                time.sleep(0.05)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            clients = []
+            for _ in range(2):
+                client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                client.connect(path)
+                clients.append(client)
+            for client in clients:
+                client.sendall(self.jobs_input().encode('utf-8'))
+                client.shutdown(socket.SHUT_WR)
+            for client in clients:
+                with client, client.makefile('r') as f:
+                    results = [json.loads(line) for line in f]
+                self.check_results(results)
+                for result in results:
+                    self.assertGreaterEqual(result['total'],
+                                            result['elapsed'])
+        finally:
+            server.terminate()
+            server.wait()
+        self.assertFalse(op.exists(path))
+
+    def testPaths (self):
+        root = op.join(self.tmpdir, 'root')
+        os.mkdir(root)
+        with open(op.join(root, 'in.srt'), 'w') as f:
+            f.write(self.JOBS[0]['text'])
+        os.symlink(op.join(CWD, DATA_DIR), op.join(root, 'link'))
+        for job in ({'input': 'in.srt', 'output': 'out.srt'},
+                    {'input': op.join(root, 'in.srt')}):
+            result = csub.serve_job(json.dumps(job), root)
+            self.assertEqual(result['status'], 'ok', job)
+        self.assertTrue(op.exists(op.join(root, 'out.srt')))
+        for job in ({'input': '../root/../in.srt'},
+                    {'input': op.join(CWD, DATA_DIR, 'test_sub_1.srt')},
+                    {'input': 'link/test_sub_1.srt'},
+                    {'input': 'in.srt', 'output': '../out.srt'},
+                    {'text': 'x', 'output': '/tmp/out.srt'}):
+            result = csub.serve_job(json.dumps(job), root)
+            self.assertEqual((result['status'], result['error']),
+                             ('error', 'OptionError'), job)
+        self.assertEqual(os.listdir(self.tmpdir), ['root'])
+
+    def testOptions (self):
+        for args in (['-S', '1'], ['-i', 'x.srt'], ['-t', 'srt'],
+                     ['--serve-root', op.join(self.tmpdir, 'none')]):
+            proc = sbp.run([PYTHON_EXE, PROGFILE, '--serve'] + args,
+                           stdin=sbp.DEVNULL, stderr=sbp.PIPE)
+            self.assertEqual(proc.returncode, 2, args)
+
+    def testInterrupt (self):
+        import signal
+        server = sbp.Popen([PYTHON_EXE, PROGFILE, '--serve'], stdin=sbp.PIPE,
+                           stdout=sbp.PIPE, stderr=sbp.PIPE)
+        try:
+            server.stdin.write(b'{"text": "{1}{2}a\\n"}\n')
+            server.stdin.flush()
+            self.assertIn(b'"ok"', server.stdout.readline())
+            server.send_signal(signal.SIGINT)
+            _, err = server.communicate(timeout=10)
+        finally:
+            server.kill()
+            server.stdin.close()
+            server.stdout.close()
+            server.stderr.close()
+        self.assertEqual(server.returncode, 0)
+        self.assertNotIn(b'Traceback', err)
+
+
+class AnchorsTest (unittest.TestCase):
+
+    SRT = ''.join('{0}\n00:00:{1:02d},000 --> 00:00:{2:02d},000\n'
+                  'line {0}\n\n'.format(n, n * 10, n * 10 + 2)
+                  for n in range(1, 5))
+
+    def testMap (self):
+        for _ in range(50):
+            keys = sorted(random.sample(range(-1000, 10**6), 20))
+            targets = sorted(random.sample(range(-1000, 10**6), 20))
+            pairs = list(zip(keys, targets))
+            random.shuffle(pairs)
+            anchors = csub.AnchorMap(pairs)
+            for units in [random.randint(-10**4, 2 * 10**6)
+                          for _ in range(200)] + keys:
+                if units <= keys[0]:
+                    expected = units - keys[0] + targets[0]
+                elif units >= keys[-1]:
+                    expected = units - keys[-1] + targets[-1]
+                else:
+                    i = next(i for i, k in enumerate(keys) if k > units)
+                    expected = math.floor(
+                        targets[i-1] + Fraction(units - keys[i-1])
+                        * (targets[i] - targets[i-1]) / (keys[i] - keys[i-1])
+                        + Fraction(1, 2))
+                self.assertEqual(anchors.map_units(units), expected)
+        for pairs in (((1, 2), (1, 3)), ((1, 2), (2, 1))):
+            self.assertRaises(ValueError, csub.AnchorMap, pairs)
+        self.assertEqual(csub.AnchorMap().map_units(123), 123)
+
+    def testSrt (self):
+        out = sbp.check_output(
+            [PYTHON_EXE, PROGFILE, '-t', 'srt', '--anchors', '10=11', '30=41'],
+            input=self.SRT, universal_newlines=True)
+        self.assertEqual(re.findall('.* --> .*', out),
+                         ['00:00:11,000 --> 00:00:14,000',
+                          '00:00:26,000 --> 00:00:29,000',
+                          '00:00:41,000 --> 00:00:43,000',
+                          '00:00:51,000 --> 00:00:53,000'])
+        # cue numbers, the same as their start times
+        self.assertEqual(
+            csub.transform(self.SRT, fmt='srt', anchors=['#2=25', '#4=0:50,5']),
+            csub.transform(self.SRT, fmt='srt', anchors=[(20, 25), (40, 50.5)]))
+        # a single anchor is a shift
+        path = op.join(CWD, DATA_DIR, 'test_sub_2.srt')
+        self.assertEqual(
+            csub.transform(pathlib.Path(path), anchors=['#452=1:00:00']),
+            csub.transform(pathlib.Path(path), shift='2134.85'))
+
+    def testOtherTypes (self):
+        path = op.join(CWD, DATA_DIR, 'test_sub_2.ass')
+        self.assertEqual(csub.transform(pathlib.Path(path), anchors=['1=3']),
+                         csub.transform(pathlib.Path(path), shift=2))
+        # frames (25 per second): 0 -> 0, 500 -> 1000
+        sub = ''.join('{{{}}}{{{}}}text\n'.format(n, n + 10)
+                      for n in range(0, 600, 50))
+        self.assertEqual(
+            csub.transform(sub, fmt='sub', anchors=['0=0', '20=40']),
+            ''.join('{{{}}}{{{}}}text\n'.format(*(
+                x * 2 if x <= 500 else x + 500 for x in (n, n + 10)))
+                    for n in range(0, 600, 50)))
+
+    def testErrors (self):
+        for fmt, kwords in (('srt', {'anchors': ['1']}),
+                            ('srt', {'anchors': ['1=2', '1=3']}),
+                            ('srt', {'anchors': ['1=2'], 'shift': 1}),
+                            ('srt', {'anchors': ['1=2'], 'stretch': (1, 1)}),
+                            ('ass', {'anchors': ['#1=2']})):
+            self.assertRaises(csub.OptionError, csub.transform,
+                              self.SRT, fmt=fmt, **kwords)
+        with self.assertRaises(csub.BadFormatError):
+            csub.transform(self.SRT, fmt='srt', anchors=['#2=30', '#3=20'])
+
+
+class SyncTest (TempDirMixin, unittest.TestCase):
+
+    def srt_times (self, text):
+        return [sum(int(x) * m for x, m in zip(t, (3600000, 60000, 1000, 1)))
+                for t in re.findall(r'(\d+):(\d+):(\d+),(\d+)', text)]
+
+    def testEstimate (self):
+        ref = pathlib.Path(CWD, DATA_DIR, 'test_sub_2.srt')
+        path = pathlib.Path(self.tmpdir, 'out.srt')
+        expected = self.srt_times(csub.transform(ref))
+        for shift, framerate in ((-12.5, None), (3.2, (25, 23.976)),
+                                 (0, (24, 25))):
+            csub.transform(ref, path, shift=shift, framerate=framerate)
+            for use_numpy in (True, False):
+                framerate2, shift2, overlap = csub.estimate_sync(
+                    ref, path, use_numpy=use_numpy)
+                self.assertEqual(framerate2, framerate and framerate[::-1])
+                self.assertGreater(overlap, 0.99)
+                times = self.srt_times(csub.transform(
+                    path, shift=shift2, framerate=framerate2))
+                self.assertLessEqual(
+                    max(abs(a - b) for a, b in zip(times, expected)), 2)
+
+    def testOtherTypes (self):
+        # an ass reference, a microdvd subtitle shifted by 38 frames
+        random.seed(1)
+        cues, start = [], 0
+        for _ in range(200):
+            start += random.randint(10, 100) * 4
+            cues.append((start, start + random.randint(25, 75) * 4))
+            start = cues[-1][1]
+        ref = op.join(self.tmpdir, 'ref.ass')
+        sub = op.join(self.tmpdir, 'in.sub')
+        with open(ref, 'w') as f:
+            f.write('[Events]\n' + ''.join(
+                'Dialogue: 0,{},{},Default,,0,0,0,,text\n'.format(*(
+                    '{}:{:02d}:{:02d}.{:02d}'.format(*csub.split_units(t, 100))
+                    for t in cue)) for cue in cues))
+        with open(sub, 'w') as f:
+            f.writelines('{{{}}}{{{}}}text\n'.format(
+                s // 4 + 38, e // 4 + 38) for s, e in cues)
+        out = sbp.check_output(
+            [PYTHON_EXE, PROGFILE, '-i', sub, '--sync-to', ref, '-w'],
+            universal_newlines=True, stderr=sbp.STDOUT)
+        self.assertIn('shift -1.520s, framerate unchanged', out)
+        self.assertEqual(re.findall(r'\{(\d+)\}\{(\d+)\}', out),
+                         [(str(s // 4), str(e // 4)) for s, e in cues])
+
+    def testErrors (self):
+        ref = op.join(CWD, DATA_DIR, 'test_sub_2.srt')
+        for args in (['-S', '1'], ['--anchors', '1=2'], ['--live'],
+                     ['--stretch', '1:0'], ['-s', '1']):
+            proc = sbp.run([PYTHON_EXE, PROGFILE, '-i', ref,
+                            '--sync-to', ref] + args,
+                           stdin=sbp.DEVNULL, stdout=sbp.PIPE, stderr=sbp.PIPE)
+            self.assertEqual(proc.returncode, 2)
+        proc = sbp.run([PYTHON_EXE, PROGFILE, '--sync-to', ref],
+                       stdin=sbp.DEVNULL, stdout=sbp.PIPE, stderr=sbp.PIPE)
+        self.assertEqual(proc.returncode, 2)
+        empty = op.join(self.tmpdir, 'empty.srt')
+        open(empty, 'w').close()
+        self.assertRaises(csub.OptionError, csub.estimate_sync, empty, ref,
+                          fmt='srt')
+        self.assertRaises(csub.OptionError, csub.transform, ref,
+                          sync_to=ref)
+
+
+def read_output (pipe, size, timeout=10):
+    """
+    Read up to *size* bytes from the *pipe* of a running process,
+    returning less if they aren't written within *timeout* seconds.
+    """
+    import select
+    data = b''
+    while len(data) < size:
+        if not select.select([pipe], [], [], timeout)[0]:
+            break
+        chunk = os.read(pipe.fileno(), size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return data
+
+
+class LiveTest (TempDirMixin, unittest.TestCase):
+
+    SRT = ''.join('{0}\n00:00:{0:02d},000 --> 00:00:{0:02d},500\n'
+                  'line {0}\n\n'.format(n) for n in range(1, 6))
+    ASS = '[Events]\n' + ''.join(
+        'Dialogue: 0,0:00:{0:02d}.00,0:00:{0:02d}.50,Default,,0000,0000,'
+        '0000,,line {0}\n'.format(n) for n in range(1, 6))
+
+    def check_live (self, units, expected, args):
+        """
+        Send the *units* of input one at a time to csub --live,
+        checking the output of every one (*expected*) is written
+        before sending the next one.
+        """
+        proc = sbp.Popen([PYTHON_EXE, PROGFILE, '--live'] + args,
+                         stdin=sbp.PIPE, stdout=sbp.PIPE)
+        try:
+            for unit, out in zip(units, expected):
+                proc.stdin.write(unit.encode('utf-8'))
+                proc.stdin.flush()
+                self.assertEqual(
+                    read_output(proc.stdout, len(out.encode('utf-8'))),
+                    out.encode('utf-8'))
+            proc.stdin.close()
+            self.assertEqual(proc.stdout.read(), b'')
+            self.assertEqual(proc.wait(timeout=10), 0)
+        finally:
+            proc.kill()
+            proc.stdout.close()
+
+    def testSrt (self):
+        expected = csub.transform(self.SRT, shift=1)
+        split = lambda text: [block + '\n\n' for block in
+                              text.split('\n\n') if block]
+        for args in (['-S', '1'], ['-t', 'srt', '-S', '1', '-e', 'auto']):
+            self.check_live(split(self.SRT), split(expected), args)
+
+    def testAss (self):
+        expected = csub.transform(self.ASS, shift=1)
+        for args in (['-S', '1'], ['-t', 'ass', '-S', '1']):
+            self.check_live(self.ASS.splitlines(True),
+                            expected.splitlines(True), args)
+
+    def testErrors (self):
+        proc = sbp.run([PYTHON_EXE, PROGFILE, '--live', '-t', 'srt'],
+                       input=self.SRT + 'x\n00:00:0x,000 --> 00:00:01,000\n',
+                       stdout=sbp.PIPE, stderr=sbp.PIPE,
+                       universal_newlines=True)
+        self.assertEqual(proc.returncode, 1)
+        self.assertEqual(proc.stdout, self.SRT)
+        self.assertIn('[at line 21]', proc.stderr)
+        for args in (['-O', 'x.srt'], ['--batch', 'x.srt', '-D', '.'],
+                     ['-t', 'srt', '--stretch', '1:2:3']):
+            proc = sbp.run([PYTHON_EXE, PROGFILE, '--live'] + args,
+                           stdin=sbp.DEVNULL, stderr=sbp.DEVNULL)
+            self.assertEqual(proc.returncode, 2)
+        # unknown type, a usage error as without --live
+        proc = sbp.run([PYTHON_EXE, PROGFILE, '--live', '-S', '1'],
+                       input='garbage\n', stdout=sbp.PIPE, stderr=sbp.PIPE,
+                       universal_newlines=True)
+        self.assertEqual((proc.returncode, proc.stdout), (2, ''))
+        self.assertNotIn('Traceback', proc.stderr)
+        # the output can't be the input
+        path = op.join(self.tmpdir, 'in.srt')
+        with open(path, 'w') as f:
+            f.write(self.SRT)
+        for other in (path, op.join(self.tmpdir, '.', 'in.srt')):
+            for mode in ('--live', '--follow'):
+                proc = sbp.run([PYTHON_EXE, PROGFILE, mode, '-S', '1',
+                                '-i', path, '-o', other],
+                               stdin=sbp.DEVNULL, stderr=sbp.PIPE,
+                               universal_newlines=True)
+                self.assertEqual(proc.returncode, 2, (mode, other))
+                self.assertIn("output to the input file", proc.stderr)
+        with open(path) as f:
+            self.assertEqual(f.read(), self.SRT)
+
+
+class FollowTest (TempDirMixin, unittest.TestCase):
+
+    CUE = '{0}\n00:00:{0:02d},000 --> 00:00:{0:02d},500\nline {0}\n\n'
+
+    def setUp (self):
+        super().setUp()
+        self.path = op.join(self.tmpdir, 'growing.srt')
+
+    def write (self, text, mode='a'):
+        with open(self.path, mode) as f:
+            f.write(text)
+
+    def expected (self, *numbers):
+        return ''.join(csub.transform(self.CUE.format(n), shift=1)
+                       for n in numbers).encode('utf-8')
+
+    def testFollow (self):
+        self.write(self.CUE.format(1) + self.CUE.format(2)[:20], 'w')
+        proc = sbp.Popen([PYTHON_EXE, PROGFILE, '--follow', '-i', self.path,
+                          '-t', 'srt', '-S', '1'], stdout=sbp.PIPE)
+        try:
+            expected = self.expected(1)
+            self.assertEqual(read_output(proc.stdout, len(expected)),
+                             expected)
+            # the rest of the incomplete cue, then a new one
+            self.write(self.CUE.format(2)[20:])
+            self.write(self.CUE.format(3))
+            expected = self.expected(2, 3)
+            self.assertEqual(read_output(proc.stdout, len(expected)),
+                             expected)
+            # truncated, processed from the start
+            self.write(self.CUE.format(4), 'w')
+            expected = self.expected(4)
+            self.assertEqual(read_output(proc.stdout, len(expected)),
+                             expected)
+            # rotated: the rest of the old file, then the new one
+            self.write(self.CUE.format(5))
+            os.rename(self.path, self.path + '.1')
+            self.write(self.CUE.format(6), 'w')
+            expected = self.expected(5, 6)
+            self.assertEqual(read_output(proc.stdout, len(expected)),
+                             expected)
+            self.assertEqual(read_output(proc.stdout, 1, 0.5), b'')
+            self.assertIsNone(proc.poll())
+        finally:
+            proc.kill()
+            proc.wait()
+            proc.stdout.close()
+
+    def testOutputFile (self):
+        out = op.join(self.tmpdir, 'out.srt')
+        def read_file (size):
+            data = b''
+            for _ in range(200):
+                if op.exists(out):
+                    with open(out, 'rb') as f:
+                        data = f.read()
+                    if len(data) >= size:
+                        break
+                time.sleep(0.05)
+            return data
+        self.write(self.CUE.format(1) + self.CUE.format(2), 'w')
+        proc = sbp.Popen([PYTHON_EXE, PROGFILE, '--follow', '-i', self.path,
+                          '-o', out, '-t', 'srt', '-S', '1'])
+        try:
+            # the BOM of utf-8-sig, only once: truncated, then rotated
+            expected = '\ufeff'.encode('utf-8') + self.expected(1, 2)
+            self.assertEqual(read_file(len(expected)), expected)
+            self.write(self.CUE.format(3), 'w')
+            expected += self.expected(3)
+            self.assertEqual(read_file(len(expected)), expected)
+            os.rename(self.path, self.path + '.1')
+            self.write(self.CUE.format(4), 'w')
+            expected += self.expected(4)
+            self.assertEqual(read_file(len(expected)), expected)
+            time.sleep(0.5)
+            with open(out, 'rb') as f:
+                self.assertEqual(f.read(), expected)
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def testWatcher (self):
+        self.write('', 'w')
+        watcher = csub.FileWatcher(self.path)
+        try:
+            start = time.monotonic()
+            watcher.wait(0.1)
+            self.assertGreaterEqual(time.monotonic() - start, 0.09)
+            if watcher.fd is not None:
+                self.write('x')
+                start = time.monotonic()
+                watcher.wait(10)
+                self.assertLess(time.monotonic() - start, 5)
+        finally:
+            watcher.close()
+
+    def testErrors (self):
+        for args in (['--follow'], ['--follow', '-O', self.path]):
+            proc = sbp.run([PYTHON_EXE, PROGFILE] + args,
+                           stdin=sbp.DEVNULL, stderr=sbp.DEVNULL)
+            self.assertEqual(proc.returncode, 2)
+        self.write('x\n00:00:0x,000 --> 00:00:01,000\n\n', 'w')
+        proc = sbp.run([PYTHON_EXE, PROGFILE, '--follow', '-t', 'srt',
+                        '-i', self.path], stderr=sbp.PIPE, timeout=10)
+        self.assertEqual(proc.returncode, 1)
+
+
+class RecursiveTest (TempDirMixin, unittest.TestCase):
+
+    def setUp (self):
+        super().setUp()
+        self.indir = op.join(self.tmpdir, 'in')
+        self.outdir = op.join(self.tmpdir, 'out')
+        os.mkdir(self.indir)
+        os.mkdir(self.outdir)
+        self.subs = []
+        for n, sub in enumerate(
+            gglob(op.join(CWD, DATA_DIR, 'test*.[sa][rus][tsb]'))):
+            subdir = op.join(self.indir, *(['d{}'.format(n)] * (n % 3)))
+            os.makedirs(subdir, exist_ok=True)
+            shutil.copy(sub, subdir)
+            self.subs.append(op.relpath(
+                op.join(subdir, op.basename(sub)), self.indir))
+        with open(op.join(self.indir, 'README.txt'), 'w') as f:
+            f.write('not a subtitle')
+
+    def run_csub (self, *args):
+        cmdline = [PYTHON_EXE, PROGFILE, '-R', self.indir,
+                   '-D', self.outdir] + list(args)
+        pipe = sbp.Popen(cmdline, stdout=sbp.PIPE, stderr=sbp.PIPE)
+        pipe.communicate()
+        self.assertEqual(pipe.returncode, 0, cmdline)
+
+    def mtimes (self):
+        return dict((s, os.stat(op.join(self.outdir, s)).st_mtime_ns)
+                    for s in self.subs)
+
+    def testMirrorAndSkip (self):
+        self.run_csub('-S', '1')
+        self.assertFalse(op.exists(op.join(self.outdir, 'README.txt')))
+        for sub in self.subs:
+            ext = op.splitext(sub)[1][1:]
+            with tempfile.NamedTemporaryFile() as ref:
+                cmd = [PYTHON_EXE, PROGFILE, '-t', ext, '-S', '1',
+                       '-i', op.join(self.indir, sub), '-o', ref.name]
+                self.assertEqual(sbp.call(cmd), 0)
+                with open(op.join(self.outdir, sub), 'rb') as out:
+                    self.assertEqual(ref.read(), out.read(), sub)
+        first = self.mtimes()
+        # nothing changed, nothing to do
+        self.run_csub('-S', '1')
+        self.assertEqual(first, self.mtimes())
+        # changed input
+        os.utime(op.join(self.indir, self.subs[0]))
+        self.run_csub('-S', '1')
+        second = self.mtimes()
+        self.assertNotEqual(first[self.subs[0]], second[self.subs[0]])
+        for sub in self.subs[1:]:
+            self.assertEqual(first[sub], second[sub])
+        # changed options
+        self.run_csub('-S', '2')
+        third = self.mtimes()
+        for sub in self.subs:
+            self.assertNotEqual(second[sub], third[sub])
+
+    def testTypeFilter (self):
+        self.run_csub('-t', 'srt')
+        for sub in self.subs:
+            self.assertEqual(op.exists(op.join(self.outdir, sub)),
+                             sub.endswith('.srt'), sub)
+
+
 class MicroDVDFIleTest (unittest.TestCase):
     """Test operation on microDVD files. """
     def testOkMicroDvdSub (self):
@@ -453,6 +1458,27 @@ class SrtFileTest (unittest.TestCase):
             newsub = csub.SrtSub(sub1, sub2)
             self.assertRaises(csub.IndexNumError, newsub.main)
 
+    def testBlocks (self):
+        block = '1\n00:00:01,000 --> 00:00:02,000\n'
+        for sub, is_block in ((block, True), ('1\n', True),
+                              (block + 'text  \n', False),
+                              (block + 'text\n\n', False)):
+            out = io.StringIO()
+            newsub = csub.SrtSub(io.StringIO(sub), out)
+            newsub.main()
+            self.assertEqual(out.getvalue(),
+                             '\n'.join(map(str.rstrip, sub.split('\n'))))
+            self.assertEqual(newsub.IS_BLOCK, is_block)
+            self.assertEqual(newsub.actual_numline, sub.count('\n'))
+        for sub, error, numline in (
+                (block + 'a\nb\n\nx\n', csub.IndexNumError, 6),
+                (block + 'a\n\n\n', csub.IndexNumError, 5),
+                (block + '\n2\n00:00:01 --> 00:00:02\n',
+                 csub.MismatchTimeError, 5)):
+            newsub = csub.SrtSub(io.StringIO(sub), io.StringIO())
+            self.assertRaises(error, newsub.main)
+            self.assertEqual(newsub.actual_numline, numline)
+
     def testProgressiveNumbers (self):
         start = random.randint(-111, 111)
         sub = csub.SrtSub(
@@ -646,6 +1672,56 @@ class SrtTimeTransformTest (unittest.TestCase):
                                  "failed on {!r}".format(strtime))
 
 
+    def testUnits (self):
+        for sub in (csub.SrtSub(None, None), csub.AssSub(None, None)):
+            for _ in range(1000):
+                units = random.randint(-10**9, 10**9)
+                h, m, s, u = sub.times_from_units(units)
+                self.assertTrue(0 <= u < sub.UNITS)
+                self.assertTrue(0 <= s < 60 and 0 <= m < 60)
+                self.assertEqual(sub.new_units(h, m, s, u), units)
+        # exact round trip changing framerate (no float drift)
+        for old, new in ((23.976, 25), (24, 29.97), (25, 25)):
+            self.subs.change_framerate(old, new)
+            back = csub.SrtSub(None, None)
+            back.change_framerate(new, old)
+            for _ in range(1000):
+                t = [random.randint(0, x) for x in (5, 59, 59, 999)]
+                units = back.new_units(*self.subs.times_from_units(
+                    self.subs.new_units(*t)))
+                self.assertEqual(self.subs.times_from_units(units), tuple(t))
+
+    def testTimeMap (self):
+        # the compiled map is the same as applying the options in turn,
+        # whatever the order they are set
+        for sub in (csub.SrtSub(None, None), csub.AssSub(None, None)):
+            for _ in range(200):
+                old, new = random.choice(((25, 25), (23.976, 25), (30, 24)))
+                delta = [random.randint(-2, 2) for _ in range(3)]
+                delta.append(random.randint(-999, 999))
+                stretch = [random.randint(-1000, 1000) for _ in 'LR']
+                sub.set_delta(*delta)
+                sub.change_framerate(old, new)
+                sub.stretch = stretch
+                ratio = Fraction(str(new)) / Fraction(str(old))
+                delta = (((delta[0] * 60 + delta[1]) * 60 + delta[2])
+                         * sub.UNITS + delta[3])
+                for _ in range(10):
+                    units = random.randint(0, 10**8)
+                    for offset, extra in ((sub.time_offset, 0),
+                                          (sub.start_offset, stretch[0]),
+                                          (sub.end_offset, stretch[1])):
+                        self.assertEqual(
+                            sub.map_units(units, offset),
+                            math.floor(ratio * (units + delta + extra)
+                                       + Fraction(1, 2)))
+                sub.change_framerate(1, 1)
+                sub.stretch = 0, 0
+                sub.set_delta()
+                self.assertEqual((sub.time_mul, sub.time_div,
+                                  sub.start_offset), (1, 1, 0))
+
+
 class AssFileTest (unittest.TestCase):
 
     def testAssTimeTransform (self):
@@ -745,6 +1821,129 @@ class AssFileTest (unittest.TestCase):
         self.assertEqual(sub_in.read(), sub_out.read())        
 
 
+class NumpyTest (unittest.TestCase):
+
+    def setUp (self):
+        if csub.load_numpy() is None:
+            self.skipTest('NumPy not available')
+        self.subs = [(csub.SrtSub, s) for s in (
+            SRT_FAKESUB_0, SRT_FAKESUB_1, SRT_FAKESUB_2, SRT_FAKESUB_POSITION,
+            SRT_FAKESUB_3_FAIL_TIME, SRT_FAKESUB_6_FAIL_INDEX)]
+        self.subs.extend((csub.AssSub, s) for s in (
+            ASS_FAKESUB_1, ASS_FAKESUB_2_OK_MISC, ASS_FAKESUB_3_FAIL_TIME))
+        self.subs.extend((csub.MicroDVD, s) for s in (
+            MICRODVD_FAKESUB_0, MICRODVD_FAKESUB_1,
+            MICRODVD_FAKESUB_FAIL_SYNTAX_6))
+        for file in gglob(op.join(CWD, DATA_DIR, '*.[sa][rus][tsb]')):
+            cls = {'.srt': csub.SrtSub, '.ass': csub.AssSub,
+                   '.sub': csub.MicroDVD}[op.splitext(file)[1]]
+            with open(file, encoding='utf-8-sig', errors='replace') as f:
+                self.subs.append((cls, f.read()))
+
+    def run_sub (self, cls, sub, use_numpy, unsafe, delta, stretch, rng, fr):
+        outfile = io.StringIO()
+        inst = cls(io.StringIO(sub), outfile, unsafe_time_mode=unsafe)
+        inst.set_delta(*delta)
+        inst.stretch = stretch
+        inst.set_subs_range(*rng)
+        if fr:
+            inst.change_framerate(*fr)
+        inst.use_numpy = use_numpy
+        try:
+            inst.main()
+        except csub.BadFormatError as e:
+            return e.__class__, inst.actual_numline
+        return outfile.getvalue(), inst.IS_BLOCK
+
+    def testSameOutput (self):
+        _r = random.randint
+        for cls, sub in self.subs:
+            for i in range(20):
+                args = (random.choice((True, False)),
+                        [_r(0, 2), _r(-30, 30), _r(-50, 50), _r(-999, 999),
+                         _r(-3, 3)],
+                        [_r(-3000, 3000) for _ in 'LR'],
+                        random.choice(((None, None), (3, None), (None, 50),
+                                       (_r(0, 1000), _r(1000, 5000)))),
+                        random.choice((None, (23.976, 25), (25, 29.97))))
+                self.assertEqual(self.run_sub(cls, sub, False, *args),
+                                 self.run_sub(cls, sub, True, *args),
+                                 (cls, args))
+
+    def testFallback (self):
+        numpy, csub.numpy = csub.numpy, None
+        try:
+            for cls, sub in self.subs:
+                args = (False, [0, 1, 2, 3, 0], [0, 0], (None, None), None)
+                self.assertEqual(self.run_sub(cls, sub, False, *args),
+                                 self.run_sub(cls, sub, True, *args))
+        finally:
+            csub.numpy = numpy
+
+
+class CueTest (unittest.TestCase):
+
+    def read_cues (self, cls, sub, encoding='utf-8'):
+        return list(cls.iter_cues(io.BytesIO(sub.encode(encoding)), encoding))
+
+    def testRoundTrip (self):
+        for cls, sub in ((csub.SrtSub, SRT_FAKESUB_1),
+                         (csub.SrtSub, SRT_FAKESUB_POSITION),
+                         (csub.MicroDVD, MICRODVD_FAKESUB_1)):
+            out = io.BytesIO()
+            cls.write_cues(out, self.read_cues(cls, sub))
+            self.assertEqual(out.getvalue().decode().strip(), sub.strip())
+        events = [line for line in ASS_FAKESUB_1.splitlines()
+                  if line.startswith('Dialogue:')]
+        out = io.BytesIO()
+        csub.AssSub.write_cues(out, self.read_cues(csub.AssSub, ASS_FAKESUB_1))
+        self.assertEqual(out.getvalue().decode().splitlines(), events)
+
+    def testNegativeTimes (self):
+        for cls, cue in ((csub.SrtSub, csub.SrtCue(1, -1, 1000, b'a')),
+                         (csub.SrtSub, csub.SrtCue(1, 0, -1000, b'a')),
+                         (csub.AssSub, csub.AssEvent(-1, 100, b'a')),
+                         (csub.AssSub, csub.AssEvent(0, -100, b'a'))):
+            self.assertRaises(csub.BadFormatError,
+                              cls.write_cues, io.BytesIO(), [cue])
+
+    def testLazyText (self):
+        for file in gglob(op.join(CWD, DATA_DIR, '_enc_*.srt')):
+            encoding = op.basename(file)[5:-4]
+            if encoding == 'ISO-2022-JP':
+                continue # not ASCII-compatible
+            with open(file, 'rb') as f:
+                cues = list(csub.SrtSub.iter_cues(f, encoding))
+            with open(file, encoding=encoding) as f:
+                text = f.read()
+            self.assertTrue(cues)
+            for cue in cues:
+                self.assertIsNone(cue._text)
+                self.assertIn(cue.text, text)
+        cue = csub.SrtCue(1, 0, 1500, b'foo', 'utf-8')
+        cue.text = 'b\u00e0r'
+        self.assertEqual(cue.raw, 'b\u00e0r'.encode())
+        self.assertFalse(hasattr(cue, '__dict__'))
+
+    def testCueTimes (self):
+        cue = self.read_cues(csub.SrtSub, '1\n01:02:03,456 --> 01:02:04,000\nx\n')[0]
+        self.assertEqual((cue.index, cue.start, cue.end), (1, 3723456, 3724000))
+        cue = self.read_cues(csub.AssSub,
+            'Dialogue: 0,1:02:03:45,1:02:04.00,Default,,0,0,0,,a, b\n')[0]
+        self.assertEqual((cue.start, cue.end, cue.seps, cue.text),
+                         (372345, 372400, (b':', b'.'), 'a, b'))
+
+    def testCueErrors (self):
+        for cls, sub, error in (
+                (csub.SrtSub, SRT_FAKESUB_3_FAIL_TIME, csub.MismatchTimeError),
+                (csub.SrtSub, SRT_FAKESUB_6_FAIL_INDEX, csub.IndexNumError),
+                (csub.SrtSub, '1\n', csub.MismatchTimeError),
+                (csub.AssSub, ASS_FAKESUB_3_FAIL_TIME, csub.MismatchTimeError),
+                (csub.MicroDVD, MICRODVD_FAKESUB_FAIL_SYNTAX_6,
+                 csub.MismatchTimeError)):
+            self.assertRaises(error, self.read_cues, cls, sub)
+
+
 class MiscTest (unittest.TestCase):
     def testClose(self):
         to_close = [open(file) for file in
@@ -757,6 +1956,67 @@ class MiscTest (unittest.TestCase):
         for file in no_close:
             self.assertFalse(file.closed)
 
+    def testChunkWriter(self):
+        class Output(io.StringIO):
+            writes = flushes = 0
+            def write(self, text):
+                self.writes += 1
+                return super().write(text)
+            def flush(self):
+                self.flushes += 1
+        def lines(n, error=None):
+            for i in range(n):
+                yield '{}\n'.format(i)
+            if error:
+                raise error
+        out = Output()
+        writer = csub.ChunkWriter(out, 100)
+        writer.writelines(lines(1000))
+        writer.write('end\n')
+        self.assertLess(out.writes, 50)
+        writer.flush()
+        self.assertEqual(out.getvalue(), ''.join(lines(1000)) + 'end\n')
+        out = Output()
+        writer = csub.ChunkWriter(out, 0)
+        writer.writelines(lines(10))
+        self.assertEqual((out.writes, out.flushes), (10, 10))
+        out = Output()
+        writer = csub.ChunkWriter(out)
+        with self.assertRaises(csub.TailCopy):
+            writer.writelines(lines(10, csub.TailCopy))
+        writer.flush()
+        self.assertEqual(out.getvalue(), ''.join(lines(10)))
+
+    def testTimeTables(self):
+        _r = random.randint
+        times = [(0, 0, 0, 0), (99, 59, 59, 999), (100, 1, 2, 3),
+                 (1234, 0, 0, 5), (-1, 59, 59, 999), (-100, 0, 0, 0)]
+        times.extend((_r(-200, 200), _r(0, 59), _r(0, 59), _r(0, 999))
+                     for _ in range(1000))
+        for h, m, s, ms in times:
+            self.assertEqual(csub.srt_time(h, m, s, ms),
+                             '{:02d}:{:02d}:{:02d},{:03d}'.format(h, m, s, ms))
+            for sep in ('.', ','):
+                self.assertEqual(
+                    csub.ass_time(h, m, s, ms // 10, sep),
+                    '{:d}:{:02d}:{:02d}{}{:02d}'.format(h, m, s, sep, ms // 10))
+        mdvd = csub.MicroDVD(None, None)
+        for start, end in ((-0.4, 0.5), (1.5, 2.5), (-2.5, 3), (1e20, 7.0)):
+            self.assertEqual(mdvd.format_line(start, end, 'text'),
+                             mdvd.OUTPUT_LINE_FORMAT.format(
+                                 start=start, end=end, rest='text'))
+
+    def testLazyImports(self):
+        # modules not needed by the library classes (see load_numpy)
+        lazy = ('argparse', 'concurrent.futures', 'datetime', 'glob',
+                'hashlib', 'json', 'numpy', 'signal', 'string', 'tempfile')
+        code = ('import sys, csub; sub = csub.SrtSub(None, None); '
+                'print(" ".join(m for m in {!r} if m in sys.modules))')
+        out = sbp.check_output([PYTHON_EXE, '-c', code.format(lazy)],
+                               cwd=op.dirname(PROGFILE),
+                               universal_newlines=True)
+        self.assertEqual(out.split(), [])
+
     def testSkip(self):
         _r = random.randint
         for file in gglob(op.join(CWD, DATA_DIR, '[a-z]*.srt')):
@@ -826,6 +2086,75 @@ class MiscTest (unittest.TestCase):
                 self.assertRaises(csub.IndexNumError, inst.main)
             os.remove(_out)
                                
+    def testSniffType(self):
+        subs = (('srt', SRT_FAKESUB_0), ('srt', SRT_FAKESUB_2),
+                ('ass', ASS_FAKESUB_1), ('sub', MICRODVD_FAKESUB_0))
+        for subtype, sub in subs:
+            found, lines = csub.sniff_type(io.StringIO(sub))
+            self.assertEqual(found, subtype)
+            self.assertEqual(''.join(lines), sub)
+        for file in gglob(op.join(CWD, DATA_DIR, 'test*.[sa][rus][tsb]')):
+            with open(file, encoding='utf-8-sig') as f:
+                found, lines = csub.sniff_type(f)
+                self.assertEqual(found, op.splitext(file)[1][1:])
+        text = 'foo\n' * (csub.SNIFF_LINES * 2) + SRT_FAKESUB_0
+        found, lines = csub.sniff_type(io.StringIO(text))
+        self.assertIsNone(found)
+        self.assertEqual(''.join(lines), text)
+
+    def testSniffTypeCmdLine(self):
+        for file in gglob(op.join(CWD, DATA_DIR, 'test*.[sa][rus][tsb]')):
+            subtype = op.splitext(file)[1][1:]
+            outs = []
+            for opt in ([], ['-t', subtype]):
+                with open(file, 'rb') as f:
+                    pipe = sbp.Popen([PYTHON_EXE, PROGFILE, '-S', '7'] + opt,
+                                     stdin=sbp.PIPE, stdout=sbp.PIPE)
+                    outs.append(pipe.communicate(f.read())[0])
+                    self.assertEqual(pipe.returncode, 0, (file, opt))
+            self.assertEqual(*outs)
+        pipe = sbp.Popen([PYTHON_EXE, PROGFILE, '-S', '7'],
+                         stdin=sbp.PIPE, stdout=sbp.PIPE, stderr=sbp.PIPE)
+        pipe.communicate(b'foo\nbar\n')
+        self.assertNotEqual(pipe.returncode, 0)
+
+    def testDetectEncoding(self):
+        for file in gglob(op.join(CWD, DATA_DIR, '_enc_*.srt')):
+            enc = ENC_FILE.match(op.basename(file)).group(1)
+            with open(file, 'rb') as f:
+                data = f.read()
+            found = csub.detect_encoding(data[:csub.ENCODING_SAMPLE])
+            self.assertEqual(data.decode(enc), data.decode(found), file)
+            # truncated multibyte sequences at the end of the sample
+            for size in range(len(data) // 2, len(data) // 2 + 4):
+                found = csub.detect_encoding(data[:size])
+                self.assertEqual(data.decode(enc), data.decode(found), file)
+        self.assertRaises(LookupError, csub.detect_encoding,
+                          b'\xfd\xfc\xfb', ('utf-8', 'us-ascii'))
+
+    def testAutoEncodingCmdLine(self):
+        cmdline = "{exe} {prog} -t srt -e auto"
+        for file in gglob(op.join(CWD, DATA_DIR, '_enc_*.srt')):
+            with open(file, 'rb') as f:
+                orig = f.read()
+            with tempfile.NamedTemporaryFile() as fout:
+                cmd = shlex.split(cmdline.format(exe=PYTHON_EXE, prog=PROGFILE))
+                self.assertEqual(
+                    sbp.call(cmd + ['-i', file, '-o', fout.name]), 0, cmd)
+                self.assertEqual(fout.read(), orig, file)
+                # from stdin
+                pipe = sbp.Popen(cmd + ['-o', fout.name], stdin=sbp.PIPE)
+                pipe.communicate(orig)
+                self.assertEqual(pipe.returncode, 0, cmd)
+                fout.seek(0)
+                self.assertEqual(fout.read(), orig, file)
+            # to stdout, the same encoding too
+            for args in ([], ['--live']):
+                proc = sbp.run(cmd + args + ['-i', file], stdout=sbp.PIPE,
+                               env=dict(os.environ, PYTHONIOENCODING='ascii'))
+                self.assertEqual(proc.returncode, 0, cmd + args)
+                self.assertEqual(proc.stdout, orig, file)
+
     def testLookupEncoding(self):
         fake_encs = ['us-asciiuga', 'utf-otto', 'foo-bar-baz']
         files = gglob(op.join(CWD, DATA_DIR, '_enc_*.srt'))
@@ -909,7 +2238,10 @@ def load_tests():
     loader = unittest.TestLoader()
     test_cases = (SrtFileTest, SrtReTest, SrtTimeTransformTest,
                   TempFileTest, AssFileTest, MicroDVDFIleTest,
-                  MiscTest, TestCommandLine)
+                  MiscTest, TestCommandLine, BatchTest,
+                  RecursiveTest, NumpyTest, CueTest, IndexTest,
+                  TailCopyTest, TransformTest, StreamTest, ServeTest,
+                  LiveTest, FollowTest, AnchorsTest, SyncTest)
     return (loader.loadTestsFromTestCase(t) for t in test_cases)
 
 